@@ -2,7 +2,7 @@
 
 __version__ = '0.2'
 from .exceptions import abort
-from .app import Cocopot
+from .app import Cocopot, url_for, parallel
 from .request import Request
 from .response import Response, make_response, redirect, jsonify
 from .globals import current_app, g, request, _request_ctx_stack
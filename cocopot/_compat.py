@@ -68,3 +68,22 @@ def to_unicode(s, enc='utf8', err='strict'):
         return text_type(s)
 
 to_native = to_bytes if PY2 else to_unicode
+
+try:
+    from inspect import isawaitable
+except ImportError:  # Python < 3.5, there is nothing to await
+    def isawaitable(obj):
+        return False
+
+try:
+    from inspect import markcoroutinefunction
+except ImportError:  # Python < 3.12
+    def markcoroutinefunction(func):
+        """Make `asyncio.iscoroutinefunction` true for `func`, a plain
+        function returning a coroutine."""
+        try:
+            from asyncio.coroutines import _is_coroutine
+        except ImportError:  # Python < 3.5, there is nothing to await
+            return func
+        func._is_coroutine = _is_coroutine
+        return func
@@ -6,18 +6,21 @@
 import os
 import sys
 from datetime import timedelta
-import traceback
 from itertools import chain
 from functools import update_wrapper
 from logging import getLogger, StreamHandler, Formatter, getLoggerClass, DEBUG, INFO, NOTSET
 
 from .routing import Router
-from .exceptions import HTTPException, InternalServerError, MethodNotAllowed, BadRequest, RequestRedirect
+from .stats import RouteStats, timer
+from .reporting import ExceptionReporter
+from .exceptions import HTTPException, InternalServerError, MethodNotAllowed, BadRequest, RequestRedirect, \
+    RequestEntityTooLarge
 
 from .request import Request
 from .response import Response, make_response
 from .globals import _request_ctx_stack, request, g
-from ._compat import reraise, string_types, text_type, integer_types, to_bytes, to_unicode
+from ._compat import reraise, string_types, text_type, integer_types, to_bytes, to_unicode, isawaitable, \
+    markcoroutinefunction
 
 class RequestContextGlobals(object):
     """A plain object."""
@@ -49,6 +52,11 @@ class RequestContext(object):
         self.environ = environ
         self.request = request
         self.g = RequestContextGlobals()
+        #: futures submitted to `Cocopot.executor` during the request
+        self.futures = None
+        #: set for ASGI requests, whose hooks hand back an awaitable instead
+        #: of running a coroutine to completion, see `Cocopot._then`
+        self.asgi = False
         for k, v in kwargs.items():
             setattr(self.g, k, v)
 
@@ -62,6 +70,10 @@ class RequestContext(object):
         rv = _request_ctx_stack.pop()
         assert rv is self, 'Popped wrong request context.  (%r instead of %r)' \
             % (rv, self)
+        if self.futures:
+            for future in self.futures:
+                future.cancel()
+            self.futures = None
         rv.request.__exit__(None, None, None)
 
     def __enter__(self):
@@ -71,6 +83,57 @@ class RequestContext(object):
     def __exit__(self, exc_type, exc_value, tb):
         self.pop(exc_value)
 
+def url_for(endpoint, **values):
+    """Generates an URL to the given endpoint with the arguments provided,
+    using the router of the current application.  Arguments that are not part
+    of the rule are appended as query string.
+
+    Endpoints starting with a dot are relative to the blueprint of the current
+    request, so `.index` in a view of the `admin` blueprint builds the URL of
+    `admin.index`.
+
+    Args:
+
+      * endpoint: the endpoint of the URL (name of the function)
+      * values: the variable arguments of the URL rule
+      * _external: if set to `True`, an absolute URL including the host
+                   of the current request is generated.
+    """
+    ctx = _request_ctx_stack.top
+    if ctx is None:
+        raise RuntimeError('working outside of request context')
+    if endpoint[:1] == '.':
+        blueprint = ctx.request.blueprint
+        endpoint = blueprint + endpoint if blueprint else endpoint[1:]
+    external = values.pop('_external', False)
+    rv = ctx.request.script_root + ctx.app.router.build(endpoint, **values)
+    if external:
+        rv = ctx.request.host_url.rstrip('/') + rv
+    return rv
+
+
+def parallel(*funcs, **kwargs):
+    """Calls the functions given concurrently in the `Cocopot.executor` of
+    the current application and returns their results in the same order.
+    The functions run with the current request context.  The first
+    exception raised by one of them is raised again.
+
+        user, feed = parallel(load_user, load_feed)
+
+    Args:
+
+      * funcs: the functions to call without arguments
+      * timeout: the seconds to wait for each result, unlimited by default
+    """
+    timeout = kwargs.pop('timeout', None)
+    ctx = _request_ctx_stack.top
+    if ctx is None:
+        raise RuntimeError('working outside of request context')
+    submit = ctx.app.executor.submit
+    futures = [submit(func) for func in funcs]
+    return [future.result(timeout) for future in futures]
+
+
 class Cocopot(object):
     """The cocopot object implements a WSGI application and acts as the central
     object.  Once it is created it will act as a central registry for
@@ -86,6 +149,9 @@ class Cocopot(object):
 
     debug = False
 
+    #: The number of threads of the `executor`.
+    executor_max_workers = 16
+
     log_format = '%(message)s'
 
 
@@ -109,6 +175,16 @@ class Cocopot(object):
         #:
         self.error_handler_spec = {None: {}}
 
+        #: The error handlers `error_handler_spec` resolves to, keyed by
+        #: (blueprint, status code) for HTTP exceptions and by (blueprint,
+        #: exception class) otherwise.  Cleared whenever an error handler is
+        #: registered.
+        self.error_handler_cache = {}
+
+        #: A dictionary of endpoint -> dict of the request body options given
+        #: to `add_url_rule`, see `body_limits`.
+        self.body_options = {}
+
         #: A dictionary with lists of functions that should be called at the
         #: beginning of the request.  The key of the dictionary is the name of
         #: the blueprint this function is active for, `None` for all requests.
@@ -124,6 +200,11 @@ class Cocopot(object):
         self.after_request_funcs = {}
         self.teardown_request_funcs = {}
 
+        #: A dictionary of endpoint -> (before, after, teardown) tuples of the
+        #: functions above that run for requests of the endpoint, built by
+        #: `freeze`.  `None` until the first request.
+        self.request_hooks = None
+
         #: all the attached blueprints in a dictionary by name.  Blueprints
         #: can be attached multiple times so this dictionary does not tell
         #: you how often they got attached.
@@ -131,8 +212,22 @@ class Cocopot(object):
 
         self.router = Router()
 
+        #: The `~cocopot.stats.RouteStats` requests are recorded in, `None`
+        #: unless `enable_route_stats` was called.
+        self.stats = None
+
         self.logger = self.create_logger()
 
+        #: The `~cocopot.reporting.ExceptionReporter` unexpected exceptions
+        #: are logged with, it rate limits the records per exception class.
+        self.exception_reporter = ExceptionReporter(self.logger)
+
+        self._executor = None
+
+        #: The `~cocopot.asgi.ASGIHandler` behind `asgi_app`, created on the
+        #: first ASGI request.  Assign one to change its thread pool size.
+        self.asgi_handler = None
+
     def create_logger(self):
         """Creates a logger for the given application.  This logger works
         similar to a regular Python logger but changes the effective logging
@@ -167,7 +262,7 @@ class Cocopot(object):
         return self.import_name
 
 
-    def run(self, host=None, port=None, debug=True, **options):
+    def run(self, host=None, port=None, debug=True, workers=1, **options):
         """Runs the application on a local development server.
         Args:
 
@@ -177,6 +272,11 @@ class Cocopot(object):
           * port: the port of the webserver. Defaults to 5000 or the
                      port defined in the SERVER_NAME` config variable if
                      present.
+          * workers: the number of processes serving requests, forked
+                     after the application is loaded.
+          * options: passed to `cocopot.run.run_simple`, for example
+                     `threaded=True` or `pool_size=16` to serve requests
+                     in a pool of worker threads.
         """
         from cocopot.run import run_simple
         if host is None:
@@ -185,7 +285,46 @@ class Cocopot(object):
             port = 3000
         if debug is not None:
             self.debug = bool(debug)
-        run_simple(host, port, self, **options)
+        self.freeze()
+        run_simple(host, port, self, processes=workers, **options)
+
+    @property
+    def executor(self):
+        """The `~cocopot.executor.RequestExecutor` of the application, a
+        pool of `executor_max_workers` threads running functions with the
+        request context they were submitted from:
+
+            future = app.executor.submit(load_feed, user_id)
+            ...
+            feed = future.result()
+
+        Futures of a request that did not start yet are cancelled when it
+        ends.  See also `cocopot.parallel`.
+        """
+        executor = self._executor
+        if executor is None:
+            from .executor import RequestExecutor
+            executor = self._executor = RequestExecutor(self.executor_max_workers)
+        return executor
+
+    def enable_route_stats(self, **options):
+        """Start recording the request count, the status code classes and
+        a latency histogram per endpoint.  The options are passed to
+        `~cocopot.stats.RouteStats`.  Read the numbers with `route_stats`.
+        """
+        self.stats = RouteStats(**options)
+
+    def route_stats(self):
+        """Returns the statistics recorded since `enable_route_stats` as dict
+        of endpoint -> stats, see `~cocopot.stats.RouteStats.snapshot`.
+        Every endpoint with a view function is included, endpoints without
+        requests have a count of 0.  Requests that did not match any route
+        are reported under `None`.
+        """
+        if self.stats is None:
+            raise RuntimeError('Route stats are not enabled, call '
+                               'enable_route_stats() first.')
+        return self.stats.snapshot(self.view_functions)
 
     def register_blueprint(self, blueprint, **options):
         """Registers a blueprint on the application.
@@ -199,6 +338,7 @@ class Cocopot(object):
         else:
             self.blueprints[blueprint.name] = blueprint
         blueprint.register(self, options)
+        self.request_hooks = None
 
     def add_url_rule(self, rule, endpoint=None, view_func=None, methods=None, **options):
         """Connects a URL rule.  Works exactly like the `route`
@@ -236,7 +376,9 @@ class Cocopot(object):
           * view_func: the function to call when serving a request to the
                     provided endpoint
           * options: methods is a list of methods this rule should be limited
-                    to (`GET`, `POST` etc.).
+                    to (`GET`, `POST` etc.).  `body_spool_size` and
+                    `max_content_length` override the application config for
+                    request bodies of the endpoint, see `body_limits`.
         """
         if endpoint is None:
             endpoint = view_func.__name__
@@ -254,9 +396,16 @@ class Cocopot(object):
         # Add the required methods now.
         methods |= required_methods
 
+        # A rule answering GET answers HEAD too, the response drops the body.
+        if 'GET' in methods:
+            methods.add('HEAD')
+
         defaults = options.get('defaults') or {}
 
         self.router.add(rule, endpoint, methods=methods, defaults=defaults)
+        for key in ('body_spool_size', 'max_content_length'):
+            if key in options:
+                self.body_options.setdefault(endpoint, {})[key] = options[key]
         if view_func is not None:
             old_func = self.view_functions.get(endpoint)
             if old_func is not None and old_func != view_func:
@@ -264,6 +413,33 @@ class Cocopot(object):
                                      'existing endpoint function: %s' % endpoint)
             self.view_functions[endpoint] = view_func
 
+    def body_limits(self, request):
+        """Returns the size above which the body of `request` is spooled to
+        a temporary file and the largest body accepted (`None` for no
+        limit).  The options given to `add_url_rule` for the endpoint win
+        over the `body_spool_size` and `max_content_length` keys of
+        `config`, which win over the attributes of the request class.
+        """
+        options = self.body_options.get(request.endpoint) or {}
+        config = self.config
+        return (options.get('body_spool_size',
+                            config.get('body_spool_size', request.body_spool_size)),
+                options.get('max_content_length',
+                            config.get('max_content_length', request.max_content_length)))
+
+    def check_content_length(self, request):
+        """Raises `RequestEntityTooLarge` if the `Content-Length` of
+        `request` is above its maximum content length, see `body_limits`.
+        It is called once the request is matched, before the request hooks
+        and the view, so a body that is too large is never read.  Chunked
+        bodies are counted while they are read.
+        """
+        length = request.environ.get('CONTENT_LENGTH')
+        if length and length != '0':
+            max_length = self.body_limits(request)[1]
+            if max_length is not None and request.content_length > max_length:
+                raise RequestEntityTooLarge()
+
     def route(self, rule, **options):
         """A decorator that is used to register a view function for a
         given URL rule.  This does the same thing as `add_url_rule`
@@ -327,8 +503,9 @@ class Cocopot(object):
             app.error_handler_spec[None][404] = page_not_found
 
         Setting error handlers via assignments to `error_handler_spec`
-        however is discouraged as it requires fiddling with nested dictionaries
-        and the special case for arbitrary exception types.
+        however is discouraged as it requires fiddling with nested dictionaries,
+        the special case for arbitrary exception types and clearing the
+        `error_handler_cache`.
 
         The first `None` refers to the active blueprint.  If the error
         handler should be application wide `None` shall be used.
@@ -357,10 +534,12 @@ class Cocopot(object):
         else:
             self.error_handler_spec.setdefault(key, {}).setdefault(None, []) \
                 .append((code_or_exception, f))
+        self.error_handler_cache.clear()
 
     def before_request(self, f):
         """Registers a function to run before each request."""
         self.before_request_funcs.setdefault(None, []).append(f)
+        self.request_hooks = None
         return f
 
 
@@ -371,6 +550,7 @@ class Cocopot(object):
 
         """
         self.after_request_funcs.setdefault(None, []).insert(0, f)
+        self.request_hooks = None
         return f
 
     def teardown_request(self, f):
@@ -388,27 +568,102 @@ class Cocopot(object):
         be passed an error object.
         """
         self.teardown_request_funcs.setdefault(None, []).insert(0, f)
+        self.request_hooks = None
         return f
 
+    def freeze(self):
+        """Precomputes the `before_request`, `after_request` and
+        `teardown_request` functions of every endpoint, application wide
+        functions merged with the ones of its blueprint, so dispatching a
+        request only needs a single lookup.  It also freezes the router,
+        which writes its route cache file if it has one, see `Router.freeze`.
+
+        This is called by `run` and on the first request, and again on the
+        next request after a hook or blueprint was registered.  Call it once
+        the application is set up to keep the cache file write off the first
+        request, and if you change `before_request_funcs` and friends
+        directly.
+        """
+        self.router.freeze()
+        hooks = dict((endpoint, self._collect_hooks(endpoint))
+                     for endpoint in self.view_functions)
+        hooks[''] = self._collect_hooks('')
+        self.request_hooks = hooks
+        return hooks
+
+    def _collect_hooks(self, endpoint):
+        bp = endpoint.rsplit('.', 1)[0] if '.' in endpoint else None
+        app_funcs, bp_funcs = [], []
+        for spec in (self.before_request_funcs, self.after_request_funcs,
+                     self.teardown_request_funcs):
+            app_funcs.append(tuple(spec.get(None, ())))
+            bp_funcs.append(tuple(spec.get(bp, ())) if bp is not None else ())
+        return (app_funcs[0] + bp_funcs[0],
+                bp_funcs[1] + app_funcs[1],
+                app_funcs[2] + bp_funcs[2])
+
+    def _request_hooks(self):
+        """The (before, after, teardown) functions of the current request."""
+        endpoint = _request_ctx_stack.top.request.endpoint
+        hooks = self.request_hooks
+        if hooks is None:
+            hooks = self.freeze()
+        rv = hooks.get(endpoint)
+        if rv is None:
+            # an endpoint without view function, remember it as well
+            rv = hooks[endpoint] = self._collect_hooks(endpoint)
+        return rv
+
 
     def handle_http_exception(self, e):
         """Handles an HTTP exception.  By default this will invoke the
         registered error handlers and fall back to returning the
         exception as response.
         """
-        handlers = self.error_handler_spec.get(request.blueprint)
         # Proxy exceptions don't have error codes.  We want to always return
         # those unchanged as errors
         if e.code is None:
             return e
-        if handlers and e.code in handlers:
-            handler = handlers[e.code]
-        else:
-            handler = self.error_handler_spec[None].get(e.code)
+        handler = self.find_error_handler(e)
         if handler is None:
             return e
         return handler(e)
 
+    def find_error_handler(self, e):
+        """Returns the error handler for `e` of the blueprint of the current
+        request, or of the application if the blueprint has none, `None` if
+        there is no handler at all.  HTTP exceptions are looked up by their
+        status code, other exceptions by the first handler registered for
+        one of their base classes.  The result is cached per blueprint and
+        status code or exception class.
+        """
+        bp = request.blueprint
+        is_http = isinstance(e, HTTPException)
+        key = (bp, e.code if is_http else type(e))
+        try:
+            return self.error_handler_cache[key]
+        except KeyError:
+            pass
+        handlers = self.error_handler_spec.get(bp) or {}
+        app_handlers = self.error_handler_spec[None]
+        if is_http:
+            if e.code in handlers:
+                handler = handlers[e.code]
+            else:
+                handler = app_handlers.get(e.code)
+        else:
+            handler = None
+            for typecheck, f in chain(handlers.get(None, ()),
+                                      app_handlers.get(None, ())):
+                if issubclass(key[1], typecheck):
+                    handler = f
+                    break
+        if len(self.error_handler_cache) >= 1024:
+            # guard against exception classes created on the fly
+            self.error_handler_cache.clear()
+        self.error_handler_cache[key] = handler
+        return handler
+
     def handle_user_exception(self, e):
         """This method is called whenever an exception occurs that should be
         handled.  A special case are `~cocopot.exception.HTTPException`\s which are forwarded by
@@ -427,14 +682,12 @@ class Cocopot(object):
         if isinstance(e, HTTPException):
             return self.handle_http_exception(e)
 
-        blueprint_handlers = ()
-        handlers = self.error_handler_spec.get(request.blueprint)
-        if handlers is not None:
-            blueprint_handlers = handlers.get(None, ())
-        app_handlers = self.error_handler_spec[None].get(None, ())
-        for typecheck, handler in chain(blueprint_handlers, app_handlers):
-            if isinstance(e, typecheck):
-                return handler(e)
+        handler = self.find_error_handler(e)
+        if handler is not None:
+            self.exception_reporter.report(
+                (exc_type, exc_value, tb), 'Handled exception on %s [%s]',
+                (request.path, request.method), INFO)
+            return handler(e)
 
         reraise(exc_type, exc_value, tb)
 
@@ -458,12 +711,40 @@ class Cocopot(object):
         """Logs an exception.  This is called by `handle_exception`
         if debugging is disabled and right before the handler is called.
         The default implementation logs the exception as error on the
-        `logger`.
+        `logger` through the `exception_reporter`.
         """
-        self.logger.error('Exception on %s [%s]' % (
+        self.exception_reporter.report(exc_info, 'Exception on %s [%s]', (
             request.path,
             request.method
-        ), exc_info=exc_info)
+        ))
+
+    def _await(self, rv):
+        """Run `rv` to completion on the shared event loop if a view, hook or
+        error handler returned a coroutine, see `~cocopot.coroutines`."""
+        if isawaitable(rv):
+            from .coroutines import run_coroutine
+            rv = run_coroutine(rv)
+        return rv
+
+    def _then(self, rv, then):
+        """Returns `then(rv)`.  If a hook returned an awaitable `rv`, an
+        ASGI request gets an awaitable of `then` of its result instead,
+        a WSGI request runs it with `_await` first."""
+        if not isawaitable(rv):
+            return then(rv)
+        if _request_ctx_stack.top.asgi:
+            from .coroutines import await_then
+            return await_then(rv, then)
+        return then(self._await(rv))
+
+    def match_request(self, req):
+        """Matches `req` against the URL rules, sets its `endpoint` and
+        `view_args` and checks its content length.  Raises the
+        `HTTPException` of a request that can not be served.
+        """
+        endpoint, view_args = self.router.match(to_unicode(req.environ['PATH_INFO']), req.method)
+        req.endpoint, req.view_args = endpoint, view_args
+        self.check_content_length(req)
 
     def full_dispatch_request(self):
         """Dispatches the request and on top of that performs request
@@ -472,14 +753,12 @@ class Cocopot(object):
         """
         try:
             req = _request_ctx_stack.top.request
-            endpoint, view_args = self.router.match(to_unicode(req.environ['PATH_INFO']))
-            req.endpoint, req.view_args = endpoint, view_args
+            self.match_request(req)
             rv = self.preprocess_request()
             if rv is None:
-                rv = self.view_functions[req.endpoint](**req.view_args)
+                rv = self._await(self.view_functions[req.endpoint](**req.view_args))
         except Exception as e:
-            self.logger.info('%s'%(traceback.format_exc()))
-            rv = self.handle_user_exception(e)
+            rv = self._await(self.handle_user_exception(e))
         response = make_response(rv)
         response = self.process_response(response)
         return response
@@ -490,13 +769,17 @@ class Cocopot(object):
         If any of these function returns a value it's handled as
         if it was the return value from the view and further
         request handling is stopped.
+
+        Under ASGI it returns an awaitable once a function returned one.
         """
-        bp = _request_ctx_stack.top.request.blueprint
-        funcs = self.before_request_funcs.get(None, ())
-        if bp is not None and bp in self.before_request_funcs:
-            funcs = chain(funcs, self.before_request_funcs[bp])
-        for func in funcs:
-            rv = func()
+        return self._preprocess(self._request_hooks()[0], 0)
+
+    def _preprocess(self, funcs, start):
+        for i in range(start, len(funcs)):
+            rv = funcs[i]()
+            if isawaitable(rv):
+                return self._then(rv, lambda rv: self._preprocess(funcs, i + 1)
+                                  if rv is None else rv)
             if rv is not None:
                 return rv
 
@@ -512,17 +795,16 @@ class Cocopot(object):
         Returns:
 
           * a new response object or the same, has to be an
-                 instance of `Response`.
+                 instance of `Response`.  Under ASGI an awaitable of it
+                 once a function returned one.
         """
-        ctx = _request_ctx_stack.top
-        bp = ctx.request.blueprint
-        funcs = []
-        if bp is not None and bp in self.after_request_funcs:
-            funcs = chain(funcs, self.after_request_funcs[bp])
-        if None in self.after_request_funcs:
-            funcs = chain(funcs, self.after_request_funcs[None])
-        for handler in funcs:
-            response = handler(response)
+        return self._postprocess(self._request_hooks()[1], 0, response)
+
+    def _postprocess(self, funcs, start, response):
+        for i in range(start, len(funcs)):
+            response = funcs[i](response)
+            if isawaitable(response):
+                return self._then(response, lambda rv: self._postprocess(funcs, i + 1, rv))
         return response
 
     def do_teardown_request(self, exc=None):
@@ -531,15 +813,18 @@ class Cocopot(object):
         not actually called by the `Cocopot` object itself but is always
         triggered when the request context is popped.  That way we have a
         tighter control over certain resources under testing environments.
+
+        Under ASGI it returns an awaitable once a function returned one.
         """
         if exc is None:
             exc = sys.exc_info()[1]
-        funcs = self.teardown_request_funcs.get(None, ())
-        bp = _request_ctx_stack.top.request.blueprint
-        if bp is not None and bp in self.teardown_request_funcs:
-            funcs = chain(funcs, self.teardown_request_funcs[bp])
-        for func in funcs:
-            rv = func(exc)
+        return self._teardown(self._request_hooks()[2], 0, exc)
+
+    def _teardown(self, funcs, start, exc):
+        for i in range(start, len(funcs)):
+            rv = funcs[i](exc)
+            if isawaitable(rv):
+                return self._then(rv, lambda rv: self._teardown(funcs, i + 1, exc))
 
 
     def wsgi_app(self, environ, start_response):
@@ -567,20 +852,51 @@ class Cocopot(object):
         ctx = RequestContext(self, environ, req)
         ctx.push()
         error = None
+        stats = self.stats
+        if stats is not None:
+            start = timer()
         try:
             try:
                 response = self.full_dispatch_request()
             except Exception as e:
-                self.logger.info('%s'%(traceback.format_exc()))
                 error = e
-                response = make_response(self.handle_exception(e))
+                response = make_response(self._await(self.handle_exception(e)))
+            if stats is not None:
+                stats.record(req.endpoint or None, response.status_code,
+                             timer() - start)
             return response(environ, start_response)
         finally:
             self.do_teardown_request(error)
             ctx.pop(error)
 
-    def __call__(self, environ, start_response):
-        """Shortcut for `wsgi_app`."""
+    @markcoroutinefunction
+    def asgi_app(self, scope, receive, send):
+        """The ASGI 3 application, it serves requests with the same router,
+        hooks, error handlers and responses as `wsgi_app`.  View functions,
+        hooks and error handlers may be coroutine functions, they are
+        awaited.  Plain view functions run in a thread pool, see
+        `~cocopot.asgi.ASGIHandler`.  Needs Python 3.5 or newer.
+
+        Give `app.asgi_app` to the ASGI server, it is marked as coroutine
+        function so servers detecting the interface pick ASGI 3.
+
+        Args:
+
+          * scope: the ASGI connection scope
+          * receive: the awaitable callable returning the next event
+          * send: the awaitable callable sending an event
+        """
+        handler = self.asgi_handler
+        if handler is None:
+            from .asgi import ASGIHandler
+            handler = self.asgi_handler = ASGIHandler(self)
+        return handler(scope, receive, send)
+
+    def __call__(self, environ, start_response, *args):
+        """Shortcut for `wsgi_app`, or for `asgi_app` when called with an
+        ASGI scope, which has a `type` key and no `REQUEST_METHOD`."""
+        if 'type' in environ and 'REQUEST_METHOD' not in environ:
+            return self.asgi_app(environ, start_response, *args)
         return self.wsgi_app(environ, start_response)
 
     def __repr__(self):
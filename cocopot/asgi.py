@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+    Serves a `Cocopot` application to ASGI servers, see `Cocopot.asgi_app`.
+    This module needs Python 3.5 or newer and is only imported on the first
+    ASGI request.
+"""
+import os
+import sys
+import asyncio
+from inspect import isawaitable, iscoroutinefunction
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from .app import RequestContext
+from .coroutines import use_task_contexts
+from .exceptions import RequestEntityTooLarge
+from .globals import _request_ctx_stack
+from .request import Request
+from .response import make_response
+from .stats import timer
+from ._compat import BytesIO, to_unicode
+
+
+def _call_in_context(ctx, func, kwargs):
+    """Call `func` in a worker thread with the request context of the
+    request it serves."""
+    _request_ctx_stack.push(ctx)
+    try:
+        return func(**kwargs)
+    finally:
+        _request_ctx_stack.pop()
+
+
+async def _resolve(rv):
+    """Await `rv` if it is awaitable, the hooks of the application hand
+    back an awaitable once one of them is a coroutine."""
+    if isawaitable(rv):
+        rv = await rv
+    return rv
+
+
+#: Returned by `next` when a response body is exhausted.
+_END = object()
+
+
+class _Disconnected(Exception):
+    """The client disconnected before sending the whole request body."""
+
+
+class ASGIHandler(object):
+    """An ASGI 3 application that serves `app` with the same router, hooks,
+    error handlers and responses as `Cocopot.wsgi_app`.
+
+    Coroutine functions used as views, hooks or error handlers are awaited
+    on the event loop, so a request waiting for I/O does not take a thread.
+    Plain view functions run in a pool of `max_workers` threads.  Plain
+    hooks and error handlers are called on the event loop and must not
+    block.
+
+    The request body is read from `receive` once the request is matched,
+    before the hooks and the view, into a temporary file above the
+    `body_spool_size` of the endpoint.  A body larger than its
+    `max_content_length` is rejected with `RequestEntityTooLarge` without
+    reading the rest of it.  The response body is sent chunk by chunk.
+    """
+
+    def __init__(self, app, max_workers=None):
+        self.app = app
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        #: the thread pool plain view functions run in
+        self.executor = ThreadPoolExecutor(max_workers)
+        use_task_contexts()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type: %r' % scope['type'])
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive, spool_size, max_length=None, length=None):
+        """Returns the request body as file and its size, or `None` if the
+        client disconnected.  Raises `RequestEntityTooLarge` if the `length`
+        announced by the client or the body received is larger than
+        `max_length`."""
+        if max_length is not None and length is not None and length > max_length:
+            raise RequestEntityTooLarge()
+        body, size, more_body = SpooledTemporaryFile(spool_size), 0, True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if chunk:
+                size += len(chunk)
+                if max_length is not None and size > max_length:
+                    body.close()
+                    raise RequestEntityTooLarge()
+                body.write(chunk)
+        body.seek(0)
+        return body, size
+
+    async def receive_body(self, req, receive):
+        """Read the body of `req` into its `wsgi.input`."""
+        length = None
+        for name, value in req.environ['asgi.scope'].get('headers', ()):
+            if name.lower() == b'content-length':
+                try:
+                    length = int(value)
+                except ValueError:
+                    pass
+        spool_size, max_length = self.app.body_limits(req)
+        body = await self.read_body(receive, spool_size, max_length, length)
+        if body is None:
+            raise _Disconnected()
+        req.environ['wsgi.input'], size = body
+        req.environ['CONTENT_LENGTH'] = str(size)
+
+    def make_environ(self, scope, body=None, size=0):
+        """Translate an ASGI HTTP scope into a WSGI environment."""
+        if body is None:
+            body = BytesIO()
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'CONTENT_LENGTH': str(size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'asgi.scope': scope,
+        }
+        client = scope.get('client')
+        if client:
+            environ['REMOTE_ADDR'] = client[0]
+            environ['REMOTE_PORT'] = str(client[1])
+        for name, value in scope.get('headers', ()):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+                continue
+            if name in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+                continue  # the body is read by `receive_body`
+            key = 'HTTP_' + name
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+        return environ
+
+    async def handle_http(self, scope, receive, send):
+        app = self.app
+        environ = self.make_environ(scope)
+        req = Request(environ)
+        ctx = RequestContext(app, environ, req)
+        ctx.asgi = True
+        ctx.push()
+        error = None
+        stats = app.stats
+        if stats is not None:
+            start = timer()
+        try:
+            try:
+                response = await self.full_dispatch_request(req, receive)
+            except _Disconnected:
+                return
+            except Exception as e:
+                error = e
+                response = make_response(await _resolve(app.handle_exception(e)))
+            if stats is not None:
+                stats.record(req.endpoint or None, response.status_code,
+                             timer() - start)
+            await self.send_response(response, environ, send)
+        finally:
+            await _resolve(app.do_teardown_request(error))
+            ctx.pop(error)
+
+    async def full_dispatch_request(self, req, receive):
+        """Like `Cocopot.full_dispatch_request`, reading the request body
+        from `receive` before the hooks and calling plain views in the
+        thread pool.  The hooks run in the `preprocess_request` and
+        `process_response` of the application."""
+        app = self.app
+        try:
+            app.match_request(req)
+            await self.receive_body(req, receive)
+            rv = await _resolve(app.preprocess_request())
+            if rv is None:
+                rv = await self.call_view(app.view_functions[req.endpoint], req.view_args)
+        except _Disconnected:
+            raise
+        except Exception as e:
+            rv = await _resolve(app.handle_user_exception(e))
+        return await _resolve(app.process_response(make_response(rv)))
+
+    async def call_view(self, view, view_args):
+        if iscoroutinefunction(view):
+            return await view(**view_args)
+        loop = asyncio.get_event_loop()
+        rv = await loop.run_in_executor(self.executor, _call_in_context,
+                                        _request_ctx_stack.top, view, view_args)
+        return await _resolve(rv)
+
+    async def send_response(self, response, environ, send):
+        """Send the WSGI response of `response`.  The start message goes
+        first, then each chunk of the body as it is produced.  Chunks of
+        an iterable that is not a list are produced in the thread pool."""
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        body = response(environ, start_response)
+        try:
+            chunks = body if isinstance(body, (list, tuple)) else None
+            if chunks is None:
+                body_iter = iter(body)
+                loop = asyncio.get_event_loop()
+                first = None
+                if not started:
+                    # a generator calls `start_response` on its first chunk
+                    first = await loop.run_in_executor(self.executor, next, body_iter, _END)
+            status, headers = started
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                            for k, v in headers],
+            })
+            if environ['REQUEST_METHOD'] == 'HEAD':
+                chunks = ()
+            if chunks is not None:
+                chunks = [c for c in chunks if c]
+                for chunk in chunks[:-1]:
+                    await send({'type': 'http.response.body', 'body': chunk,
+                                'more_body': True})
+                await send({'type': 'http.response.body',
+                            'body': chunks[-1] if chunks else b''})
+                return
+            chunk = first
+            if chunk is None:
+                chunk = await loop.run_in_executor(self.executor, next, body_iter, _END)
+            while chunk is not _END:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk,
+                                'more_body': True})
+                chunk = await loop.run_in_executor(self.executor, next, body_iter, _END)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
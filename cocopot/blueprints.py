@@ -8,12 +8,21 @@ from functools import update_wrapper
 
 class Blueprint(object):
     """Represents a blueprint.
+
+    Args:
+
+      * name: the name of the blueprint, prefixed to its endpoints.
+      * url_prefix: a path prefixed to its URL rules.
+      * url_defaults: the default view arguments of its URL rules.
+      * max_content_length: the largest request body accepted by its
+                            endpoints, unless a route sets its own.
     """
 
-    def __init__(self, name, url_prefix=None, url_defaults=None):
+    def __init__(self, name, url_prefix=None, url_defaults=None, max_content_length=None):
         self.app = None
         self.name = name
         self.url_prefix = url_prefix
+        self.max_content_length = max_content_length
         self.deferred_functions = []
         self.view_functions = {}
         self.url_defaults = url_defaults or {}
@@ -72,6 +81,10 @@ class Blueprint(object):
             rule = url_prefix + rule
         if endpoint is None:
             endpoint = view_func.__name__
+        max_content_length = self.register_options.get('max_content_length',
+                                                       self.max_content_length)
+        if max_content_length is not None and 'max_content_length' not in options:
+            options = dict(options, max_content_length=max_content_length)
         defaults = self.url_defaults
         if 'defaults' in options:
             defaults = dict(defaults, **options.pop('defaults'))
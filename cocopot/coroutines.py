@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+    Runs coroutines returned by views and hooks of WSGI requests on a shared
+    event loop, see `Cocopot.wsgi_app`, and chains the ones of the hooks of
+    ASGI requests.  This module needs Python 3.5 or newer and is only
+    imported when the first coroutine shows up.
+"""
+import os
+import asyncio
+import threading
+from inspect import isawaitable
+
+from .globals import _request_ctx_stack
+from .local import get_ident
+
+_current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+_get_running_loop = getattr(asyncio, '_get_running_loop', None)
+
+
+def _context_ident():
+    """Identify the running asyncio task, or the thread or greenlet outside
+    of one, so requests served concurrently on one event loop do not share
+    their context stack."""
+    if _get_running_loop is not None and _get_running_loop() is None:
+        return get_ident()
+    try:
+        task = _current_task()
+    except RuntimeError:  # no event loop in this thread
+        task = None
+    return task if task is not None else get_ident()
+
+
+def use_task_contexts():
+    """Give every asyncio task a request context stack of its own.  Only
+    needed for a `~cocopot.local.LocalStack`, with a context variable every
+    task has its own stack anyway."""
+    if hasattr(_request_ctx_stack, '__ident_func__'):
+        _request_ctx_stack.__ident_func__ = _context_ident
+
+
+async def _run_in_context(coro, ctx):
+    _request_ctx_stack.push(ctx)
+    try:
+        return await coro
+    finally:
+        _request_ctx_stack.pop()
+
+
+async def await_then(awaitable, then):
+    """Await `awaitable` and return `then` of its result, awaited as well
+    if it is awaitable, see `Cocopot._then`."""
+    rv = then(await awaitable)
+    if isawaitable(rv):
+        rv = await rv
+    return rv
+
+
+class EventLoopThread(object):
+    """An event loop running forever in a daemon thread."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name='cocopot-event-loop')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro, ctx=None):
+        """Run `coro` on the loop with the request context `ctx` and block
+        until it is done.  Returns its result or raises its exception.
+        """
+        if ctx is not None:
+            coro = _run_in_context(coro, ctx)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_loop():
+    """Returns the `EventLoopThread` of this process, it is started on the
+    first call (and again in a forked child)."""
+    global _shared
+    loop = _shared
+    if loop is None or loop.pid != os.getpid():
+        with _shared_lock:
+            loop = _shared
+            if loop is None or loop.pid != os.getpid():
+                use_task_contexts()
+                loop = _shared = EventLoopThread()
+    return loop
+
+
+def run_coroutine(coro):
+    """Run `coro` on the shared event loop with the current request context
+    and return its result, for WSGI worker threads."""
+    return shared_loop().run(coro, _request_ctx_stack.top)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+    A thread pool that runs functions with the request context of the request
+    that submitted them, see `Cocopot.executor` and `cocopot.parallel`.
+    On Python 2 this needs the `futures` backport of `concurrent.futures`.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .globals import _request_ctx_stack
+
+
+def _call_in_context(ctx, func, args, kwargs):
+    if ctx is None:
+        return func(*args, **kwargs)
+    _request_ctx_stack.push(ctx)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _request_ctx_stack.pop()
+
+
+class RequestExecutor(object):
+    """A bounded pool of `max_workers` threads shared by all requests of an
+    application.  Functions submitted during a request run with its request
+    context, so `request`, `g` and `current_app` work in them.
+
+    The futures of a request that did not start yet are cancelled when the
+    request context is popped.  Functions already running are not
+    interrupted, they should not outlive their request.
+    """
+
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """The `ThreadPoolExecutor`, started on first use."""
+        pool = self._pool
+        if pool is None:
+            with self._lock:
+                pool = self._pool
+                if pool is None:
+                    pool = self._pool = ThreadPoolExecutor(self.max_workers)
+        return pool
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule `func(*args, **kwargs)` and return its `Future`."""
+        ctx = _request_ctx_stack.top
+        future = self.pool.submit(_call_in_context, ctx, func, args, kwargs)
+        if ctx is not None:
+            if ctx.futures is None:
+                ctx.futures = []
+            ctx.futures.append(future)
+        return future
+
+    def map(self, func, *iterables, **kwargs):
+        """Like `map` but the calls run in the pool, returns a list of the
+        results.  `timeout` limits the wait for each result."""
+        timeout = kwargs.pop('timeout', None)
+        futures = [self.submit(func, *args) for args in zip(*iterables)]
+        return [f.result(timeout) for f in futures]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait)
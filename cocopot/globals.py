@@ -4,8 +4,9 @@
     active context.
 """
 
+import os
 from functools import partial
-from .local import LocalStack, LocalProxy
+from .local import make_stack, LocalProxy
 from .utils import ConfigDict
 
 def _lookup_req_object(name):
@@ -14,8 +15,9 @@ def _lookup_req_object(name):
         raise RuntimeError('working outside of request context')
     return getattr(top, name)
 
-# context locals
-_request_ctx_stack = LocalStack()
+# context locals, the COCOPOT_CONTEXT_STACK environment variable selects the
+# kind of stack, see `cocopot.local.make_stack`
+_request_ctx_stack = make_stack(os.environ.get('COCOPOT_CONTEXT_STACK', 'auto'))
 request = LocalProxy(partial(_lookup_req_object, 'request'))
 current_app = LocalProxy(partial(_lookup_req_object, 'app'))
 g = LocalProxy(partial(_lookup_req_object, 'g'))
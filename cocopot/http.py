@@ -1,4 +1,5 @@
 
+import re
 import time
 import email
 import email.utils
@@ -121,6 +122,25 @@ def parse_content_type(content_type):
     return (parts[0], params)
 
 
+_option_re = re.compile(r';\s*([^\s;=]+)\s*(?:=\s*("(?:\\.|[^"\\])*"|[^;]*))?')
+
+
+def parse_options_header(value):
+    """Split a header like `Content-Disposition` into its value and a dict
+    of its options.  Quoted option values are unquoted."""
+    value = value.strip()
+    pos = value.find(';')
+    if pos < 0:
+        return value, {}
+    options = {}
+    for key, option in _option_re.findall(value[pos:]):
+        option = option.strip()
+        if option[:1] == '"' and option[-1:] == '"':
+            option = option[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+        options[key.lower()] = option
+    return value[:pos].strip(), options
+
+
 def html_escape(string):
     """ Escape HTML special characters ``&<>`` and quotes ``'"``. """
     return string.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')\
@@ -14,6 +14,11 @@ except ImportError:
     except ImportError:
         from _thread import get_ident
 
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+    ContextVar = None
+
 
 class LocalStack(object):
     """This class works similar to a `Local` but keeps a stack
@@ -30,15 +35,19 @@ class LocalStack(object):
         23
         >>> ls.top
         42
-        
+
+    Every thread or greenlet has a stack of its own.  `__ident_func__`
+    returns the key of the current one and can be replaced, e.g. to give
+    every asyncio task its own stack.
     """
 
     def __init__(self):
         self._stack = {}
+        self.__ident_func__ = get_ident
 
     def push(self, obj):
         """Pushes a new item to the stack"""
-        rv = self._stack.setdefault(get_ident(), [])
+        rv = self._stack.setdefault(self.__ident_func__(), [])
         rv.append(obj)
         return rv
 
@@ -46,7 +55,7 @@ class LocalStack(object):
         """Removes the topmost item from the stack, will return the
         old value or `None` if the stack was already empty.
         """
-        ident = get_ident()
+        ident = self.__ident_func__()
         stack = self._stack.get(ident, None)
         if stack is None:
             return None
@@ -61,10 +70,77 @@ class LocalStack(object):
         """The topmost item on the stack.  If the stack is empty,
         `None` is returned.
         """
-        try:
-            return self._stack.get(get_ident(), [])[-1]
-        except (AttributeError, IndexError):
+        stack = self._stack.get(self.__ident_func__())
+        return stack[-1] if stack else None
+
+
+class ContextVarStack(object):
+    """Same as `LocalStack` but the stack is kept in a
+    `contextvars.ContextVar`, so every thread, asyncio task and (with a
+    greenlet version that supports it) greenlet has its own stack, and
+    nothing is left behind when one of them ends without popping.  Needs
+    Python 3.7 or newer.
+
+    The stack is a tuple that is replaced on every change, a task started
+    while a request is active sees the stack as it was then.
+    """
+
+    def __init__(self, name='cocopot.stack'):
+        self._var = ContextVar(name, default=())
+
+    def push(self, obj):
+        """Pushes a new item to the stack"""
+        rv = self._var.get() + (obj,)
+        self._var.set(rv)
+        return rv
+
+    def pop(self):
+        """Removes the topmost item from the stack, will return the
+        old value or `None` if the stack was already empty.
+        """
+        stack = self._var.get()
+        if not stack:
             return None
+        self._var.set(stack[:-1])
+        return stack[-1]
+
+    @property
+    def top(self):
+        """The topmost item on the stack.  If the stack is empty,
+        `None` is returned.
+        """
+        stack = self._var.get()
+        return stack[-1] if stack else None
+
+
+def _greenlet_contexts():
+    """Whether greenlets, if installed, each have their own context."""
+    try:
+        from greenlet import greenlet
+    except ImportError:
+        return True
+    return hasattr(greenlet, 'gr_context')
+
+
+def make_stack(kind='auto'):
+    """Returns a new `ContextVarStack` or `LocalStack` for `kind` 'contextvar'
+    or 'local'.  'auto' picks `ContextVarStack` when contextvars are
+    available and work with greenlets, if those are installed.
+    """
+    if kind == 'auto':
+        kind = 'contextvar' if ContextVar is not None and _greenlet_contexts() else 'local'
+    if kind == 'contextvar':
+        if ContextVar is None:
+            raise RuntimeError('contextvars need Python 3.7 or newer')
+        return ContextVarStack()
+    if kind == 'local':
+        return LocalStack()
+    raise ValueError('Unknown context stack: %r' % kind)
+
+_object_getattribute = object.__getattribute__
+_proxy_attributes = frozenset(['_get_current_object', '_LocalProxy__target',
+                               '__name__', '__dict__', '__class__'])
+
 
 class LocalProxy(object):
     """Acts as a proxy for a object.  Forwards all operations to
@@ -75,7 +151,7 @@ class LocalProxy(object):
         session = LocalProxy(lambda: get_current_request().session)
 
     """
-    __slots__ = ('__target', '__dict__', '__name__')
+    __slots__ = ('__target', '__dict__', '__name__', '__weakref__')
 
     def __init__(self, target, name=None):
         object.__setattr__(self, '_LocalProxy__target', target)
@@ -86,10 +162,11 @@ class LocalProxy(object):
         object behind the proxy at a time for performance reasons or because
         you want to pass the object into a different context.
         """
-        if callable(self.__target):
-            return self.__target()
+        target = _object_getattribute(self, '_LocalProxy__target')
+        if callable(target):
+            return target()
         try:
-            return getattr(self.__target, self.__name__)
+            return getattr(target, self.__name__)
         except AttributeError:
             raise RuntimeError('no object bound to %s' % self.__name__)
 
@@ -125,10 +202,27 @@ class LocalProxy(object):
         except RuntimeError:
             return []
 
-    def __getattr__(self, name):
+    def __getattribute__(self, name):
+        # Going through `__getattr__` costs a failed lookup on the proxy for
+        # every `request.args` and the like, so all names but the proxy's own
+        # are forwarded right away.
+        if name in _proxy_attributes:
+            return _object_getattribute(self, name)
+        if name[:2] == '__':
+            # Dunder names of the proxy itself, like `__doc__` or
+            # `__module__`, work without a bound object as they used to.
+            try:
+                return _object_getattribute(self, name)
+            except AttributeError:
+                pass
+        target = _object_getattribute(self, '_LocalProxy__target')
+        if callable(target):
+            current = target()
+        else:
+            current = _object_getattribute(self, '_get_current_object')()
         if name == '__members__':
-            return dir(self._get_current_object())
-        return getattr(self._get_current_object(), name)
+            return dir(current)
+        return getattr(current, name)
 
     def __setitem__(self, key, value):
         self._get_current_object()[key] = value
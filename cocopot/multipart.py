@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+    An incremental parser for `multipart/form-data` bodies, see
+    `Request.parse_form_data`.
+"""
+from tempfile import SpooledTemporaryFile
+
+from .exceptions import BadRequest
+from .http import parse_options_header
+from ._compat import PY2
+
+
+class MultipartPart(object):
+    """A part of a multipart body."""
+
+    def __init__(self, headers, charset='utf-8', errors='replace'):
+        #: the headers of the part as list of `(name, value)` tuples
+        self.headers = headers
+        self.charset = charset
+        self.errors = errors
+        self.name = self.filename = None
+        self.content_type = None
+        for key, value in headers:
+            key = key.lower()
+            if key == 'content-disposition':
+                _, options = parse_options_header(value)
+                self.name = options.get('name')
+                self.filename = options.get('filename')
+            elif key == 'content-type':
+                self.content_type = value
+        #: the content of a file part, `None` for other parts
+        self.file = None
+        #: the content of the part as list of bytes, for other parts
+        self.chunks = []
+        #: the size of the content in bytes
+        self.size = 0
+
+    @property
+    def value(self):
+        """The content of a part that is not a file, decoded."""
+        data = b''.join(self.chunks)
+        return data if PY2 else data.decode(self.charset, self.errors)
+
+
+class MultipartParser(object):
+    """Parse a `multipart/form-data` body read from `stream`, iterating
+    over the parser yields its `MultipartPart` objects.
+
+    The stream is read `chunk_size` bytes at a time and boundaries are
+    searched with `bytes.find`, so the body is not split into lines.  The
+    content of file parts (parts with a filename) goes to a
+    `SpooledTemporaryFile` that moves to disk past `spool_size` bytes, other
+    parts are kept in memory.  Lines may end with CRLF or, like `cgi`
+    allows, with LF only.
+
+    A malformed body raises `BadRequest`.
+
+    Args:
+
+      * stream: a file-like object with the body.
+      * boundary: the boundary from the `Content-Type` header.
+      * content_length: the size of the body, read until the end of the
+                        stream if it is -1.
+    """
+
+    #: the size of the part headers allowed
+    max_header_size = 8192
+
+    def __init__(self, stream, boundary, content_length=-1, charset='utf-8',
+                 errors='replace', spool_size=1024 * 1024, chunk_size=64 * 1024):
+        if not boundary:
+            raise BadRequest('Missing multipart boundary.')
+        self.stream = stream
+        self.boundary = b'--' + (boundary.encode('latin-1')
+                                 if not isinstance(boundary, bytes) else boundary)
+        self.content_length = content_length
+        self.charset = charset
+        self.errors = errors
+        self.spool_size = spool_size
+        self.chunk_size = chunk_size
+
+    def _read(self):
+        size = self.chunk_size
+        if self.content_length >= 0:
+            size = min(size, self.content_length)
+            if not size:
+                return b''
+        data = self.stream.read(size)
+        if self.content_length >= 0:
+            self.content_length -= len(data)
+        return data
+
+    def __iter__(self):
+        read = self._read
+        err = BadRequest('Error while parsing multipart body.')
+        boundary = self.boundary
+
+        # The preamble, up to the first boundary line.
+        buf = b''
+        while True:
+            chunk = read()
+            if not chunk:
+                raise err
+            buf += chunk
+            pos = buf.find(boundary)
+            if pos >= 0 and len(buf) >= pos + len(boundary) + 2:
+                break
+            if pos < 0:
+                buf = buf[-len(boundary):]
+        buf = buf[pos + len(boundary):]
+        if buf[:2] == b'--':
+            return
+        nl = b'\r\n' if buf[:2] == b'\r\n' else b'\n'
+        if buf[:len(nl)] != nl:
+            raise err
+        buf = buf[len(nl):]
+        delimiter = nl + boundary
+        keep = len(delimiter) + 2
+
+        while True:
+            # The headers of a part.
+            if buf[:len(nl)] == nl:
+                head, buf = b'', buf[len(nl):]
+            else:
+                while True:
+                    end = buf.find(nl + nl)
+                    if end >= 0:
+                        break
+                    if len(buf) > self.max_header_size:
+                        raise err
+                    chunk = read()
+                    if not chunk:
+                        raise err
+                    buf += chunk
+                head, buf = buf[:end], buf[end + 2 * len(nl):]
+            part = MultipartPart(self._parse_headers(head.split(nl)),
+                                 self.charset, self.errors)
+            if part.filename is not None:
+                part.file = SpooledTemporaryFile(self.spool_size)
+                write = part.file.write
+            else:
+                write = part.chunks.append
+
+            # The content, up to the next delimiter.
+            start = 0
+            while True:
+                pos = buf.find(delimiter, start)
+                if pos >= 0 and len(buf) >= pos + keep:
+                    break
+                if pos < 0 and len(buf) > keep:
+                    # Everything but a possible start of the delimiter
+                    # belongs to the part.
+                    write(buf[:-keep])
+                    part.size += len(buf) - keep
+                    buf = buf[-keep:]
+                chunk = read()
+                if not chunk:
+                    raise err
+                buf += chunk
+                start = max(0, pos if pos >= 0 else len(buf) - len(chunk) - keep)
+            if pos:
+                write(buf[:pos])
+                part.size += pos
+            if part.file is not None:
+                part.file.seek(0)
+            yield part
+
+            tail = buf[pos + len(delimiter):pos + keep]
+            buf = buf[pos + len(delimiter):]
+            if tail == b'--':
+                return
+            if tail[:len(nl)] != nl:
+                raise err
+            buf = buf[len(nl):]
+
+    def _parse_headers(self, lines):
+        headers = []
+        for line in lines:
+            if not line:
+                continue
+            line = line.decode(self.charset, self.errors)
+            if line[0] in ' \t' and headers:  # folded line
+                name, value = headers[-1]
+                headers[-1] = (name, value + ' ' + line.strip())
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise BadRequest('Error while parsing multipart body.')
+            headers.append((name.strip(), value.strip()))
+        return headers
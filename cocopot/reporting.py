@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+    Logging of unexpected exceptions, see `Cocopot.exception_reporter`.
+"""
+import threading
+from logging import ERROR
+
+from .stats import timer
+
+
+class ExceptionReporter(object):
+    """Logs exceptions with their traceback without flooding the log when
+    the same error happens on every request, e.g. while a database is down.
+
+    At most `limit` records are logged per exception class and `interval`
+    seconds, the others are only counted.  The next record logged for the
+    class tells how many were suppressed.  Nothing is formatted unless the
+    logger is enabled for the level, the traceback itself is only formatted
+    by the handlers that emit the record.
+    """
+
+    def __init__(self, logger, limit=10, interval=60.0):
+        self.logger = logger
+        self.limit = limit
+        self.interval = interval
+        #: exception class -> number of exceptions reported, logged or not
+        self.counts = {}
+        #: exception class -> [window start, logged, suppressed]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def report(self, exc_info, message, args=(), level=ERROR):
+        """Count the exception of `exc_info` and log it with `message % args`
+        unless its class is over the limit.  Returns whether it was logged.
+        """
+        exc_type = exc_info[0]
+        with self._lock:
+            self.counts[exc_type] = self.counts.get(exc_type, 0) + 1
+            if not self.logger.isEnabledFor(level):
+                return False
+            now = timer()
+            window = self._windows.get(exc_type)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                window = self._windows[exc_type] = [now, 0, suppressed]
+            if window[1] >= self.limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+        if suppressed:
+            message += ' (%d similar errors suppressed)'
+            args = tuple(args) + (suppressed,)
+        self.logger.log(level, message, *args, exc_info=exc_info)
+        return True
+
+    def reset(self):
+        """Forget the counts and the rate limit windows."""
+        with self._lock:
+            self.counts.clear()
+            self._windows.clear()
@@ -1,23 +1,96 @@
 # -*- coding: utf-8 -*-
 from functools import update_wrapper
 from datetime import datetime, timedelta
-import cgi
-from tempfile import TemporaryFile
-from .exceptions import HTTPException, BadRequest
+from tempfile import SpooledTemporaryFile
+from .exceptions import HTTPException, BadRequest, RequestEntityTooLarge
+from .globals import _request_ctx_stack
 from .utils import cached_property
 from .datastructures import MultiDict, FileUpload, FormsDict, WSGIHeaders
-from ._compat import (PY2, to_bytes, string_types, text_type,
+from ._compat import (PY2, string_types, text_type,
      integer_types, to_unicode, to_native, BytesIO)
 if PY2:
     from Cookie import SimpleCookie
 else:
     from http.cookies import SimpleCookie
 from .utils import (urlencode, urldecode, urlquote, urlunquote, urljoin, json)
-from .http import (parse_content_type, parse_date, parse_auth, parse_content_type, parse_range_header)
+from .http import (parse_content_type, parse_date, parse_auth, parse_content_type, parse_range_header,
+                   parse_options_header)
+from .multipart import MultipartParser
 
 from .exceptions import BadRequest
 
 MEMFILE_MAX = 4*1024*1024
+COPY_BUFFER_SIZE = 64*1024
+
+_HEXDIGITS = b'0123456789abcdefABCDEF'
+# Trailer fields that would change the framing of the body (RFC 7230 4.1.2).
+_CHUNKED_FORBIDDEN_TRAILERS = (b'content-length', b'transfer-encoding', b'trailer')
+
+
+def copy_stream(src, dst, length):
+    """Copy `length` bytes from the file-like `src` to `dst` through one
+    reused buffer, or less if `src` ends before."""
+    buf = bytearray(min(length, COPY_BUFFER_SIZE))
+    readinto = getattr(src, 'readinto', None)
+    view = memoryview(buf)
+    while length > 0:
+        if readinto is not None:
+            n = readinto(view[:min(length, len(buf))])
+            chunk = view[:n] if not PY2 else bytes(buf[:n])
+        else:
+            chunk = src.read(min(length, len(buf)))
+            n = len(chunk)
+        if not n:
+            break
+        dst.write(chunk)
+        length -= n
+
+class BodyStream(object):
+    """A file-like object reading the body of `request` straight from
+    `wsgi.input`, see `Request.raw_stream`.  It stops after `Content-Length`
+    bytes or decodes a chunked body, and raises `RequestEntityTooLarge` when
+    the body is larger than `max_length` bytes.
+    """
+
+    def __init__(self, request, max_length=None):
+        self.max_length = max_length
+        #: number of bytes of the body read so far
+        self.position = 0
+        self._input = request.environ.get('wsgi.input')
+        self._chunks = None
+        self._buffer = b''
+        if self._input is None:
+            self._remaining = 0
+        elif request.chunked:
+            read1 = getattr(self._input, 'read1', None)
+            self._chunks = request.iter_chunked(read1 or self._input.read,
+                                                COPY_BUFFER_SIZE, max_length,
+                                                read1 is not None)
+        else:
+            self._remaining = max(0, request.content_length)
+            if max_length is not None and self._remaining > max_length:
+                raise RequestEntityTooLarge()
+
+    def read(self, size=-1):
+        """Read up to `size` bytes, all of the rest with a negative size.
+        Returns an empty bytes object at the end of the body."""
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(COPY_BUFFER_SIZE), b''))
+        if self._chunks is None:
+            size = min(size, self._remaining)
+            data = self._input.read(size) if size else b''
+            self._remaining = self._remaining - len(data) if data else 0
+        else:
+            if not self._buffer:
+                self._buffer = next(self._chunks, b'')
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+            data = bytes(data)
+        self.position += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(COPY_BUFFER_SIZE), b'')
+
 
 class Request(object):
     """
@@ -35,6 +108,21 @@ class Request(object):
     #: happened when matching, this will be `None`.
     view_args = None
 
+    #: file uploads larger than this are spooled to a temporary file
+    form_spool_size = 1024 * 1024
+
+    #: request bodies larger than this are spooled to a temporary file, the
+    #: application config and route options can override it, see
+    #: `Cocopot.body_limits`
+    body_spool_size = MEMFILE_MAX
+
+    #: the largest request body accepted, `None` for no limit.  Overridden
+    #: like `body_spool_size`.
+    max_content_length = None
+
+    #: `True` once the body is read from `raw_stream`
+    body_streamed = False
+
     def __init__(self, environ, populate_request=True):
         self.environ = environ
         if populate_request:
@@ -70,8 +158,9 @@ class Request(object):
         object in a with statement with will automatically close it.
 
         """
-        if hasattr(self.stream, 'close'):
-            self.stream.close()
+        stream = self.__dict__.get('stream')
+        if hasattr(stream, 'close'):
+            stream.close()
 
     def __enter__(self):
         return self
@@ -89,6 +178,30 @@ class Request(object):
     def input_stream(self):
         return self.environ.get('wsgi.input')
 
+    @cached_property
+    def raw_stream(self):
+        """The body as `BodyStream`, reading it from `wsgi.input` while the
+        view consumes it instead of copying it first, so a view forwarding a
+        large body uses constant memory.  Once it is used, `data`, `form`,
+        `files` and `json` raise `RuntimeError`.  If one of them was used
+        before, the copy they made is returned.
+        """
+        if 'stream' in self.__dict__:
+            self.stream.seek(0)
+            return self.stream
+        self.body_streamed = True
+        return BodyStream(self, self.body_limits()[1])
+
+    def iter_body(self, chunk_size=COPY_BUFFER_SIZE):
+        """Iterate over the body in pieces of up to `chunk_size` bytes, read
+        from `raw_stream`."""
+        read = self.raw_stream.read
+        while True:
+            chunk = read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
     @cached_property
     def args(self):
         query_string = self.environ.get('QUERY_STRING', '')
@@ -128,64 +241,122 @@ class Request(object):
         """ True if Chunked transfer encoding was. """
         return 'chunked' in self.environ.get('HTTP_TRANSFER_ENCODING', '').lower()
 
-    def iter_body(self, read, bufsize):
-        maxread = max(0, self.content_length)
-        while maxread:
-            part = read(min(maxread, bufsize))
-            if not part: break
-            yield part
-            maxread -= len(part)
-
-    def iter_chunked(self, read, bufsize):
+    def iter_chunked(self, read, bufsize, max_length=None, partial_reads=False):
+        """Decode a chunked body read with `read`, yielding its parts as
+        `memoryview` slices of the blocks read.  Raises `BadRequest` for a
+        malformed body, size line or trailer, and `RequestEntityTooLarge` as
+        soon as the body gets larger than `max_length` bytes.
+
+        Size lines are found with `bytes.find` in the blocks read.  Blocks
+        of `bufsize` bytes are asked for if `partial_reads` is true, i.e.
+        `read` returns the bytes available like `read1` instead of waiting
+        for all of them.  Otherwise `read` is never asked for more than the
+        framing says is left, so it does not wait on a connection after the
+        end of the body.  The trailers are checked and dropped.
+        """
         err = BadRequest('Error while parsing chunked transfer body.')
-        rn, sem, bs = to_bytes('\r\n'), to_bytes(';'), to_bytes('')
+        block = bufsize if partial_reads else None
+        buf, pos, body_size, trailers = b'', 0, 0, None
+        view = memoryview(buf)
         while True:
-            header = read(1)
-            while header[-2:] != rn:
-                c = read(1)
-                header += c
-                if not c: raise err
-                if len(header) > bufsize: raise err
-            size, _, _ = header.partition(sem)
-            try:
-                maxread = int(to_native(size.strip()), 16)
-            except ValueError:
+            # A chunk size line, or a trailer line after the last chunk.
+            end = buf.find(b'\r\n', pos)
+            while end < 0:
+                partial = len(buf) - pos
+                if partial > bufsize:
+                    raise err
+                # At least the rest of the line is left, then a chunk and
+                # its CRLF or the CRLF ending the trailers.  After the last
+                # chunk the line may be that CRLF, the end of the body.
+                if block:
+                    need = block
+                elif trailers is not None and partial < 2:
+                    need = 2 - partial
+                elif partial:
+                    need = (1 if buf.endswith(b'\r') else 2) + 2
+                else:
+                    need = 5
+                data = read(need)
+                if not data:
+                    if trailers is not None and not partial:
+                        return  # no CRLF after the last chunk
+                    raise err
+                buf, pos = buf[pos:] + data, 0
+                view = memoryview(buf)
+                end = buf.find(b'\r\n', max(0, partial - 1))
+            line, pos = buf[pos:end], end + 2
+
+            if trailers is not None:
+                if not line:
+                    return
+                trailers += len(line) + 2
+                name, sep, _ = line.partition(b':')
+                if not sep or not name or trailers > bufsize or \
+                        name != name.strip() or name.lower() in _CHUNKED_FORBIDDEN_TRAILERS:
+                    raise err
+                continue
+
+            size = line.partition(b';')[0].strip()
+            if not size or size.strip(_HEXDIGITS):
                 raise err
-            if maxread == 0: break
-            buff = bs
-            while maxread > 0:
-                if not buff:
-                    buff = read(min(maxread, bufsize))
-                part, buff = buff[:maxread], buff[maxread:]
-                if not part: raise err
-                yield part
-                maxread -= len(part)
-            if read(2) != rn:
+            size = int(size, 16)
+            if not size:
+                trailers = 0
+                continue
+            body_size += size
+            if max_length is not None and body_size > max_length:
+                raise RequestEntityTooLarge()
+
+            # The chunk data, then CRLF and at least a last chunk "0\r\n\r\n".
+            while size:
+                if pos == len(buf):
+                    buf, pos = read(block or min(size + 7, bufsize)), 0
+                    if not buf:
+                        raise err
+                    view = memoryview(buf)
+                n = min(size, len(buf) - pos)
+                yield view[pos:pos + n] if not PY2 else buf[pos:pos + n]
+                pos += n
+                size -= n
+            while len(buf) - pos < 2:
+                data = read(block or 7 - (len(buf) - pos))
+                if not data:
+                    raise err
+                buf, pos = buf[pos:] + data, 0
+                view = memoryview(buf)
+            if not buf.startswith(b'\r\n', pos):
                 raise err
+            pos += 2
+
+    def body_limits(self):
+        """The spool size and the maximum content length for the body, from
+        the application serving this request if there is one."""
+        ctx = _request_ctx_stack.top
+        if ctx is not None and ctx.request is self:
+            return ctx.app.body_limits(self)
+        return self.body_spool_size, self.max_content_length
 
     def get_input_stream(self):
+        if self.body_streamed:
+            raise RuntimeError('The request body was read from raw_stream or '
+                               'iter_body, data, form, files and json are not '
+                               'available.')
         try:
-            read_func = self.environ['wsgi.input'].read
+            stream = self.environ['wsgi.input']
         except KeyError:
             self.environ['wsgi.input'] = BytesIO()
             return self.environ['wsgi.input']
+        spool_size, max_length = self.body_limits()
+        body = SpooledTemporaryFile(spool_size)
         if self.chunked:
-            body, body_size, is_temp_file = BytesIO(), 0, False
-            for part in self.iter_chunked(read_func, MEMFILE_MAX):
+            read1 = getattr(stream, 'read1', None)
+            for part in self.iter_chunked(read1 or stream.read, COPY_BUFFER_SIZE,
+                                          max_length, read1 is not None):
                 body.write(part)
-                body_size += len(part)
-                if not is_temp_file and body_size > MEMFILE_MAX:
-                    body, tmp = TemporaryFile(mode='w+b'), body
-                    body.write(tmp.getvalue())
-                    del tmp
-                    is_temp_file = True
         else:
-            if self.content_length > MEMFILE_MAX:
-                body = TemporaryFile(mode='w+b')
-            else:
-                body = BytesIO()
-                for part in self.iter_body(read_func, MEMFILE_MAX):
-                    body.write(part)
+            if max_length is not None and self.content_length > max_length:
+                raise RequestEntityTooLarge()
+            copy_stream(stream, body, self.content_length)
         self.environ['wsgi.input'] = body
         body.seek(0)
         return body
@@ -200,22 +371,18 @@ class Request(object):
                 post[key] = value
             return post
 
-        safe_env = {'QUERY_STRING': ''}  # Build a safe environment for cgi
-        for key in ('REQUEST_METHOD', 'CONTENT_TYPE', 'CONTENT_LENGTH'):
-            if key in self.environ:
-                safe_env[key] = self.environ[key]
-        args = dict(fp=self.stream, environ=safe_env, keep_blank_values=True)
-        if not PY2:
-            args['encoding'] = 'utf8'
-        data = cgi.FieldStorage(**args)
-        self.environ['_cgi.FieldStorage'] = data  #http://bugs.python.org/issue18394
-        data = data.list or []
-        for item in data:
-            if item.filename:
-                post[item.name] = FileUpload(item.file, item.name,
-                                             item.filename, item.headers)
+        boundary = parse_options_header(self.content_type)[1].get('boundary')
+        parser = MultipartParser(self.stream, boundary, charset=self.charset,
+                                 errors=self.encoding_errors,
+                                 spool_size=self.form_spool_size)
+        for part in parser:
+            if part.name is None:
+                continue
+            if part.filename:
+                post[part.name] = FileUpload(part.file, part.name,
+                                             part.filename, part.headers)
             else:
-                post[item.name] = item.value
+                post[part.name] = part.value
         return post
 
     @cached_property
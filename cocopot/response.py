@@ -337,9 +337,16 @@ class Response(object):
         return out
 
     def __call__(self, environ, start_response):
-        """Process this response as WSGI application.
+        """Process this response as WSGI application.  The body of the
+        response to a HEAD request is dropped, its length is still sent.
         """
-        start_response(self._status_line, self.headerlist)
+        headers = self.headerlist
         body = self.body if isinstance(self.body, list) else [self.body]
         body = list(map(lambda x: to_bytes(x), body))
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            if 'Content-Length' not in self._headers and \
+                    self._status_code not in self.bad_headers:
+                headers.append(('Content-Length', str(sum(map(len, body)))))
+            body = []
+        start_response(self._status_line, headers)
         return body
@@ -1,10 +1,336 @@
-
 import re
+import os
+import bisect
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
 from .exceptions import BadRequest, NotFound, MethodNotAllowed
+from .utils import urlquote, json
+from ._compat import PY2, to_bytes, to_unicode, string_types
 
 class RouteSyntaxError(Exception):
     pass
 
+
+class RouteBuildError(LookupError):
+    pass
+
+
+_url_safe = re.compile(r'[A-Za-z0-9_.\-~/]*\Z').match
+
+def _quote(value, safe='/'):
+    if _url_safe(value) and (safe or '/' not in value):
+        return value
+    return urlquote(to_bytes(value) if PY2 else value, safe=safe)
+
+
+def _encode_query(items):
+    """A faster `urlencode(items, doseq=True)` for the common case of short
+    ascii keys and values."""
+    parts = []
+    for key, value in items:
+        key = _quote(to_unicode(key), '')
+        if isinstance(value, (list, tuple)):
+            parts.extend(key + '=' + _quote(to_unicode(v), '') for v in value)
+        else:
+            parts.append(key + '=' + _quote(to_unicode(value), ''))
+    return '&'.join(parts)
+
+
+def _re_flatten(p):
+    """ Turn all capturing groups in a regular expression pattern into
+        non-capturing groups. """
+    if '(' not in p:
+        return p
+    return re.sub(r'(\\*)(\(\?P<[^>]+>|\((?!\?))', lambda m: m.group(0) if
+                  len(m.group(1)) % 2 else m.group(1) + '(?:', p)
+
+
+def _prefix_key(prefix, depth):
+    """The dispatch key of a rule whose literal text before the first
+    wildcard is `prefix`: up to `depth` complete path segments of it."""
+    if not depth:
+        return ()
+    return tuple(prefix.split('/')[:-1][:depth + 1])
+
+
+_replace = getattr(os, 'replace', os.rename)
+
+#: Bumped whenever the layout of the rule records in cache files changes.
+_CACHE_VERSION = 'cocopot-routes-1'
+
+
+def _callable_key(func):
+    """Identify a filter callable across processes by its name and code."""
+    if func is None:
+        return None
+    code = getattr(func, '__code__', None)
+    digest = ''
+    if code is not None:
+        digest = hashlib.sha1(code.co_code + to_bytes(repr(code.co_consts))).hexdigest()
+    return '%s.%s:%s' % (getattr(func, '__module__', None),
+                         getattr(func, '__name__', type(func).__name__), digest)
+
+
+def _may_overlap(a, b):
+    """Whether the rules of two (name, segments, static path, pattern)
+    entries can match the same path.  A static rule is checked against the
+    other rule, two wildcards are taken to overlap, and so are rules the
+    segment tree can not represent."""
+    if a[2] is not None and b[2] is not None:
+        return a[2] == b[2]
+    if b[2] is not None:
+        a, b = b, a
+    if a[2] is not None and b[1] is None:
+        return re.match('^(%s)$' % b[3], a[2]) is not None
+    if a[1] is None or b[1] is None:
+        return True
+    a, b = a[1], b[1]
+    for i in range(max(len(a), len(b))):
+        sa = a[i] if i < len(a) else None
+        sb = b[i] if i < len(b) else None
+        if isinstance(sa, tuple) and sa[0] == 'path':
+            return sb is not None
+        if isinstance(sb, tuple) and sb[0] == 'path':
+            return sa is not None
+        if sa is None or sb is None:
+            return False
+        if isinstance(sa, string_types):
+            if isinstance(sb, string_types):
+                if sa != sb:
+                    return False
+            elif not sb[2](sa):
+                return False
+        elif isinstance(sb, string_types) and not sa[2](sb):
+            return False
+    return True
+
+
+#: Marker for paths the match cache knows to raise `NotFound`.
+_NOT_FOUND = object()
+
+
+class _Node(object):
+    """A node of the segment tree `Router` uses to match dynamic rules.
+    Static children are found with a dict lookup, typed wildcards are
+    checked in place against the segment.
+    """
+    __slots__ = ('static', 'wildcards', 'rule', 'tail', 'first')
+
+    def __init__(self):
+        #: literal segment -> child node
+        self.static = {}
+        #: converter name -> (segment check, child node)
+        self.wildcards = {}
+        #: (index, pattern, variables) of the rule ending at this node
+        self.rule = None
+        #: same as `rule` but for a rule ending with a `path` wildcard
+        self.tail = None
+        #: the lowest rule index found in this subtree, used for pruning
+        self.first = None
+
+
+class _RuleIndex(object):
+    """The dynamic rules registered for one HTTP method (or for any method),
+    searchable in one of the `Router.modes`.  Rules carry their position in
+    the router so every index keeps the same precedence.  Regular expressions
+    are only compiled on the first match after an `insert`.
+    """
+
+    def __init__(self, mode, max_groups, depth=0):
+        self.mode = mode
+        self.max_groups = max_groups
+        #: number of leading literal segments the regexp rules are
+        #: dispatched on, 0 tries them all
+        self.depth = depth
+        self.known = set()  # patterns already in this index
+        #: pattern -> prefix key, see `_prefix_key`
+        self.prefixes = {}
+        #: (index, pattern) of the rules matched by regexp: all rules in
+        #: `scan` mode, the ones not in the tree in `tree` mode.
+        self.patterns = []
+        #: prefix key -> [(index, pattern, match)] built from `patterns`
+        self.compiled = None
+        self.tree = _Node()
+        #: (index, pattern, flat pattern, variables), ordered
+        self.combined_rules = []
+        #: prefix key -> result of `_build_combined`, built on first match
+        #: after `insert`
+        self.combined = None
+
+    def insert(self, index, pattern, segments, flat_pattern, variables, prefix=()):
+        if pattern in self.known:
+            return
+        self.known.add(pattern)
+        self.prefixes[pattern] = prefix
+        if self.mode == 'combined':
+            bisect.insort(self.combined_rules, (index, pattern, flat_pattern, variables))
+            self.combined = None
+        elif self.mode == 'scan' or segments is None:
+            bisect.insort(self.patterns, (index, pattern))
+            self.compiled = None
+        else:
+            self._tree_insert(segments, index, pattern)
+
+    def _buckets(self, rules):
+        """Group ordered rules, tuples that start with (index, pattern), by
+        their prefix key.  The bucket of a key holds the rules of every key
+        that is a prefix of it, so a path only needs its own bucket."""
+        own = {(): []}
+        for rule in rules:
+            own.setdefault(self.prefixes[rule[1]], []).append(rule)
+        buckets = {}
+        for key in own:
+            merged = []
+            for k in range(len(key) + 1):
+                merged.extend(own.get(key[:k], ()))
+            merged.sort()
+            buckets[key] = merged
+        return buckets
+
+    def _bucket(self, buckets, path):
+        """The bucket of the longest prefix key of `path`."""
+        if len(buckets) == 1:
+            return buckets[()]
+        segs = path.split('/', self.depth + 1)
+        segs.pop()  # the last segment is incomplete, or the rest of the path
+        for k in range(len(segs), 0, -1):
+            bucket = buckets.get(tuple(segs[:k]))
+            if bucket is not None:
+                return bucket
+        return buckets[()]
+
+    def _compile(self):
+        compiled = [(index, pattern, re.compile('^(%s)$' % pattern).match)
+                    for index, pattern in self.patterns]
+        return self._buckets(compiled)
+
+    def _tree_insert(self, segments, index, pattern):
+        node = self.tree
+        variables = []
+        path = [node]
+        for seg in segments:
+            if isinstance(seg, tuple):
+                converter, variable, check = seg
+                variables.append(variable)
+                if converter == 'path':
+                    break
+                if converter not in node.wildcards:
+                    node.wildcards[converter] = (check, _Node())
+                node = node.wildcards[converter][1]
+            else:
+                child = node.static.get(seg)
+                if child is None:
+                    child = node.static[seg] = _Node()
+                node = child
+            path.append(node)
+        leaf = (index, pattern, tuple(variables))
+        if segments and isinstance(segments[-1], tuple) and segments[-1][0] == 'path':
+            if node.tail is None or node.tail[0] > index:
+                node.tail = leaf
+        elif node.rule is None or node.rule[0] > index:
+            node.rule = leaf
+        for n in path:
+            if n.first is None or n.first > index:
+                n.first = index
+
+    def _match_tree(self, node, segs, pos, values, best):
+        """Depth first search for the rule with the lowest index that matches
+        `segs[pos:]`.  `best` is the best (index, pattern, variables, values)
+        tuple found so far, subtrees that can not beat it are skipped.
+        """
+        if best is not None and node.first >= best[0]:
+            return best
+        if pos == len(segs):
+            rule = node.rule
+            if rule is not None and (best is None or rule[0] < best[0]):
+                best = rule + (values,)
+            return best
+        tail = node.tail
+        if tail is not None and (best is None or tail[0] < best[0]):
+            rest = '/'.join(segs[pos:])
+            if rest:
+                best = tail + (values + [rest],)
+        seg = segs[pos]
+        child = node.static.get(seg)
+        if child is not None:
+            best = self._match_tree(child, segs, pos + 1, values, best)
+        if seg:
+            for check, child in node.wildcards.values():
+                if check(seg):
+                    best = self._match_tree(child, segs, pos + 1, values + [seg], best)
+        return best
+
+    def _build_combined(self, rules):
+        """Merge the (index, pattern, flat pattern, variables) `rules` into as few alternation patterns as the group
+        limit allows.  Returns a list of (match, targets) tuples where
+        `targets` maps the `lastindex` of a match to (pattern, variables,
+        offset of the first variable in `groups()`).
+        """
+        combined = []
+        parts, targets, groups = [], {}, 0
+
+        def flush():
+            if parts:
+                re_combined = re.compile('^(?:%s)$' % '|'.join(parts))
+                combined.append((re_combined.match, targets))
+
+        for _, pattern, flat_pattern, variables in rules:
+            size = len(variables) + 1
+            if parts and groups + size > self.max_groups:
+                flush()
+                parts, targets, groups = [], {}, 0
+            parts.append('(%s)' % flat_pattern)
+            targets[groups + 1] = (pattern, variables, groups + 1)
+            groups += size
+        flush()
+        return combined
+
+    def match(self, path):
+        """Return the (pattern, url_args) of the first rule matching `path`,
+        or (None, None).
+        """
+        if self.mode == 'combined':
+            combined = self.combined
+            if combined is None:
+                combined = self.combined = dict(
+                    (key, self._build_combined(rules)) for key, rules
+                    in self._buckets(self.combined_rules).items())
+            for combined_match, targets in self._bucket(combined, path):
+                matched = combined_match(path)
+                if matched:
+                    pattern, variables, offset = targets[matched.lastindex]
+                    values = matched.groups()[offset:offset + len(variables)]
+                    return pattern, dict(zip(variables, values))
+            return None, None
+
+        compiled = self.compiled
+        if compiled is None:
+            compiled = self.compiled = self._compile()
+        compiled = self._bucket(compiled, path)
+        if self.mode == 'scan':
+            for _, pattern, re_match in compiled:
+                matched = re_match(path)
+                if matched:
+                    return pattern, matched.groupdict()
+            return None, None
+
+        best = None
+        if self.tree.first is not None:
+            best = self._match_tree(self.tree, path.split('/'), 0, [], None)
+        for index, pattern, re_match in compiled:
+            if best is not None and index > best[0]:
+                break
+            matched = re_match(path)
+            if matched:
+                return pattern, matched.groupdict()
+        if best is None:
+            return None, None
+        _, pattern, variables, values = best
+        return pattern, dict(zip(variables, values))
+
+
 class Router(object):
     """ A Router is an ordered collection of route->endpoint pairs. It is used to
         efficiently match WSGI requests against a number of routes and return
@@ -14,12 +340,56 @@ class Router(object):
         The path-rule is either a static path (e.g. `/contact`) or a dynamic
         path that contains wildcards (e.g. `/wiki/<page>`). The wildcard syntax
         and details on the matching order are described in docs:`routing`.
+
+        Dynamic rules are matched with a segment tree by default
+        (`mode='tree'`), so the cost of a match grows with the depth of the
+        path and not with the number of rules. Rules the tree can not
+        represent (custom filters, several wildcards in one segment, a `path`
+        wildcard that is not the last segment) are checked with their regular
+        expression. `mode='scan'` tries every rule's regular expression in
+        order, like older versions did. `mode='combined'` merges the rules
+        into a few alternation patterns with at most `_MAX_GROUPS_PER_PATTERN`
+        groups each and finds the winner with `match.lastindex`. All modes
+        return the same results.
+
+        Dynamic rules are looked up in one index of all rules.  If the first
+        rule matching the path does not accept the request method, the index
+        of rules registered for that method finds a later rule that does;
+        without one, the `Allow` header of the 405 lists the methods of the
+        first rule and of the rules that can match the same paths, which
+        are found when the rules are added.  So telling a 404 from a 405
+        takes no extra lookup.
+
+        Rules matched by regular expression are grouped by their first
+        `prefix_depth` literal segments (`/v1/users/<id>` goes with
+        `('', 'v1', 'users')`), so a request only tries the rules sharing
+        its prefix and the rules starting with a wildcard.  `prefix_depth=0`
+        tries every rule.
+
+        `build` turns an endpoint and its arguments back into an URL, using
+        the rule of the endpoint with the most wildcards that all arguments
+        are known for.
+
+        With `cache_size` set, the results of `match` are kept in a LRU cache
+        keyed on (path, method), including paths that were not found.
+
+        With `cache_file` set, compiled rules are loaded from that file and
+        the file is rewritten by `freeze` if a rule had to be compiled, see
+        `save`.  Records are only used if the rule and all filters are
+        unchanged.
     """
     #: The current CPython regexp implementation does not allow more
     #: than 99 matching groups per regular expression.
     _MAX_GROUPS_PER_PATTERN = 99
 
-    def __init__(self, strict=False):
+    modes = ('tree', 'scan', 'combined')
+
+    def __init__(self, strict=False, mode='tree', cache_size=0, cache_file=None,
+                 prefix_depth=2):
+        if mode not in self.modes:
+            raise ValueError('Unknown router mode: %r' % mode)
+        self.mode = mode
+        self.prefix_depth = prefix_depth
         self.static_routes = {}  # Search structure for static routes
         self.dynamic_patterns = []
         self.dynamic_routes = {}
@@ -31,12 +401,76 @@ class Router(object):
             'float': lambda: (r'-?[\d.]+', float, lambda x: str(float(x))),
             'path': lambda: (r'.+?', None, None)
         }
+        #: Filters the segment tree knows how to check without a regexp
+        #: over the full path. `add_filter` removes a name from here.
+        self.segment_checks = {
+            'string': bool,
+            'int': re.compile(r'-?\d+\Z').match,
+            'float': re.compile(r'-?[\d.]+\Z').match,
+            'path': None,  # only as the last segment, matches the rest
+        }
+        self.rule_index = {}  # pattern -> position in dynamic_patterns
+        #: pattern -> (segments, flat pattern, variables, prefix key) of
+        #: dynamic rules
+        self.rule_parts = {}
+        #: Dynamic rules by HTTP method, used when the first rule matching a
+        #: path does not accept the request method.
+        self.method_indexes = {}
+        #: All dynamic rules regardless of the method, matching looks here
+        #: first.
+        self.any_index = self._new_index()
+        #: rule (static) or pattern (dynamic) -> sorted methods of it and of
+        #: the rules that can match the same paths, the content of the
+        #: `Allow` header of a 405.
+        self.allowed_methods = {}
+        #: rule or pattern -> rules and patterns that can match the same
+        #: paths, see `_add_overlaps`
+        self.overlaps = {}
+        #: leading literal segments -> (name, segments, static path, pattern)
+        #: of the rules starting with exactly them, and of the rules
+        #: starting with them and more
+        self.overlap_keys = {}
+        self.overlap_longer = {}
+        #: Maximum number of entries in the match cache, 0 disables it.
+        self.cache_size = cache_size
+        self.match_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_hits = self.cache_misses = self.cache_evictions = 0
+        #: endpoint -> list of (rule, template, variables, defaults) used by
+        #: `build`, rules with more variables first.
+        self.builders = {}
+        self.build_cache = {}  # endpoint -> URL of rules without wildcards
+        #: rule -> compiled record, what `save` writes to the cache file.
+        #: Only kept with a `cache_file` and until it is saved.
+        self.rule_records = {} if cache_file else None
+        #: File the compiled rules are loaded from and saved to, see `save`.
+        self.cache_file = cache_file
+        self.cached_rules = None  # records of `cache_file`, loaded on `add`
+        self.cache_key = None  # rule set hash of `cache_file`
+        self.cache_stale = False  # a rule was compiled that is not in the file
 
     def add_filter(self, name, func):
         """ Add a filter. The provided function is called with the configuration
         string as parameter and must return a (regexp, to_python, to_url) tuple.
         The first element is a string, the last two are callables or None. """
         self.filters[name] = func
+        self.segment_checks.pop(name, None)
+        # Records compiled with the old filter are no longer valid.
+        self.cached_rules = None
+        if self.rule_records:
+            self.rule_records.clear()
+
+    def clear_cache(self):
+        """ Drop all entries of the match cache. """
+        with self.cache_lock:
+            self.match_cache.clear()
+
+    def cache_info(self):
+        """ Return a dict with the hits, misses, evictions, current size and
+        maximum size of the match cache. """
+        return dict(hits=self.cache_hits, misses=self.cache_misses,
+                    evictions=self.cache_evictions,
+                    size=len(self.match_cache), maxsize=self.cache_size)
 
     rule_syntax = re.compile('(?:<([a-zA-Z_]+:)?(?:([a-zA-Z_][a-zA-Z_0-9]*))>)')
 
@@ -57,64 +491,381 @@ class Router(object):
         if offset <= len(rule) or prefix:
             yield prefix + rule[offset:], None, None
 
-    def add(self, rule, endpoint, methods=['GET'], defaults=None):
-        """ Add a new rule or replace the endpoint for an existing rule. """
+    def _split_segments(self, tokens):
+        """Split the tokens of a rule into path segments.  Returns a list of
+        literal strings and [converter, variable] lists, or `None` if the
+        rule can not be stored in the segment tree.
+        """
+        segments = [[]]
+        for key, converter, variable in tokens:
+            if converter:
+                segments[-1].append([converter, variable])
+            elif key:
+                pieces = key.split('/')
+                if pieces[0]:
+                    segments[-1].append(pieces[0])
+                for piece in pieces[1:]:
+                    segments.append([piece] if piece else [])
+        result = []
+        last = len(segments) - 1
+        for i, parts in enumerate(segments):
+            if not parts:
+                result.append('')
+            elif len(parts) > 1:
+                return None
+            elif isinstance(parts[0], list):
+                converter = parts[0][0]
+                if converter not in self.segment_checks:
+                    return None
+                if converter == 'path' and i != last:
+                    return None
+                result.append(parts[0])
+            else:
+                result.append(parts[0])
+        return result
+
+    def _compile_rule(self, rule):
+        """Tokenize `rule` and return its record: a list of (is_static,
+        pattern, flat pattern, variables, segments, filters, builder) that
+        only holds strings, so it can be stored in the route cache file.
+        Filters and converters are referenced by name.
+        """
         pattern = ''  # Regular expression pattern with named groups
+        flat_pattern = ''  # Same, but only the wildcards are (unnamed) groups
+        variables = []  # Names of the wildcards in order
         filters = []  # Lists of wildcard input filters
         builder = []  # Data structure for the URL builder
         is_static = True
 
-        for key, converter, variable in self._itertokens(rule):
+        tokens = list(self._itertokens(rule))
+        for key, converter, variable in tokens:
             if converter:
                 is_static = False
                 mask, in_filter, out_filter = self.filters[converter]()
                 pattern += '(?P<%s>%s)' % (variable, mask)
-                if in_filter: filters.append((variable, in_filter))
-                builder.append((variable, out_filter or str))
+                flat_pattern += '(%s)' % _re_flatten(mask)
+                variables.append(variable)
+                if in_filter: filters.append([variable, converter])
+                builder.append([variable, converter])
             elif key:
                 pattern += re.escape(key)
-                builder.append((None, key))
+                flat_pattern += re.escape(key)
+                builder.append([None, key])
+
+        if not is_static:
+            try:
+                re.compile('^(%s)$' % pattern)
+            except re.error as _e:
+                raise RouteSyntaxError("Could not add Route: %s (%s)" %
+                                       (rule, _e))
+        segments = self._split_segments(tokens)
+        return [is_static, pattern, flat_pattern, variables, segments,
+                filters, builder]
+
+    def _new_index(self):
+        return _RuleIndex(self.mode, self._MAX_GROUPS_PER_PATTERN, self.prefix_depth)
+
+    def _link_rule(self, record):
+        """Resolve the filter and converter names of a rule record to the
+        callables of this router."""
+        is_static, pattern, flat_pattern, variables, segments, filters, builder = record
+        funcs = {}
+        for name in set([c for _, c in filters] + [c for v, c in builder if v]):
+            funcs[name] = self.filters[name]()
+        filters = [(v, funcs[c][1]) for v, c in filters]
+        # Only a `path` value may keep its slashes in a built url.
+        builder = [(v, funcs[c][2] or str, '/' if c == 'path' else '') if v
+                   else (None, c, None) for v, c in builder]
+        if segments is not None:
+            segments = [s if isinstance(s, string_types) else
+                        (s[0], s[1], self.segment_checks[s[0]]) for s in segments]
+        return is_static, pattern, flat_pattern, tuple(variables), segments, \
+            filters, builder
+
+    def add(self, rule, endpoint, methods=['GET'], defaults=None):
+        """ Add a new rule or replace the endpoint for an existing rule. """
+        if self.match_cache:
+            self.clear_cache()
+        self.build_cache.clear()
+
+        linked = None
+        if self.cache_file:
+            if self.cached_rules is None:
+                self.cached_rules = self._load_cache()
+            record = self.cached_rules.get(rule)
+            if record is not None:
+                try:
+                    linked = self._link_rule(record)
+                except (KeyError, TypeError, ValueError):
+                    linked = None
+        if linked is None:
+            record = self._compile_rule(rule)
+            linked = self._link_rule(record)
+            self.cache_stale = self.rule_records is not None
+        if self.rule_records is not None:
+            self.rule_records[rule] = record
+        is_static, pattern, flat_pattern, variables, segments, filters, builder = linked
 
         rule_args = dict(endpoint=endpoint, rule=rule, filters=filters,
                         builder=builder, pattern=pattern, defaults=defaults)
+        self._add_builder(endpoint, rule, builder, defaults)
+        methods = [m.upper() for m in methods]
         if is_static and not self.strict_order:
-            self.static_routes[rule] = dict([(m.upper(), rule_args)for m in methods])
+            routes = self.static_routes.setdefault(rule, {})
+            routes.update(dict([(m, rule_args) for m in methods]))
+            self._add_overlaps(rule, segments, rule, pattern, builder)
             return
 
+        if pattern in self.rule_index:
+            index = self.rule_index[pattern]
+        else:
+            index = self.rule_index[pattern] = len(self.dynamic_patterns)
+            self.dynamic_patterns.append(pattern)
+            prefix = builder[0][1] if builder[0][0] is None else ''
+            self.rule_parts[pattern] = (segments, flat_pattern, variables,
+                                        _prefix_key(prefix, self.prefix_depth))
+        parts = self.rule_parts[pattern]
+        self.any_index.insert(index, pattern, *parts)
+        for m in methods:
+            if m not in self.method_indexes:
+                self.method_indexes[m] = self._new_index()
+            self.method_indexes[m].insert(index, pattern, *parts)
+        routes = self.dynamic_routes.setdefault(pattern, {})
+        routes.update(dict([(m, rule_args) for m in methods]))
+        self._add_overlaps(pattern, segments, rule if is_static else None,
+                           pattern, builder)
+
+    def _add_overlaps(self, name, segments, static, pattern, builder):
+        """Record which rules can match the same paths as the rule or
+        pattern `name`, whose path is `static` if it has no wildcards, and
+        update the allowed methods of all of them.  Only
+        rules whose leading literal segments are a prefix of each other's
+        are compared."""
+        if name not in self.overlaps:
+            if segments is not None:
+                key = []
+                for seg in segments:
+                    if not isinstance(seg, string_types):
+                        break
+                    key.append(seg)
+                key = tuple(key)
+            else:
+                prefix = builder[0][1] if builder[0][0] is None else ''
+                key = tuple(prefix.split('/')[:-1])
+            entry = (name, segments, static, pattern)
+            overlaps = self.overlaps[name] = set()
+            candidates = list(self.overlap_longer.get(key, ()))
+            for k in range(len(key) + 1):
+                candidates.extend(self.overlap_keys.get(key[:k], ()))
+            for other in candidates:
+                if _may_overlap(entry, other):
+                    overlaps.add(other[0])
+                    self.overlaps[other[0]].add(name)
+            self.overlap_keys.setdefault(key, []).append(entry)
+            for k in range(len(key)):
+                self.overlap_longer.setdefault(key[:k], []).append(entry)
+        for n in [name] + list(self.overlaps[name]):
+            allowed = set(self._own_methods(n))
+            for other in self.overlaps[n]:
+                allowed.update(self._own_methods(other))
+            self.allowed_methods[n] = tuple(sorted(allowed))
+
+    def _own_methods(self, name):
+        routes = self.dynamic_routes.get(name)
+        if routes is None:
+            routes = self.static_routes.get(name, ())
+        return routes
+
+    def _filters_key(self):
+        """A hash of everything the rule records depend on besides the rule
+        itself: the filters and which of them the segment tree can check."""
+        parts = [_CACHE_VERSION]
+        for name in sorted(self.filters):
+            mask, in_filter, out_filter = self.filters[name]()
+            parts.append('%s:%s:%s:%s:%s' % (name, mask, _callable_key(in_filter),
+                         _callable_key(out_filter), name in self.segment_checks))
+        return hashlib.sha1(to_bytes('\n'.join(parts))).hexdigest()
+
+    def _rules_key(self, filters_key, records):
+        """A hash of the rule set together with the filters."""
+        data = json.dumps([filters_key, sorted(records.items())],
+                          sort_keys=True)
+        return hashlib.sha1(to_bytes(data)).hexdigest()
+
+    def _load_cache(self):
+        """Return the rule records of the cache file, or an empty dict if the
+        file is missing, unreadable or was written for other filters."""
+        self.cache_key = None
         try:
-            re_pattern = re.compile('^(%s)$' % pattern)
-            re_match = re_pattern.match
-        except re.error as _e:
-            raise RouteSyntaxError("Could not add Route: %s (%s)" %
-                                   (rule, _e()))
+            with open(self.cache_file) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('filters') != self._filters_key():
+            return {}
+        self.cache_key = data.get('key')
+        return data.get('rules') or {}
 
-        rule_args['match'] = re_match
+    def save(self, path=None):
+        """ Write the compiled rules to `path` (defaults to `cache_file`).  A
+        router created with the same `cache_file` loads them back in `add`
+        instead of tokenizing and compiling every rule again.  Nothing is
+        written if the file already holds this exact rule set.
 
-        self.dynamic_patterns.append(re_pattern)
-        self.dynamic_routes[re_pattern] = dict([(m.upper(), rule_args)for m in methods])
+        The records are dropped afterwards, rules added later are written
+        by the next process that compiles them. """
+        records, self.rule_records = self.rule_records, None
+        self.cached_rules = {}
+        self.cache_stale = False
+        if records is None:
+            return
+        path = path or self.cache_file
+        filters_key = self._filters_key()
+        key = self._rules_key(filters_key, records)
+        if path == self.cache_file and key == self.cache_key:
+            return
+        data = dict(filters=filters_key, key=key, rules=records)
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(prefix='.routes', suffix='.tmp',
+                                       dir=os.path.dirname(os.path.abspath(path)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            _replace(tmp, path)
+        except (IOError, OSError):
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+            return
+        if path == self.cache_file:
+            self.cache_key = key
 
+    def freeze(self):
+        """ Call once all rules are added: saves the `cache_file` if a rule
+        had to be compiled and drops the records kept for it. """
+        if self.cache_stale:
+            self.save()
+        self.rule_records = None
+        self.cached_rules = {}
 
+    def _add_builder(self, endpoint, rule, builder, defaults):
+        """Compile the builder of a rule into a `%` template and the
+        (variable, to_url, safe) triples that fill it."""
+        builders = self.builders.setdefault(endpoint, [])
+        for b in builders:
+            if b[0] == rule:
+                return
+        template, variables = '', []
+        for variable, part, safe in builder:
+            if variable is None:
+                template += part.replace('%', '%%')
+            else:
+                template += '%s'
+                variables.append((variable, part, safe))
+        builders.append((rule, template, tuple(variables), defaults or {}))
+        # Prefer the rules that consume the most arguments.
+        builders.sort(key=lambda b: -len(b[2]))
+
+    def build(self, endpoint, **args):
+        """ Build an URL for `endpoint`.  Arguments that are not part of the
+        rule are appended as query string.  Raise `RouteBuildError` if no rule
+        of the endpoint can be built with the given arguments. """
+        if not args:
+            url = self.build_cache.get(endpoint)
+            if url is not None:
+                return url
+        for rule, template, variables, defaults in self.builders.get(endpoint, ()):
+            values = []
+            for name, to_url, safe in variables:
+                if name in args:
+                    value = args[name]
+                elif name in defaults:
+                    value = defaults[name]
+                else:
+                    break
+                try:
+                    value = to_url(value)
+                except (ValueError, TypeError) as e:
+                    raise RouteBuildError('Could not build url for endpoint %r: '
+                                          'bad value %r for %r (%s)' %
+                                          (endpoint, value, name, e))
+                values.append(_quote(value, safe))
+            else:
+                url = template % tuple(values)
+                if not args:
+                    if not variables:
+                        self.build_cache[endpoint] = url
+                    return url
+                names = set(v[0] for v in variables)
+                query = [(k, v) for k, v in args.items()
+                         if k not in names and k not in defaults and v is not None]
+                if query:
+                    url += '?' + _encode_query(query)
+                return url
+        raise RouteBuildError('Could not build url for endpoint %r with '
+                              'arguments %r' % (endpoint, sorted(args)))
 
     def match(self, path, method='GET'):
         """ Return a (endpoint, url_args) tuple or raise HTTPException(400/404/405). """
-        rule_args = self.static_routes.get(path)
-        url_args = {}
-        if not rule_args:
-            for re_pattern in self.dynamic_patterns:
-                matched = re_pattern.match(path)
-                if matched:
-                    url_args = matched.groupdict()
-                    rule_args = self.dynamic_routes[re_pattern]
-                    break
+        if not self.cache_size:
+            return self._match(path, method)
 
-        if not rule_args:
-            raise NotFound("Not found: " + repr(path))
+        key = (path, method)
+        cache = self.match_cache
+        with self.cache_lock:
+            result = cache.pop(key, None)
+            if result is None:
+                self.cache_misses += 1
+            else:
+                cache[key] = result
+                self.cache_hits += 1
+        if result is not None:
+            if result is _NOT_FOUND:
+                raise NotFound("Not found: " + repr(path))
+            return result[0], dict(result[1])
 
-        if method not in rule_args:
-            allow_header = ",".join(sorted(rule_args.keys()))
-            raise MethodNotAllowed("Method not allowed. Allowed methods: %s"%(allow_header))
+        try:
+            endpoint, url_args = self._match(path, method)
+            result = (endpoint, dict(url_args))
+        except NotFound:
+            result = _NOT_FOUND
+            raise
+        finally:
+            if result is not None:
+                with self.cache_lock:
+                    cache[key] = result
+                    while len(cache) > self.cache_size:
+                        cache.popitem(last=False)
+                        self.cache_evictions += 1
+        return endpoint, url_args
+
+    def _match(self, path, method):
+        static = self.static_routes.get(path)
+        if static and method in static:
+            args, url_args = static[method], {}
+        else:
+            pattern, url_args = self.any_index.match(path)
+            routes = self.dynamic_routes[pattern] if pattern is not None else {}
+            if method in routes:
+                args = routes[method]
+            else:
+                # A later rule may accept the method, only the index of the
+                # method knows.
+                index = self.method_indexes.get(method)
+                other = None
+                if pattern is not None and index is not None:
+                    other, other_args = index.match(path)
+                if other is not None:
+                    args, url_args = self.dynamic_routes[other][method], other_args
+                elif not static and pattern is None:
+                    raise NotFound("Not found: " + repr(path))
+                else:
+                    allowed = self.allowed_methods[path if static else pattern]
+                    raise MethodNotAllowed(allowed, "Method not allowed. Allowed "
+                                           "methods: %s" % ",".join(allowed))
 
-        args = rule_args[method]
         filters = args.get('filters')
         defaults = args.get('defaults') or {}
         if filters:
@@ -1,21 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+    The built-in server behind `Cocopot.run`, based on `wsgiref`.
+"""
+import os
+import time
+import errno
+import random
+import itertools
+import socket
+import signal
+import threading
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
 
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
 
-def run_simple(hostname, port, app, **kwargs):
-    from wsgiref.simple_server import make_server
-    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
-    import socket
 
-    class FixedHandler(WSGIRequestHandler):
-        def address_string(self):  # Prevent reverse DNS lookups please.
-            return self.client_address[0]
+class FixedHandler(WSGIRequestHandler):
+    def address_string(self):  # Prevent reverse DNS lookups please.
+        return self.client_address[0]
 
-        def log_request(*args, **kw):
-            return WSGIRequestHandler.log_request(*args, **kw)
+    def log_request(*args, **kw):
+        return WSGIRequestHandler.log_request(*args, **kw)
 
-    srv = make_server(hostname, port, app, WSGIServer, FixedHandler)
+
+class ThreadPoolMixIn(object):
+    """Serve connections in a fixed pool of `pool_size` worker threads.
+
+    The accept loop hands accepted connections to the workers through a
+    queue of `pool_size` entries.  While that queue is full the server stops
+    accepting and further clients wait in the listen backlog of the socket
+    (`request_queue_size`), so a burst of clients does not start a thread
+    each.  The workers are started with the first request, after a
+    pre-forking server forked its worker processes.
+    """
+
+    #: number of worker threads
+    pool_size = 8
+    #: seconds `server_close` waits for the workers to finish
+    shutdown_timeout = 10.0
+    _workers = ()
+
+    def start_workers(self):
+        self._connections = queue.Queue(self.pool_size)
+        self._workers = []
+        for i in range(self.pool_size):
+            t = threading.Thread(target=self._work, name='cocopot-worker-%d' % i)
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def _work(self):
+        while True:
+            item = self._connections.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        if not self._workers:
+            self.start_workers()
+        self._connections.put((request, client_address))
+
+    def stop_workers(self):
+        """Let the workers serve the connections already accepted, then
+        stop them."""
+        workers, self._workers = self._workers, []
+        for _ in workers:
+            self._connections.put(None)
+        for t in workers:
+            t.join(self.shutdown_timeout)
+
+
+class ThreadPoolWSGIServer(ThreadPoolMixIn, WSGIServer):
+    """A `WSGIServer` serving requests in a thread pool."""
+
+    def server_close(self):
+        WSGIServer.server_close(self)
+        self.stop_workers()
+
+
+def make_server(hostname, port, app, threaded=False, pool_size=None,
+                backlog=128, reuse_port=False, keep_alive=False):
+    """Create a server for `app` listening on `hostname` and `port`.
+
+    Args:
+
+      * threaded: serve requests in a pool of worker threads instead of one
+                  at a time.
+      * pool_size: the number of worker threads, defaults to 8.  Implies
+                   `threaded`.
+      * backlog: the size of the listen backlog of the socket.
+      * reuse_port: set `SO_REUSEPORT` on the socket, so several processes
+                    can listen on the same port.
+      * keep_alive: use the event-driven `cocopot.server.HTTPServer`
+                    instead of `wsgiref`.  It keeps connections open between
+                    requests and always serves requests in a pool of
+                    `pool_size` threads.
+    """
+    if keep_alive:
+        from cocopot.server import HTTPServer
+        srv = HTTPServer((hostname, port), app, backlog=backlog,
+                         reuse_port=reuse_port)
+        if pool_size:
+            srv.pool_size = pool_size
+        return srv
+    if threaded or pool_size:
+        srv = ThreadPoolWSGIServer((hostname, port), FixedHandler, False)
+        if pool_size:
+            srv.pool_size = pool_size
+    else:
+        srv = WSGIServer((hostname, port), FixedHandler, False)
+    srv.request_queue_size = backlog
+    try:
+        if reuse_port:
+            srv.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        srv.server_bind()
+        srv.server_activate()
+    except Exception:
+        srv.server_close()
+        raise
+    srv.set_app(app)
+    return srv
+
+
+class PreforkServer(object):
+    """Serve `app` in `processes` worker processes forked from this one.
+
+    The application is loaded once, in the master process, and shared by
+    the workers copy-on-write.  The workers accept connections on the
+    listening socket they inherit, or with `reuse_port` on sockets of their
+    own bound with `SO_REUSEPORT`, which lets the kernel spread connections
+    evenly.  Other options are passed to `make_server`, so every worker can
+    also use a thread pool.
+
+    The master restarts workers that die.  SIGTERM or SIGINT stop it: it
+    sends SIGTERM to the workers, which stop accepting and serve the
+    requests they already accepted, and kills the workers that are still
+    running after `graceful_timeout` seconds.
+
+    Workers are recycled once they served `max_requests` requests, plus a
+    random number up to `max_requests_jitter` so they do not all restart at
+    once, or when their resident memory grows above `max_rss_mb`.  It is
+    read from `/proc/self/statm` at most every `rss_check_interval`
+    seconds, on Linux only.  A recycled worker stops accepting, serves the
+    requests it accepted and exits, the master starts a new one.  Until it
+    runs the other workers accept the new connections, or they wait in the
+    listen backlog.  With `reuse_port` the connections waiting for the
+    socket of the recycled worker are dropped though.
+
+    `stats` returns the number of workers replaced for each reason, it is
+    shared with the workers: the application finds the server in
+    `request.environ['cocopot.supervisor']`.
+    """
+
+    #: seconds the workers get to finish their requests on shutdown
+    graceful_timeout = 30.0
+    #: seconds between two checks of the workers
+    poll_interval = 0.2
+    #: seconds between two reads of the resident memory of a worker
+    rss_check_interval = 1.0
+
+    def __init__(self, hostname, port, app, processes, reuse_port=False,
+                 max_requests=None, max_requests_jitter=0, max_rss_mb=None,
+                 **options):
+        self.app = app
+        self.processes = processes
+        self.reuse_port = reuse_port
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss_mb = max_rss_mb
+        self.options = options
+        if reuse_port:
+            # Hold the port (and find it when `port` is 0) without
+            # listening, the workers bind their own sockets to it.
+            self.server = None
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.socket.bind((hostname, port))
+        else:
+            self.server = make_server(hostname, port, app, **options)
+            self.socket = self.server.socket
+            # All workers wait for the same socket, those that lose the race
+            # for a connection must not block in accept().
+            self.socket.setblocking(False)
+        self.hostname = hostname
+        self.port = self.socket.getsockname()[1]
+        #: maps the pids of the running workers to their start time
+        self.workers = {}
+        # the number of workers replaced for every reason, in shared memory
+        from multiprocessing.sharedctypes import RawArray
+        self._replaced = RawArray('l', len(_REPLACE_REASONS))
+        self.stopping = False
+
+    def stats(self):
+        """The number of workers running and replaced, as dict."""
+        rv = dict(zip(_REPLACE_REASONS, self._replaced))
+        rv['workers'] = self.processes
+        rv['recycled'] = rv['max_requests'] + rv['max_rss']
+        return rv
+
+    def spawn_worker(self):
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.time()
+            return pid
+        status = 0
+        try:
+            self.run_worker(max_requests)
+        except SystemExit as e:
+            status = e.code or 0
+        except BaseException:
+            self.app.logger.exception('Worker %d failed', os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def run_worker(self, max_requests=None):
+        """Serve requests in a worker process until SIGTERM, or until it
+        should be recycled.  Returns the reason to recycle it."""
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master stops us
+        if self.reuse_port:
+            self.socket.close()
+            srv = make_server(self.hostname, self.port, self.app,
+                              reuse_port=True, **self.options)
+        else:
+            srv = self.server
+        recycle = []
+
+        def drain(*args):
+            # shutdown() waits for serve_forever() to return, which runs
+            # in this thread.
+            t = threading.Thread(target=srv.shutdown)
+            t.daemon = True
+            t.start()
+        signal.signal(signal.SIGTERM, drain)
+
+        app, served = self.app, itertools.count(1)
+        max_rss_mb, next_rss_check = self.max_rss_mb, [0]
+
+        def over_limit():
+            if max_requests and next(served) >= max_requests:
+                return 'max_requests'
+            if max_rss_mb and time.time() >= next_rss_check[0]:
+                next_rss_check[0] = time.time() + self.rss_check_interval
+                rss = rss_mb()
+                if rss is not None and rss > max_rss_mb:
+                    return 'max_rss'
+
+        def worker_app(environ, start_response):
+            environ['cocopot.supervisor'] = self
+            try:
+                return app(environ, start_response)
+            finally:
+                reason = None if recycle else over_limit()
+                if reason:
+                    recycle.append(reason)
+                    drain()
+        srv.set_app(worker_app)
+        try:
+            srv.serve_forever()
+        finally:
+            srv.server_close()
+        if recycle:
+            raise SystemExit(_RECYCLE_STATUS[recycle[0]])
+
+    def reap_workers(self):
+        """Forget about the workers that exited, returns their pids and
+        why they exited: `max_requests`, `max_rss` or `died`."""
+        exited = []
+        for pid in list(self.workers):
+            try:
+                rv, status = os.waitpid(pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                rv, status = pid, None
+            if rv:
+                del self.workers[pid]
+                reason = 'died'
+                if status is not None and os.WIFEXITED(status):
+                    reason = _RECYCLE_REASON.get(os.WEXITSTATUS(status), 'died')
+                exited.append((pid, reason))
+        return exited
+
+    def serve_forever(self):
+        """Start the workers and supervise them until SIGTERM or SIGINT."""
+        def stop(signum, frame):
+            self.stopping = True
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        try:
+            for _ in range(self.processes):
+                self.spawn_worker()
+            while not self.stopping:
+                for pid, reason in self.reap_workers():
+                    if self.stopping:
+                        break
+                    if reason == 'died':
+                        self.app.logger.warning('Worker %d died, starting a new one', pid)
+                    else:
+                        self.app.logger.info('Worker %d reached %s, starting a new one',
+                                             pid, reason)
+                    self._replaced[_REPLACE_REASONS.index(reason)] += 1
+                    self.spawn_worker()
+                time.sleep(self.poll_interval)
+        finally:
+            self.stop()
+
+    def stop(self):
+        for pid in self.workers:
+            _kill(pid, signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while True:
+            self.reap_workers()
+            if not self.workers or time.time() >= deadline:
+                break
+            time.sleep(0.05)
+        for pid in self.workers:
+            _kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.workers.clear()
+        self.close()
+
+    def close(self):
+        """Close the listening socket of this process."""
+        if self.server is not None:
+            self.server.server_close()
+        else:
+            self.socket.close()
+
+
+_REPLACE_REASONS = ('died', 'max_requests', 'max_rss')
+# exit status of recycled workers
+_RECYCLE_STATUS = {'max_requests': 75, 'max_rss': 76}
+_RECYCLE_REASON = dict((v, k) for k, v in _RECYCLE_STATUS.items())
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_mb():
+    """The resident memory of this process in MB, from `/proc/self/statm`,
+    or `None` where it does not exist."""
+    try:
+        fd = os.open('/proc/self/statm', os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return int(os.read(fd, 256).split()[1]) * _PAGE_SIZE / 1048576.0
+    finally:
+        os.close(fd)
+
+
+def _kill(pid, sig):
+    try:
+        os.kill(pid, sig)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+
+def run_simple(hostname, port, app, threaded=False, pool_size=None,
+               backlog=128, processes=1, reuse_port=False, keep_alive=False,
+               max_requests=None, max_requests_jitter=0, max_rss_mb=None,
+               **kwargs):
+    """Serve `app` on `hostname` and `port` until interrupted, see
+    `make_server` for the options.  SIGTERM stops the server like CTRL+C,
+    requests already accepted are served before it returns.
+
+    With `processes` above 1, or one of `max_requests` and `max_rss_mb`
+    to recycle workers, requests are served by that many worker processes,
+    see `PreforkServer`.
+    """
+    options = dict(threaded=threaded, pool_size=pool_size, backlog=backlog,
+                   keep_alive=keep_alive)
+    if processes > 1 or max_requests or max_rss_mb:
+        srv = PreforkServer(hostname, port, app, processes,
+                            reuse_port=reuse_port, max_requests=max_requests,
+                            max_requests_jitter=max_requests_jitter,
+                            max_rss_mb=max_rss_mb, **options)
+        app.logger.info(' * Running on %s://%s:%d/ with %d workers %s'%('http', hostname, srv.port, processes, '(Press CTRL+C to quit)'))
+        srv.serve_forever()
+        return
+    srv = make_server(hostname, port, app, reuse_port=reuse_port, **options)
+    try:
+        signal.signal(signal.SIGTERM, _terminate)
+    except ValueError:  # not in the main thread
+        pass
     try:
         app.logger.info(' * Running on %s://%s:%d/ %s'%('http', hostname, port, '(Press CTRL+C to quit)'))
         srv.serve_forever()
-    except KeyboardInterrupt:
+    finally:
         srv.server_close()
-        raise
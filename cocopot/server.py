@@ -0,0 +1,694 @@
+# -*- coding: utf-8 -*-
+"""
+    An event-driven HTTP/1.1 server for WSGI applications, with keep-alive
+    and pipelining, see `cocopot.run.make_server`.  On Python 2 this needs
+    the `selectors34` backport of `selectors`.
+"""
+import re
+import sys
+import time
+import errno
+import socket
+import threading
+import traceback
+from collections import deque
+from email.utils import formatdate
+
+try:
+    import selectors
+except ImportError:  # Python 2
+    import selectors34 as selectors
+try:
+    import queue
+    from urllib.parse import unquote
+except ImportError:  # Python 2
+    import Queue as queue
+    from urllib import unquote
+
+from ._compat import PY2, BytesIO, reraise
+
+if PY2:
+    _native = str
+
+    def _unquote_path(path):
+        return unquote(path)
+else:
+    def _native(b):
+        return b.decode('latin-1')
+
+    def _unquote_path(path):
+        return unquote(path.decode('latin-1'), 'latin-1')
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+_NO_BODY_STATUS = ('1', '204', '304')
+# RFC 7230 3.2.6: a header name is a token
+_is_token = re.compile(br"[!#$%&'*+\-.^_`|~0-9A-Za-z]+\Z").match
+
+# selector key data of the listening and the wake-up socket
+_ACCEPT = object()
+_WAKEUP = object()
+
+_date_cache = [0, '']
+
+
+def http_date():
+    """The current time as value of a `Date` header, cached for a
+    second."""
+    now = int(time.time())
+    if _date_cache[0] != now:
+        _date_cache[:] = [now, formatdate(now, usegmt=True)]
+    return _date_cache[1]
+
+
+class RequestError(Exception):
+    """A request the server cannot serve, answered with `status` and
+    closing the connection."""
+
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+
+class Connection(object):
+    """A client connection and the bytes received on it that were not
+    parsed yet."""
+
+    def __init__(self, server, sock, address):
+        self.server = server
+        self.sock = sock
+        self.address = address
+        self.buffer = bytearray()
+        self.last_active = time.time()
+        self.closed = False
+        #: the parsed head of a request waiting for its body
+        self.head = None
+
+    def parse_head(self):
+        """Parse the request line and headers at the start of the buffer.
+        Returns the WSGI environment, the content length (`None` for a
+        chunked body) and whether the connection may be kept alive, or
+        `None` if the head is not complete yet."""
+        buf = self.buffer
+        while buf[:2] == b'\r\n':  # RFC 7230 3.5: ignore empty lines
+            del buf[:2]
+        end = buf.find(b'\r\n\r\n')
+        if end < 0:
+            if len(buf) > self.server.max_header_size:
+                raise RequestError('431 Request Header Fields Too Large')
+            return None
+        if end > self.server.max_header_size:
+            raise RequestError('431 Request Header Fields Too Large')
+        lines = bytes(buf[:end]).split(b'\r\n')
+        del buf[:end + 4]
+        try:
+            method, target, version = lines[0].split(b' ')
+        except ValueError:
+            raise RequestError('400 Bad Request')
+        if version not in (b'HTTP/1.1', b'HTTP/1.0'):
+            raise RequestError('505 HTTP Version Not Supported')
+        if target[:1] != b'/':
+            if b'://' in target:  # absolute form
+                target = b'/' + target.split(b'://', 1)[1].partition(b'/')[2]
+            elif target != b'*':
+                raise RequestError('400 Bad Request')
+        path, _, query = target.partition(b'?')
+        environ = self.server.base_environ.copy()
+        environ['REQUEST_METHOD'] = _native(method)
+        environ['PATH_INFO'] = _unquote_path(path) if b'%' in path else _native(path)
+        environ['QUERY_STRING'] = _native(query)
+        environ['SERVER_PROTOCOL'] = _native(version)
+        environ['REMOTE_ADDR'] = self.address[0]
+        environ['REMOTE_PORT'] = str(self.address[1])
+        for line in lines[1:]:
+            name, sep, value = line.partition(b':')
+            if not sep or not _is_token(name):
+                raise RequestError('400 Bad Request')
+            if b'_' in name:
+                # Would be taken for the header with a `-` in its place,
+                # like `Content_Length` for `Content-Length`, which a
+                # proxy in front does not do.
+                continue
+            name = _native(name).upper().replace('-', '_')
+            value = _native(value.strip(b' \t'))
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            if name in environ:
+                value = environ[name] + ',' + value
+            environ[name] = value
+
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if version == b'HTTP/1.1':
+            keep_alive = 'close' not in connection
+        else:
+            keep_alive = 'keep-alive' in connection
+        if 'HTTP_TRANSFER_ENCODING' in environ:
+            if environ['HTTP_TRANSFER_ENCODING'].lower() != 'chunked':
+                raise RequestError('501 Not Implemented')
+            environ.pop('CONTENT_LENGTH', None)
+            # The request reads the chunks itself, where they end is
+            # unknown here.
+            return environ, None, False
+        length = environ.get('CONTENT_LENGTH', '0')
+        # Only digits, `int` also takes signs, spaces and underscores.
+        if not length.isdigit():
+            raise RequestError('400 Bad Request')
+        try:
+            length = int(length)
+        except ValueError:  # other unicode digits
+            raise RequestError('400 Bad Request')
+        return environ, length, keep_alive
+
+    def next_request(self):
+        """Returns the next request as `(environ, keep_alive)` once it can
+        be served, or `None`.  Bodies up to `body_buffer_size` bytes are
+        received before, larger and chunked ones are read from the socket
+        by the application.  So are the bodies a client waits to send for
+        a `100 Continue`, which is sent when the application reads the
+        body, after it had the chance to reject it."""
+        if self.head is None:
+            self.head = self.parse_head()
+            if self.head is None:
+                return None
+        environ, length, keep_alive = self.head
+        if length is not None and length <= len(self.buffer):
+            environ['wsgi.input'] = BytesIO(bytes(self.buffer[:length]))
+            del self.buffer[:length]
+        elif environ.get('HTTP_EXPECT', '').lower() == '100-continue' \
+                and environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+            environ['wsgi.input'] = SocketInput(self, length, expect_continue=True)
+        elif length is not None and length <= self.server.body_buffer_size:
+            return None
+        else:
+            environ['wsgi.input'] = SocketInput(self, length)
+        self.head = None
+        return environ, keep_alive
+
+    def send_continue(self):
+        try:
+            self.sock.send(b'HTTP/1.1 100 Continue\r\n\r\n')
+        except socket.error:
+            pass
+
+    def fill(self, size):
+        """Receive up to `size` bytes into the buffer, blocking.  Returns
+        the number of bytes received."""
+        data = self.sock.recv(size)
+        self.buffer += data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+
+
+class SocketInput(object):
+    """`wsgi.input` for a body the server did not receive yet.  Reads at
+    most `length` bytes, or until the client stops sending with `length`
+    `None`.  With `expect_continue` the client waits for a `100 Continue`
+    before it sends the body, it is sent on the first read."""
+
+    def __init__(self, conn, length, expect_continue=False):
+        self.conn = conn
+        self.remaining = length
+        self.continue_pending = expect_continue
+
+    def _continue(self):
+        if self.continue_pending:
+            self.continue_pending = False
+            self.conn.send_continue()
+
+    def _fill(self, size):
+        buf = self.conn.buffer
+        while len(buf) < size and self.conn.fill(max(size - len(buf), 65536)):
+            pass
+
+    def read(self, size=-1):
+        self._continue()
+        remaining = self.remaining
+        if remaining is not None and (size is None or size < 0 or size > remaining):
+            size = remaining
+        if size is None or size < 0:
+            while self.conn.fill(65536):
+                pass
+            size = len(self.conn.buffer)
+        elif len(self.conn.buffer) < size:
+            self._fill(size)
+        buf = self.conn.buffer
+        data = bytes(buf[:size])
+        del buf[:size]
+        if remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def read1(self, size=-1):
+        """Like `read`, but waits to receive data only if none is
+        buffered."""
+        self._continue()
+        if not self.conn.buffer and self.remaining != 0:
+            self.conn.fill(65536)
+        buffered = len(self.conn.buffer)
+        return self.read(buffered if size is None or size < 0 else min(size, buffered))
+
+    def readline(self, size=-1):
+        self._continue()
+        buf = self.conn.buffer
+        limit = self.remaining
+        if size is not None and size >= 0:
+            limit = size if limit is None else min(limit, size)
+        start = 0
+        while True:
+            pos = buf.find(b'\n', start)
+            if pos >= 0:
+                end = pos + 1
+                break
+            if limit is not None and len(buf) >= limit:
+                end = limit
+                break
+            start = len(buf)
+            if not self.conn.fill(65536):
+                end = len(buf)
+                break
+        if limit is not None:
+            end = min(end, limit)
+        data = bytes(buf[:end])
+        del buf[:end]
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def discard(self, limit):
+        """Skip the unread rest of the body if it is shorter than `limit`,
+        returns whether the next request can be read after it.  A body
+        the client still waits to send is not asked for."""
+        if self.continue_pending or self.remaining is None or self.remaining > limit:
+            return False
+        while self.remaining:
+            if not self.read(min(self.remaining, 65536)):
+                return False
+        return True
+
+
+class HTTPServer(object):
+    """Serves a WSGI application over HTTP/1.1.
+
+    One thread waits for connections and request data with a selector and
+    parses the requests, a pool of `pool_size` worker threads calls the
+    application.  A connection is handed to a worker when a request is
+    complete, the worker also serves the requests the client pipelined
+    behind it, and hands it back to wait for the next request.  So idle
+    keep-alive connections do not take a thread.  They are closed after
+    `keep_alive_timeout` seconds without a request.
+
+    Bodies up to `body_buffer_size` bytes are received before the request
+    is handed to a worker, the application reads larger ones from the
+    socket.  A connection with a chunked request body is closed after the
+    response.
+
+    The interface is the one of `wsgiref.simple_server.WSGIServer`:
+    `serve_forever`, `shutdown`, `server_close`, `server_port`, `socket`.
+    """
+
+    #: number of worker threads calling the application
+    pool_size = 8
+    #: seconds an idle connection is kept open
+    keep_alive_timeout = 5.0
+    #: seconds a worker waits for the client to send or receive data
+    timeout = 30.0
+    #: seconds `shutdown` waits for the requests being served
+    shutdown_timeout = 10.0
+    #: the connections are not accepted beyond that number
+    max_connections = 1000
+    max_header_size = 65536
+    body_buffer_size = 65536
+    server_software = 'cocopot'
+
+    def __init__(self, server_address, app, backlog=128, reuse_port=False):
+        self.app = app
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.socket.bind(server_address)
+            self.socket.listen(backlog)
+        except Exception:
+            self.socket.close()
+            raise
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.server_name, self.server_port = self.server_address[:2]
+        self.base_environ = {
+            'SERVER_NAME': self.server_name,
+            'SERVER_PORT': str(self.server_port),
+            'SCRIPT_NAME': '',
+            'GATEWAY_INTERFACE': 'CGI/1.1',
+            'SERVER_SOFTWARE': self.server_software,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        self.connections = {}
+        self._requests = queue.Queue()
+        self._returned = deque()
+        self._workers = []
+        self._busy = 0
+        self._stop = False
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+        self._selector = None
+
+    def set_app(self, app):
+        self.app = app
+
+    # The event loop
+
+    def serve_forever(self, poll_interval=0.5):
+        """Serve requests until `shutdown` is called."""
+        self._is_shut_down.clear()
+        self._stop = False
+        self.start_workers()
+        sel = self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        sel.register(self._wake_r, selectors.EVENT_READ, _WAKEUP)
+        sel.register(self.socket, selectors.EVENT_READ, _ACCEPT)
+        self._accepting = True
+        timeout = min(poll_interval, self.keep_alive_timeout)
+        last_sweep = time.time()
+        try:
+            while not self._stop:
+                self._select(timeout)
+                now = time.time()
+                if now - last_sweep >= timeout:
+                    self.close_idle(now - self.keep_alive_timeout)
+                    last_sweep = now
+            self.drain()
+        finally:
+            for conn in list(self.connections.values()):
+                self.close_connection(conn)
+            sel.close()
+            self._wake_r.close()
+            self._wake_w.close()
+            self._selector = None
+            self._is_shut_down.set()
+
+    def _select(self, timeout):
+        for key, _ in self._selector.select(timeout):
+            data = key.data
+            if data is _ACCEPT:
+                self.accept()
+            elif data is _WAKEUP:
+                self.take_returned()
+            else:
+                self.read(data)
+
+    def accept(self):
+        while len(self.connections) < self.max_connections:
+            try:
+                sock, address = self.socket.accept()
+            except socket.error as e:
+                if e.args[0] in _WOULD_BLOCK or e.args[0] == errno.ECONNABORTED:
+                    return
+                raise
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = Connection(self, sock, address)
+            self.connections[sock] = conn
+            self._selector.register(sock, selectors.EVENT_READ, conn)
+        # Leave further clients in the listen backlog for now.
+        self._selector.unregister(self.socket)
+        self._accepting = False
+
+    def read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except socket.error as e:
+            if e.args[0] in _WOULD_BLOCK:
+                return
+            data = b''
+        if not data:
+            self.close_connection(conn)
+            return
+        conn.buffer += data
+        conn.last_active = time.time()
+        try:
+            request = conn.next_request()
+        except RequestError as e:
+            self.send_error(conn, e.status)
+            self.close_connection(conn)
+            return
+        if request is not None:
+            self._selector.unregister(conn.sock)
+            self._busy += 1
+            self._requests.put((conn, request))
+
+    def take_returned(self):
+        """Wait for the next request on the connections the workers are
+        done with."""
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except socket.error:
+            pass
+        now = time.time()
+        while self._returned:
+            conn = self._returned.popleft()
+            self._busy -= 1
+            if conn.closed or self._stop:
+                self.close_connection(conn)
+                continue
+            conn.last_active = now
+            self._selector.register(conn.sock, selectors.EVENT_READ, conn)
+
+    def close_idle(self, before):
+        for conn in list(self.connections.values()):
+            if conn.last_active < before and not conn.closed and \
+                    self._selector.get_map().get(conn.sock) is not None:
+                self.close_connection(conn)
+
+    def close_connection(self, conn):
+        if self.connections.pop(conn.sock, None) is None:
+            return
+        if not conn.closed:
+            try:
+                self._selector.unregister(conn.sock)
+            except (KeyError, ValueError):
+                pass
+            conn.close()
+        if not self._accepting and not self._stop:
+            self._selector.register(self.socket, selectors.EVENT_READ, _ACCEPT)
+            self._accepting = True
+
+    def drain(self):
+        """Stop accepting and wait until the workers served the requests
+        they got."""
+        if self._accepting:
+            self._selector.unregister(self.socket)
+            self._accepting = False
+        deadline = time.time() + self.shutdown_timeout
+        while self._busy and time.time() < deadline:
+            self._select(0.1)
+
+    def shutdown(self):
+        """Stop `serve_forever` and wait until it returns.  Must be called
+        from another thread."""
+        self._stop = True
+        self.wake()
+        self._is_shut_down.wait()
+
+    def wake(self):
+        try:
+            self._wake_w.send(b'x')
+        except (socket.error, AttributeError):
+            pass
+
+    def server_close(self):
+        self.socket.close()
+        self.stop_workers()
+
+    # The workers
+
+    def start_workers(self):
+        while len(self._workers) < self.pool_size:
+            t = threading.Thread(target=self._work,
+                                 name='cocopot-worker-%d' % len(self._workers))
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def stop_workers(self):
+        workers, self._workers = self._workers, []
+        for _ in workers:
+            self._requests.put(None)
+        for t in workers:
+            t.join(self.shutdown_timeout)
+
+    def _work(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            conn, request = item
+            try:
+                self.process(conn, request)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+                conn.close()
+            self._returned.append(conn)
+            self.wake()
+
+    def process(self, conn, request):
+        """Serve `request` and the requests pipelined behind it."""
+        conn.sock.settimeout(self.timeout)
+        try:
+            while request is not None:
+                environ, keep_alive = request
+                if not self.handle_request(conn, environ, keep_alive and not self._stop):
+                    conn.close()
+                    return
+                request = conn.next_request()
+        except RequestError as e:
+            self.send_error(conn, e.status)
+            conn.close()
+            return
+        except socket.error:
+            conn.close()
+            return
+        conn.sock.setblocking(False)
+
+    def handle_request(self, conn, environ, keep_alive):
+        """Call the application and send its response, returns whether the
+        connection can be kept alive."""
+        state = {'status': None, 'headers': None, 'sent': False,
+                 'chunked': False, 'keep_alive': keep_alive}
+        head_request = environ['REQUEST_METHOD'] == 'HEAD'
+        sock = conn.sock
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info:
+                try:
+                    if state['sent']:
+                        reraise(*exc_info)
+                finally:
+                    exc_info = None
+            elif state['status'] is not None:
+                raise AssertionError('Headers already set')
+            state['status'], state['headers'] = status, headers
+            return write
+
+        def write(data, length=None):
+            if not state['sent']:
+                if state['status'] is None:
+                    raise AssertionError('write() before start_response()')
+                head = self.make_head(environ, state, length)
+                state['sent'] = True
+            else:
+                head = b''
+            if head_request or not data:
+                if head:
+                    sock.sendall(head)
+            elif state['chunked']:
+                sock.sendall(b''.join([head, ('%x\r\n' % len(data)).encode('latin-1'),
+                                       data, b'\r\n']))
+            else:
+                sock.sendall(head + data if head else data)
+
+        try:
+            result = self.app(environ, start_response)
+            try:
+                if isinstance(result, (list, tuple)):
+                    write(b''.join(result), sum(len(data) for data in result))
+                else:
+                    for data in result:
+                        if data:
+                            write(data)
+                    if not state['sent']:
+                        write(b'', 0)
+                if state['chunked'] and not head_request:
+                    sock.sendall(b'0\r\n\r\n')
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except socket.error:
+            raise
+        except Exception:
+            traceback.print_exc(file=environ['wsgi.errors'])
+            if not state['sent']:
+                self.send_error(conn, '500 Internal Server Error')
+            return False
+        body = environ['wsgi.input']
+        if isinstance(body, SocketInput) and not body.discard(self.body_buffer_size):
+            return False
+        return state['keep_alive']
+
+    def make_head(self, environ, state, length):
+        """The status line and headers of a response, `length` is the size
+        of the body if known."""
+        status = state['status']
+        has_length = has_date = has_server = False
+        lines = ['HTTP/1.1 ', status, '\r\n']
+        for name, value in state['headers']:
+            lname = name.lower()
+            if lname == 'content-length':
+                has_length = True
+            elif lname == 'date':
+                has_date = True
+            elif lname == 'server':
+                has_server = True
+            elif lname == 'connection':
+                if value.lower() == 'close':
+                    state['keep_alive'] = False
+                continue
+            elif lname == 'transfer-encoding':
+                continue
+            lines.extend((name, ': ', value, '\r\n'))
+        if not has_date:
+            lines.extend(('Date: ', http_date(), '\r\n'))
+        if not has_server:
+            lines.extend(('Server: ', self.server_software, '\r\n'))
+        if not has_length and not status.startswith(_NO_BODY_STATUS):
+            if length is not None:
+                lines.extend(('Content-Length: ', str(length), '\r\n'))
+            elif environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+                lines.append('Transfer-Encoding: chunked\r\n')
+                state['chunked'] = True
+            else:
+                state['keep_alive'] = False
+        body = environ['wsgi.input']
+        if isinstance(body, SocketInput) and (body.continue_pending or body.remaining is None
+                                              or body.remaining > self.body_buffer_size):
+            # An answer before the body is read, like a 413, closes the
+            # connection instead of receiving the rest of the body, or
+            # waiting whether a client expecting a `100 Continue` sends it.
+            state['keep_alive'] = False
+        if not state['keep_alive']:
+            lines.append('Connection: close\r\n')
+        elif environ['SERVER_PROTOCOL'] == 'HTTP/1.0':
+            lines.append('Connection: keep-alive\r\n')
+        lines.append('\r\n')
+        return ''.join(lines).encode('latin-1')
+
+    def send_error(self, conn, status):
+        body = status.encode('latin-1')
+        response = ('HTTP/1.1 %s\r\nContent-Type: text/plain\r\n'
+                    'Content-Length: %d\r\nConnection: close\r\n\r\n'
+                    % (status, len(body))).encode('latin-1') + body
+        try:
+            conn.sock.send(response)
+        except socket.error:
+            pass
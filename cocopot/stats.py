@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+    Per endpoint request statistics, see `Cocopot.enable_route_stats`.
+"""
+import time
+import threading
+import weakref
+from bisect import bisect_left
+
+#: a monotonic high resolution clock where available
+timer = getattr(time, 'perf_counter', time.time)
+
+#: upper bounds of the latency buckets in seconds, the last bucket is open
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+
+
+class _ThreadToken(object):
+    __slots__ = ('__weakref__',)
+
+
+class RouteStats(object):
+    """Collects the request count, the status code classes and a fixed bucket
+    latency histogram per endpoint.
+
+    Every thread records into its own shard so `record` never takes a lock,
+    the shards are merged when the numbers are read with `snapshot`.  When
+    a thread exits its shard is folded into one set of retired rows, so a
+    server starting a thread per connection keeps one shard per live
+    thread.  A row of a shard is a flat list:
+
+        [count, total_seconds, 1xx, 2xx, 3xx, 4xx, 5xx, bucket0, bucket1, ...]
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.row_size = 7 + len(self.buckets) + 1
+        self._local = threading.local()
+        #: weak reference to the token of a live thread -> its shard
+        self._shards = {}
+        #: the rows of the threads that exited
+        self._retired = {}
+        # Reentrant: a thread may exit, and retire its shard, while the
+        # collector runs in a thread holding the lock.
+        self._lock = threading.RLock()
+
+    def _new_shard(self):
+        shard = {}
+        # The token only lives in the thread's local storage, it goes away
+        # with the thread.
+        token = self._local.token = _ThreadToken()
+        with self._lock:
+            self._shards[weakref.ref(token, self._retire)] = shard
+        self._local.shard = shard
+        return shard
+
+    def _retire(self, ref):
+        with self._lock:
+            shard = self._shards.pop(ref, None)
+            if shard:
+                self._merge(self._retired, shard.items())
+
+    def _merge(self, merged, rows):
+        for endpoint, row in rows:
+            total = merged.get(endpoint)
+            if total is None:
+                total = merged[endpoint] = [0] * self.row_size
+            for i, value in enumerate(row):
+                total[i] += value
+
+    def record(self, endpoint, status_code, seconds):
+        """Record one request of `endpoint`.  Requests that did not match
+        a route are recorded with `None` as endpoint.
+        """
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        row = shard.get(endpoint)
+        if row is None:
+            row = shard[endpoint] = [0] * self.row_size
+        row[0] += 1
+        row[1] += seconds
+        status_class = status_code // 100
+        if 1 <= status_class <= 5:
+            row[1 + status_class] += 1
+        row[7 + bisect_left(self.buckets, seconds)] += 1
+
+    def reset(self):
+        """Drop everything recorded so far."""
+        with self._lock:
+            for shard in self._shards.values():
+                shard.clear()
+            self._retired.clear()
+
+    def snapshot(self, endpoints=()):
+        """Merge the shards and return a dict of endpoint -> stats.  The
+        `endpoints` given are included even if they never got a request, so
+        routes without traffic show up with a count of 0.
+
+        Every entry is a dict with the keys `count`, `mean_ms`, `status`
+        (a dict like `{'2xx': 10, '4xx': 1}`) and `latency`, a list of
+        (upper bound in milliseconds, count) tuples where the last upper
+        bound is `None`.
+        """
+        merged = dict((endpoint, [0] * self.row_size) for endpoint in endpoints)
+        with self._lock:
+            shards = list(self._shards.values())
+            self._merge(merged, self._retired.items())
+        for shard in shards:
+            self._merge(merged, list(shard.items()))
+        bounds = [b * 1000 for b in self.buckets] + [None]
+        rv = {}
+        for endpoint, row in merged.items():
+            count = row[0]
+            rv[endpoint] = {
+                'count': count,
+                'mean_ms': row[1] * 1000 / count if count else 0.0,
+                'status': dict(('%dxx' % (i + 1), row[2 + i])
+                               for i in range(5) if row[2 + i]),
+                'latency': list(zip(bounds, row[7:])),
+            }
+        return rv
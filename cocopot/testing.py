@@ -200,4 +200,4 @@ class CocopotClient(object):
             return resp_buffer.append
 
         app_rv = app(environ, start_response)
-        return  app_rv[0], response[0], response[1]
+        return (app_rv[0] if app_rv else b''), response[0], response[1]
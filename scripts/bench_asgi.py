@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Compare the throughput of `Cocopot.wsgi_app` and `Cocopot.asgi_app`.
+
+    The load is generated in process, without sockets, so only the
+    application side is measured: WSGI requests are served by a pool of
+    threads like a threaded server does, ASGI requests are tasks on one
+    event loop.  The `poll` workload sleeps in the view, like a long-poll
+    endpoint waiting for an event.  Needs Python 3.5 or newer.
+"""
+from __future__ import print_function
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cocopot
+from cocopot._compat import BytesIO
+
+POLL_SECONDS = 0.05
+
+
+def make_app():
+    app = cocopot.Cocopot('bench')
+
+    @app.route('/hello')
+    def hello():
+        return 'Hello World!'
+
+    @app.route('/async/hello')
+    async def async_hello():
+        return 'Hello World!'
+
+    @app.route('/poll')
+    def poll():
+        time.sleep(POLL_SECONDS)
+        return 'event'
+
+    @app.route('/async/poll')
+    async def async_poll():
+        await asyncio.sleep(POLL_SECONDS)
+        return 'event'
+
+    return app
+
+
+def make_environ(path):
+    return {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path,
+        'QUERY_STRING': '', 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'localhost',
+        'CONTENT_LENGTH': '0', 'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr,
+    }
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def bench_wsgi(app, path, requests, threads):
+    def one(_):
+        app(make_environ(path), start_response)
+
+    with ThreadPoolExecutor(threads) as pool:
+        start = time.time()
+        list(pool.map(one, range(requests)))
+        return time.time() - start
+
+
+def bench_asgi(app, path, requests, concurrency):
+    scope = {'type': 'http', 'method': 'GET', 'path': path,
+             'query_string': b'', 'headers': [(b'host', b'localhost')]}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        pass
+
+    async def client(count):
+        for _ in range(count):
+            await app(dict(scope), receive, send)
+
+    async def run():
+        per_client = [requests // concurrency] * concurrency
+        per_client[0] += requests % concurrency
+        start = time.time()
+        await asyncio.gather(*[client(n) for n in per_client])
+        return time.time() - start
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WSGI/ASGI throughput')
+    parser.add_argument('-n', '--requests', type=int, default=20000)
+    parser.add_argument('-t', '--threads', type=int, default=16,
+                        help='WSGI server threads, also the ASGI thread pool size')
+    parser.add_argument('-c', '--concurrency', type=int, default=1000,
+                        help='concurrent ASGI clients for the poll workload')
+    args = parser.parse_args()
+
+    app = make_app()
+    from cocopot.asgi import ASGIHandler
+    app.asgi_handler = ASGIHandler(app, max_workers=args.threads)
+    poll_requests = max(args.concurrency, args.requests // 10)
+    runs = [
+        ('hello', 'WSGI, %d threads' % args.threads, args.requests,
+         lambda: bench_wsgi(app, '/hello', args.requests, args.threads)),
+        ('hello', 'ASGI, sync view', args.requests,
+         lambda: bench_asgi(app, '/hello', args.requests, args.threads)),
+        ('hello', 'ASGI, async view', args.requests,
+         lambda: bench_asgi(app, '/async/hello', args.requests, args.threads)),
+        ('poll', 'WSGI, %d threads' % args.threads, poll_requests,
+         lambda: bench_wsgi(app, '/poll', poll_requests, args.threads)),
+        ('poll', 'ASGI, %d clients' % args.concurrency, poll_requests,
+         lambda: bench_asgi(app, '/async/poll', poll_requests, args.concurrency)),
+    ]
+    print('%-8s %-22s %10s %12s' % ('workload', 'server', 'requests', 'req/s'))
+    for workload, label, requests, run in runs:
+        seconds = run()
+        print('%-8s %-22s %10d %12.0f' % (workload, label, requests, requests / seconds))
+
+
+if __name__ == '__main__':
+    main()
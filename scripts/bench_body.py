@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Measure the memory taken by concurrent uploads: `--uploads` threads read
+    the body of a request of `--size` MB each through `request.stream` and
+    wait for the others before they let go of it, so all bodies are held at
+    the same time.  The peak of the memory allocated by Python is reported
+    for different `body_spool_size` values, 0 keeps the bodies in memory.
+    The `iter_body` row streams the bodies with `request.iter_body` instead,
+    all threads reading at the same time.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cocopot.request import Request
+
+
+class UploadStream(object):
+    """A `wsgi.input` sending `size` bytes without holding them."""
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def readinto(self, buf):
+        n = min(len(buf), self.remaining)
+        self.remaining -= n
+        return n
+
+    def read(self, size):
+        n = min(size, self.remaining)
+        self.remaining -= n
+        return b'\0' * n
+
+
+def upload(size, spool_size, barrier):
+    environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/upload',
+               'CONTENT_TYPE': 'application/octet-stream',
+               'CONTENT_LENGTH': str(size), 'wsgi.input': UploadStream(size)}
+    req = Request(environ)
+    if spool_size is None:
+        barrier.wait()
+        for chunk in req.iter_body():
+            pass
+        return
+    req.body_spool_size = spool_size
+    stream = req.stream
+    barrier.wait()
+    while stream.read(65536):
+        pass
+    req.close()
+
+
+def run(uploads, size, spool_size):
+    barrier = threading.Barrier(uploads)
+    threads = [threading.Thread(target=upload, args=(size, spool_size, barrier))
+               for _ in range(uploads)]
+    tracemalloc.start()
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Request body memory benchmark')
+    parser.add_argument('-n', '--uploads', type=int, default=100)
+    parser.add_argument('-s', '--size', type=float, default=8.0, help='MB per upload')
+    parser.add_argument('--spool-sizes', default='0,4194304,65536',
+                        help='comma separated body_spool_size values')
+    args = parser.parse_args()
+
+    size = int(args.size * 1024 * 1024)
+    print('%-16s %12s %10s' % ('body_spool_size', 'peak memory', 'time'))
+    for spool_size in args.spool_sizes.split(',') + [None]:
+        peak, seconds = run(args.uploads, size,
+                            int(spool_size) if spool_size is not None else None)
+        label = {'0': 'in memory', None: 'iter_body'}.get(spool_size, spool_size)
+        print('%-16s %10.1fMB %8.2fs' % (label, peak / 1048576.0, seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Compare `Request.iter_chunked` with the decoder it replaced, which read
+    size lines one byte at a time, on a 10 MB chunked body sent in 1 KB and
+    in 64 KB chunks.  The body is read from memory (`BytesIO`) and from a
+    socket file like the one `wsgiref` gives as `wsgi.input`, with `read1`
+    as `Request.get_input_stream` does.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cocopot.request import Request, COPY_BUFFER_SIZE
+from cocopot._compat import BytesIO
+
+
+def legacy_iter_chunked(read, bufsize):
+    while True:
+        header = read(1)
+        while header[-2:] != b'\r\n':
+            c = read(1)
+            header += c
+            if not c or len(header) > bufsize:
+                raise ValueError('bad chunked body')
+        maxread = int(header.partition(b';')[0].strip(), 16)
+        if maxread == 0:
+            break
+        buff = b''
+        while maxread > 0:
+            if not buff:
+                buff = read(min(maxread, bufsize))
+            part, buff = buff[:maxread], buff[maxread:]
+            if not part:
+                raise ValueError('bad chunked body')
+            yield part
+            maxread -= len(part)
+        if read(2) != b'\r\n':
+            raise ValueError('bad chunked body')
+
+
+def make_body(size, chunk_size):
+    chunk = b'%x\r\n' % chunk_size + b'x' * chunk_size + b'\r\n'
+    return chunk * (size // chunk_size) + b'0\r\n\r\n'
+
+
+def memory_stream(body):
+    return BytesIO(body)
+
+
+def socket_stream(body):
+    a, b = socket.socketpair()
+
+    def send():
+        a.sendall(body)
+        a.close()
+    t = threading.Thread(target=send)
+    t.daemon = True
+    t.start()
+    return b.makefile('rb')
+
+
+def decode_cocopot(stream):
+    req = Request({'wsgi.input': stream, 'HTTP_TRANSFER_ENCODING': 'chunked'})
+    return sum(len(part) for part in req.iter_chunked(stream.read1, COPY_BUFFER_SIZE,
+                                                      partial_reads=True))
+
+
+def decode_legacy(stream):
+    return sum(len(part) for part in legacy_iter_chunked(stream.read, COPY_BUFFER_SIZE))
+
+
+def best(func, make_stream, body, repeat):
+    times = []
+    for _ in range(repeat):
+        stream = make_stream(body)
+        start = time.time()
+        func(stream)
+        times.append(time.time() - start)
+        stream.close()
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chunked body decoder benchmark')
+    parser.add_argument('-s', '--size', type=float, default=10.0, help='MB per body')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    size = int(args.size * 1024 * 1024)
+    print('%-8s %-10s %12s %12s %8s' % ('input', 'chunks', 'legacy', 'cocopot', 'speedup'))
+    for label, make_stream in (('memory', memory_stream), ('socket', socket_stream)):
+        for chunk_size in (1024, 65536):
+            body = make_body(size, chunk_size)
+            assert decode_cocopot(make_stream(body)) == decode_legacy(make_stream(body)) == size
+            theirs = best(decode_legacy, make_stream, body, args.repeat)
+            ours = best(decode_cocopot, make_stream, body, args.repeat)
+            print('%-8s %-10s %10.2fms %10.2fms %7.1fx' % (
+                label, '%d KB' % (chunk_size // 1024), theirs * 1000, ours * 1000,
+                theirs / ours))
+
+
+if __name__ == '__main__':
+    main()
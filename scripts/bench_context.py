@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Benchmark the context stacks behind `cocopot.request` and friends:
+    `LocalStack` keyed by thread (the default up to Python 3.6), `LocalStack`
+    keyed by asyncio task (what ASGI used with it) and `ContextVarStack`
+    (the default from Python 3.7).
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cocopot
+import cocopot.globals
+from cocopot.app import RequestContext
+from cocopot.local import LocalStack, ContextVarStack, ContextVar
+from cocopot.request import Request
+from cocopot.globals import request
+from cocopot._compat import BytesIO
+
+
+def make_stacks():
+    stacks = [('LocalStack', LocalStack())]
+    try:
+        from cocopot.coroutines import _context_ident
+    except (ImportError, SyntaxError):
+        pass
+    else:
+        task_stack = LocalStack()
+        task_stack.__ident_func__ = _context_ident
+        stacks.append(('LocalStack per task', task_stack))
+    if ContextVar is not None:
+        stacks.append(('ContextVarStack', ContextVarStack()))
+    return stacks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Context stack benchmark')
+    parser.add_argument('-n', '--number', type=int, default=200000)
+    args = parser.parse_args()
+
+    app = cocopot.Cocopot('bench')
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/', 'QUERY_STRING': 'a=1',
+               'wsgi.input': BytesIO()}
+    ctx = RequestContext(app, environ, Request(environ))
+    request_args = lambda: request.args
+    print('%-22s %12s %12s %12s' % ('stack', 'top', 'request.args', 'push+pop'))
+    for label, stack in make_stacks():
+        cocopot.globals._request_ctx_stack = stack
+        stack.push(ctx)
+        request_args()  # fill the cached property
+        timings = [lambda: stack.top, request_args]
+        ns = [min(timeit.repeat(f, number=args.number, repeat=3)) / args.number * 1e9
+              for f in timings]
+        stack.pop()
+
+        def push_pop():
+            stack.push(ctx)
+            stack.pop()
+        ns.append(min(timeit.repeat(push_pop, number=args.number, repeat=3))
+                  / args.number * 1e9)
+        print('%-22s %10.0fns %10.0fns %10.0fns' % tuple([label] + ns))
+
+
+if __name__ == '__main__':
+    main()
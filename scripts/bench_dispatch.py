@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Benchmark the request dispatching of `cocopot.Cocopot` under different
+    application setups.  Every benchmark compares a baseline application
+    with a variant and prints the time per request of both.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cocopot
+from cocopot._compat import BytesIO
+
+
+def make_environ(path='/hello', method='GET'):
+    return {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': 'limit=10',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost',
+        'HTTP_USER_AGENT': 'bench',
+        'CONTENT_LENGTH': '0',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def hello_app():
+    app = cocopot.Cocopot('hello')
+
+    @app.route('/hello')
+    def hello():
+        return 'Hello World!'
+
+    return app
+
+
+def time_requests(variants, number, repeat=7):
+    """Time (label, app, environ) variants.  The runs are interleaved and
+    the best one is kept, so CPU frequency changes hit all variants alike."""
+    timers = []
+    for label, app, environ in variants:
+        def run(app=app, environ=environ):
+            app(dict(environ), start_response)
+        timers.append((label, timeit.Timer(run)))
+    best = dict((label, None) for label, _ in timers)
+    for _ in range(repeat):
+        for label, timer in timers:
+            sec = timer.timeit(number) / number
+            if best[label] is None or sec < best[label]:
+                best[label] = sec
+    return [(label, best[label]) for label, _ in timers]
+
+
+def bench_stats(number):
+    """Hello world with and without `enable_route_stats`."""
+    plain = hello_app()
+    recording = hello_app()
+    recording.enable_route_stats()
+    environ = make_environ()
+    return time_requests([('plain', plain, environ),
+                          ('route stats', recording, environ)], number)
+
+
+def hooks_app():
+    """Hello world served by a blueprint, with hooks on the app and on the
+    blueprint."""
+    app = cocopot.Cocopot('hooks')
+    bp = cocopot.Blueprint('api', url_prefix='/api')
+
+    def before():
+        pass
+
+    def after(response):
+        return response
+
+    def teardown(exc):
+        pass
+
+    for target in (app, bp):
+        target.before_request(before)
+        target.after_request(after)
+        target.teardown_request(teardown)
+
+    @bp.route('/hello')
+    def hello():
+        return 'Hello World!'
+
+    app.register_blueprint(bp)
+    return app
+
+
+def bench_hooks(number):
+    """Hello world without and with before/after/teardown hooks."""
+    return time_requests([('plain', hello_app(), make_environ()),
+                          ('hooks', hooks_app(), make_environ('/api/hello'))],
+                         number)
+
+
+def errors_app(handlers=50):
+    """A view raising the exception class whose handler was registered last
+    out of `handlers` exception handlers."""
+    app = cocopot.Cocopot('errors')
+    classes = [type('Error%d' % i, (Exception,), {}) for i in range(handlers)]
+    for cls in classes:
+        app.register_error_handler(cls, lambda e: 'Handled!')
+
+    @app.route('/hello')
+    def hello():
+        raise classes[-1]()
+    return app
+
+
+def bench_errors(number):
+    """Hello world without and with an exception out of 50 handlers."""
+    return time_requests([('plain', hello_app(), make_environ()),
+                          ('50 handlers', errors_app(), make_environ())],
+                         number)
+
+
+def bench_notfound(number):
+    """Hello world and a flood of requests to a path without route."""
+    app = hello_app()
+    return time_requests([('hello', app, make_environ()),
+                          ('404', app, make_environ('/missing'))], number)
+
+
+def fanout_app(backends=6, latency=0.002):
+    """`/serial` and `/parallel` call `backends` backends that take
+    `latency` seconds each, one after the other or with `cocopot.parallel`."""
+    app = cocopot.Cocopot('fanout')
+
+    def backend():
+        time.sleep(latency)
+        return cocopot.request.path
+
+    @app.route('/serial')
+    def serial():
+        return ','.join([backend() for _ in range(backends)])
+
+    @app.route('/parallel')
+    def parallel():
+        return ','.join(cocopot.parallel(*[backend] * backends))
+
+    return app
+
+
+def bench_fanout(number):
+    """A view calling 6 backends of 2ms, serially and with cocopot.parallel."""
+    app = fanout_app()
+    number = max(1, number // 200)
+    return time_requests([('serial', app, make_environ('/serial')),
+                          ('parallel', app, make_environ('/parallel'))],
+                         number, repeat=3)
+
+
+BENCHMARKS = {
+    'stats': bench_stats,
+    'hooks': bench_hooks,
+    'errors': bench_errors,
+    'notfound': bench_notfound,
+    'fanout': bench_fanout,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dispatch benchmark runner')
+    parser.add_argument('-b', '--benchmark', nargs='+', choices=sorted(BENCHMARKS),
+                        default=sorted(BENCHMARKS))
+    parser.add_argument('-n', '--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    for name in args.benchmark:
+        print(name + ': ' + BENCHMARKS[name].__doc__)
+        results = BENCHMARKS[name](args.number)
+        baseline = results[0][1]
+        for label, sec in results:
+            print('  %-20s %8.2fus/req %+7.1f%%' %
+                  (label, sec * 1e6, (sec / baseline - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Compare `cocopot.multipart.MultipartParser` with `cgi.FieldStorage`,
+    which `Request.parse_form_data` used before, on a 1 MB upload, a 50 MB
+    upload and a form of 200 small fields.  `cgi` is skipped where it does
+    not exist anymore (Python 3.13).
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cocopot.multipart import MultipartParser
+from cocopot._compat import BytesIO, PY2
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import cgi
+except ImportError:
+    cgi = None
+
+BOUNDARY = '----------------------------bench1234567890'
+
+
+def make_body(parts):
+    out = []
+    for name, filename, data in parts:
+        out.append(('--%s\r\n' % BOUNDARY).encode('latin-1'))
+        disposition = 'Content-Disposition: form-data; name="%s"' % name
+        if filename:
+            disposition += '; filename="%s"\r\nContent-Type: image/jpeg' % filename
+        out.append((disposition + '\r\n\r\n').encode('latin-1'))
+        out.append(data)
+        out.append(b'\r\n')
+    out.append(('--%s--\r\n' % BOUNDARY).encode('latin-1'))
+    return b''.join(out)
+
+
+def make_bodies():
+    photo = os.urandom(1024 * 1024)
+    return [
+        ('1 MB file', make_body([('caption', None, b'holiday'),
+                                 ('photo', 'a.jpg', photo)])),
+        ('50 MB file', make_body([('caption', None, b'logs'),
+                                  ('photo', 'b.jpg', photo * 50)])),
+        ('200 fields', make_body([('field%d' % i, None, ('value %d' % i).encode('latin-1'))
+                                  for i in range(200)])),
+    ]
+
+
+def parse_cocopot(body):
+    for part in MultipartParser(BytesIO(body), BOUNDARY, len(body)):
+        if part.file is not None:
+            part.file.close()
+        else:
+            part.value
+
+
+def parse_cgi(body):
+    environ = {'REQUEST_METHOD': 'POST', 'QUERY_STRING': '',
+               'CONTENT_TYPE': 'multipart/form-data; boundary=%s' % BOUNDARY,
+               'CONTENT_LENGTH': str(len(body))}
+    kwargs = {} if PY2 else {'encoding': 'utf8'}
+    form = cgi.FieldStorage(fp=BytesIO(body), environ=environ,
+                            keep_blank_values=True, **kwargs)
+    for item in form.list:
+        if item.filename:
+            item.file.close()
+        else:
+            item.value
+
+
+def best(func, body, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func(body)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multipart parser benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('%-12s %12s %12s %8s' % ('body', 'cgi', 'cocopot', 'speedup'))
+    for label, body in make_bodies():
+        ours = best(parse_cocopot, body, args.repeat)
+        if cgi is None:
+            print('%-12s %12s %10.2fms' % (label, '-', ours * 1000))
+            continue
+        theirs = best(parse_cgi, body, args.repeat)
+        print('%-12s %10.2fms %10.2fms %7.1fx' % (label, theirs * 1000, ours * 1000,
+                                                  theirs / ours))
+
+
+if __name__ == '__main__':
+    main()
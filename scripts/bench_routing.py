@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Benchmark `cocopot.routing.Router` with growing route tables.
+
+    Every table mixes static and dynamic rules the way a versioned
+    REST API does.  For each router mode the time to add all rules, the
+    match latency of the first, middle and last rule and of a path nobody
+    registered, and the memory held by the router are measured.  With
+    `--json` the results, including the optional benchmarks, are written
+    as JSON to compare releases.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cocopot
+from cocopot.routing import Router
+from cocopot.exceptions import HTTPException, NotFound
+
+RESOURCES = ['users', 'feeds', 'photos', 'comments', 'likes', 'groups',
+             'events', 'places', 'messages', 'devices']
+
+
+def make_rules(count):
+    """Return `count` (rule, sample_path) tuples, one in four is static."""
+    rules = []
+    for i in range(count):
+        version = 'v%d' % (i % 3 + 1)
+        resource = '%s%d' % (RESOURCES[i % len(RESOURCES)], i // len(RESOURCES))
+        kind = i % 4
+        if kind == 0:
+            rules.append(('/%s/%s' % (version, resource),
+                          '/%s/%s' % (version, resource)))
+        elif kind == 1:
+            rules.append(('/%s/%s/<int:id>' % (version, resource),
+                          '/%s/%s/42' % (version, resource)))
+        elif kind == 2:
+            rules.append(('/%s/%s/<int:id>/<name>' % (version, resource),
+                          '/%s/%s/42/feed' % (version, resource)))
+        else:
+            rules.append(('/%s/%s/<path:rest>' % (version, resource),
+                          '/%s/%s/a/b/c' % (version, resource)))
+    return rules
+
+
+def build(mode, rules, methods=('GET',), cache_file=None, prefix_depth=2):
+    router = Router(mode=mode, cache_file=cache_file, prefix_depth=prefix_depth)
+    for i, (rule, _) in enumerate(rules):
+        for method in methods:
+            router.add(rule, 'endpoint%d' % i, methods=[method])
+    return router
+
+
+def measure_memory(mode, rules, prefix_depth):
+    """Build a router, return it and the bytes it allocated (or None)."""
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    router = build(mode, rules, prefix_depth=prefix_depth)
+    # Compile the lazily built indexes, they are part of the footprint.
+    try:
+        router.match('/')
+    except HTTPException:
+        pass
+    memory = None
+    if tracemalloc is not None:
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return router, memory
+
+
+def bench_scaling(modes, sizes, number, prefix_depth):
+    """Return a result dict per mode and table size."""
+    results = []
+    for mode in modes:
+        for size in sizes:
+            rules = make_rules(size)
+            # Building is timed separately, tracemalloc slows it down.
+            start = time.time()
+            build(mode, rules, prefix_depth=prefix_depth)
+            build_seconds = time.time() - start
+            router, memory = measure_memory(mode, rules, prefix_depth)
+            # Static rules are a dict lookup in every mode, so time the
+            # dynamic rules closest to the first, middle and last position.
+            dynamic = [path for rule, path in rules if '<' in rule]
+            paths = [('first', dynamic[0]),
+                     ('middle', dynamic[len(dynamic) // 2]),
+                     ('last', dynamic[-1]),
+                     ('404', '/v1/nothing/here')]
+            results.append({
+                'mode': mode,
+                'routes': size,
+                'build_ms': build_seconds * 1000,
+                'match_us': dict((name, time_match(router, path, number) * 1e6)
+                                 for name, path in paths),
+                'memory_kb': memory / 1024.0 if memory is not None else None,
+            })
+    return results
+
+
+def print_scaling(results, out=sys.stdout):
+    print('%-8s %7s %10s %10s %10s %10s %10s %10s' %
+          ('mode', 'routes', 'build', 'first', 'middle', 'last', '404', 'memory'),
+          file=out)
+    for r in results:
+        us = r['match_us']
+        memory = '%8.0fkB' % r['memory_kb'] if r['memory_kb'] is not None else '-'
+        print('%-8s %7d %8.1fms %8.2fus %8.2fus %8.2fus %8.2fus %10s' %
+              (r['mode'], r['routes'], r['build_ms'], us['first'],
+               us['middle'], us['last'], us['404'], memory), file=out)
+
+
+def time_match(router, path, number):
+    def run():
+        try:
+            router.match(path)
+        except NotFound:
+            pass
+    return min(timeit.repeat(run, number=number, repeat=3)) / number
+
+
+def time_mixed(router, requests, number):
+    """Average latency of a request out of a mixed GET/POST/PUT stream."""
+    def run():
+        for path, method in requests:
+            try:
+                router.match(path, method)
+            except HTTPException:
+                pass
+    return min(timeit.repeat(run, number=number, repeat=3)) / number / len(requests)
+
+
+def bench_mixed(modes, sizes, number):
+    """Return a result dict per mode and table size."""
+    methods = ['GET'] * 14 + ['POST'] * 4 + ['PUT'] * 2
+    results = []
+    for mode in modes:
+        for size in sizes:
+            rules = make_rules(size)
+            router = build(mode, rules, methods=('GET', 'POST'))
+            requests = []
+            for i in range(len(methods)):
+                _, path = rules[(i * 7919) % len(rules)]
+                requests.append((path, methods[i]))
+            results.append({
+                'mode': mode,
+                'routes': size,
+                'request_us': time_mixed(router, requests, max(1, number // 20)) * 1e6,
+            })
+    return results
+
+
+def print_mixed(results, out=sys.stdout):
+    print(file=out)
+    print('Mixed traffic: 70% GET, 20% POST, 10% PUT (rules only allow GET and POST)',
+          file=out)
+    print('%-8s %7s %10s' % ('mode', 'routes', 'request'), file=out)
+    for r in results:
+        print('%-8s %7d %8.2fus' % (r['mode'], r['routes'], r['request_us']), file=out)
+
+
+def bench_build(sizes, number):
+    """Time `Router.build` the way a JSON listing builds its links: one
+    static link, one resource link and one paginated link per item.
+    Return a result dict per table size."""
+    results = []
+    for size in sizes:
+        rules = make_rules(size)
+        router = build('tree', rules)
+        last = (len(rules) - 2) // 4 * 4  # last static rule with a successor
+        static = 'endpoint%d' % last
+        resource = 'endpoint%d' % (last + 1)
+        timings = [
+            ('static', lambda: router.build(static)),
+            ('resource', lambda: router.build(resource, id=42)),
+            ('paginated', lambda: router.build(resource, id=42, page=3, limit=20)),
+        ]
+        us = dict((name, min(timeit.repeat(f, number=number, repeat=3)) / number * 1e6)
+                  for name, f in timings)
+        results.append({
+            'routes': size,
+            'build_us': us,
+            # 1000 items, so microseconds per item are ms in total
+            'request_ms': sum(us.values()),
+        })
+    return results
+
+
+def print_build(results, out=sys.stdout):
+    print(file=out)
+    print('Router.build, 1000 items with 3 links each', file=out)
+    print('%7s %10s %10s %10s %10s' % ('routes', 'static', 'resource', 'paginated', 'request'),
+          file=out)
+    for r in results:
+        us = r['build_us']
+        print('%7d %8.2fus %8.2fus %8.2fus %8.2fms' %
+              (r['routes'], us['static'], us['resource'], us['paginated'],
+               r['request_ms']), file=out)
+
+
+def bench_startup(sizes):
+    """Compare building a router from scratch with loading the compiled
+    rules from a cache file, like a freshly started worker does.  Return a
+    result dict per table size."""
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            rules = make_rules(size)
+            cache_file = os.path.join(tmpdir, 'routes%d.json' % size)
+            build('tree', rules, cache_file=cache_file).save()
+            # Patterns are memoized by the re module, so purge them first.
+            re.purge()
+            start = time.time()
+            build('tree', rules)
+            compiled = time.time() - start
+            re.purge()
+            start = time.time()
+            build('tree', rules, cache_file=cache_file)
+            cached = time.time() - start
+            results.append({
+                'routes': size,
+                'compile_ms': compiled * 1000,
+                'cached_ms': cached * 1000,
+            })
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def print_startup(results, out=sys.stdout):
+    print(file=out)
+    print('Router startup', file=out)
+    print('%7s %10s %10s' % ('routes', 'compile', 'cached'), file=out)
+    for r in results:
+        print('%7d %8.1fms %8.1fms' % (r['routes'], r['compile_ms'], r['cached_ms']),
+              file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Router benchmark runner')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000])
+    parser.add_argument('-m', '--modes', nargs='+', default=list(Router.modes),
+                        choices=Router.modes)
+    parser.add_argument('-n', '--number', type=int, default=2000)
+    parser.add_argument('-d', '--prefix-depth', type=int, default=2,
+                        help='literal segments regexp rules are dispatched on')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results as JSON, - for stdout')
+    parser.add_argument('--mixed', action='store_true',
+                        help='also time a mixed GET/POST/PUT request stream')
+    parser.add_argument('--build', action='store_true',
+                        help='also time building URLs with Router.build')
+    parser.add_argument('--startup', action='store_true',
+                        help='also time building a router with and without '
+                             'a route cache file')
+    args = parser.parse_args()
+
+    # The tables go to stderr when the JSON report goes to stdout.
+    out = sys.stderr if args.json == '-' else sys.stdout
+    report = {
+        'cocopot': cocopot.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'prefix_depth': args.prefix_depth,
+        'number': args.number,
+        'results': bench_scaling(args.modes, args.sizes, args.number, args.prefix_depth),
+    }
+    print_scaling(report['results'], out)
+    if args.mixed:
+        report['mixed'] = bench_mixed(args.modes, args.sizes, args.number)
+        print_mixed(report['mixed'], out)
+    if args.build:
+        report['build'] = bench_build(args.sizes, args.number)
+        print_build(report['build'], out)
+    if args.startup:
+        report['startup'] = bench_startup(args.sizes)
+        print_startup(report['startup'], out)
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
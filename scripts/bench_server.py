@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Load test the built-in server of `cocopot.run`.
+
+    The `io` workload calls a view that waits for I/O, once single threaded
+    and then with thread pools of growing size.  The `cpu` workload calls a
+    view building a JSON document with pre-forked servers of growing size
+    (`--processes`), it only scales up to the number of cores.  The
+    `keepalive` workload calls a small view over keep-alive connections,
+    served by `wsgiref`, which closes them after every response, and by the
+    event-driven `cocopot.server.HTTPServer`, both with `--pool-size` threads.
+
+    The load generator runs `--clients` threads, spread over
+    `--client-processes` processes, each sending requests as fast as it
+    can, over a new connection for every request except for `keepalive`.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cocopot
+from cocopot.run import make_server, PreforkServer
+
+
+def make_app(io_seconds):
+    app = cocopot.Cocopot('bench')
+
+    @app.route('/io')
+    def io():
+        time.sleep(io_seconds)
+        return 'done'
+
+    @app.route('/hello')
+    def hello():
+        return 'Hello World!'
+
+    @app.route('/cpu')
+    def cpu():
+        items = [{'id': i, 'name': 'item %d' % i, 'tags': ['a', 'b'], 'score': i * 0.5}
+                 for i in range(200)]
+        return json.dumps({'items': items, 'total': len(items)})
+
+    return app
+
+
+def get(port, path):
+    """A minimal HTTP/1.0 GET, returns the status line."""
+    s = socket.create_connection(('127.0.0.1', port))
+    try:
+        s.sendall(('GET %s HTTP/1.0\r\nHost: localhost\r\n\r\n' % path).encode('latin-1'))
+        data = b''
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        return data.split(b'\r\n', 1)[0]
+    finally:
+        s.close()
+
+
+def client_process(port, path, clients, deadline, keep_alive, results):
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+
+    def client(i):
+        conn = HTTPConnection('127.0.0.1', port)
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                if keep_alive:
+                    conn.request('GET', path)
+                    r = conn.getresponse()
+                    r.read()
+                    ok = r.status == 200
+                else:
+                    ok = get(port, path).endswith(b'200 OK')
+            except (socket.error, IOError):
+                conn.close()
+                ok = False
+            if ok:
+                latencies[i].append(time.time() - start)
+            else:
+                errors[i] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put((sum(latencies, []), sum(errors)))
+
+
+def load(port, path, clients, seconds, processes, keep_alive=False):
+    """Returns the requests per second, the 99th percentile of the latency
+    and the errors of `clients` threads in `processes` processes sending
+    requests for `seconds`."""
+    results = multiprocessing.Queue()
+    start = time.time()
+    deadline = start + seconds
+    procs = [multiprocessing.Process(target=client_process, args=(
+        port, path, max(1, clients // processes), deadline, keep_alive, results))
+        for _ in range(processes)]
+    for p in procs:
+        p.start()
+    done = [results.get() for p in procs]
+    for p in procs:
+        p.join()
+    latencies = sorted(sum((l for l, _ in done), []))
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+    return len(latencies) / (time.time() - start), p99, sum(e for _, e in done)
+
+
+class ThreadedServer(object):
+    def __init__(self, app, **options):
+        self.srv = make_server('127.0.0.1', 0, app, **options)
+        self.port = self.srv.server_port
+        self.thread = threading.Thread(target=self.srv.serve_forever)
+        self.thread.start()
+
+    def stop(self):
+        self.srv.shutdown()
+        self.srv.server_close()
+        self.thread.join()
+
+
+class ForkedServer(object):
+    def __init__(self, app, **options):
+        server = PreforkServer('127.0.0.1', 0, app, **options)
+        self.port = server.port
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        server.close()
+        time.sleep(0.5)  # let the workers start
+
+    def stop(self):
+        os.kill(self.pid, signal.SIGTERM)
+        os.waitpid(self.pid, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Built-in server load test')
+    parser.add_argument('workload', nargs='?', default='io',
+                        choices=['io', 'cpu', 'keepalive'])
+    parser.add_argument('-c', '--clients', type=int, default=64)
+    parser.add_argument('--client-processes', type=int, default=1)
+    parser.add_argument('-s', '--seconds', type=float, default=3.0)
+    parser.add_argument('--io-ms', type=float, default=20.0,
+                        help='time the io view waits for I/O')
+    parser.add_argument('--pool-sizes', default='1,4,16,64',
+                        help='comma separated thread pool sizes for io')
+    parser.add_argument('--pool-size', type=int, default=8,
+                        help='thread pool size for keepalive')
+    parser.add_argument('--processes', default='1,2,4',
+                        help='comma separated process counts for cpu')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='let the processes listen with SO_REUSEPORT')
+    args = parser.parse_args()
+
+    app = make_app(args.io_ms / 1000.0)
+    path = '/' + args.workload
+    if args.workload == 'io':
+        configs = [('single threaded', ThreadedServer, {})]
+        configs += [('pool_size=%s' % n, ThreadedServer, {'pool_size': int(n)})
+                    for n in args.pool_sizes.split(',')]
+    elif args.workload == 'cpu':
+        configs = [('processes=%s' % n, ForkedServer,
+                    {'processes': int(n), 'reuse_port': args.reuse_port})
+                   if int(n) > 1 else ('processes=1', ThreadedServer, {})
+                   for n in args.processes.split(',')]
+    else:
+        path = '/hello'
+        configs = [('wsgiref', ThreadedServer, {'pool_size': args.pool_size}),
+                   ('keep_alive', ThreadedServer,
+                    {'pool_size': args.pool_size, 'keep_alive': True})]
+    print('%-18s %10s %10s %8s' % ('server', 'req/s', 'p99', 'errors'))
+    for label, server_class, options in configs:
+        server = server_class(app, **options)
+        try:
+            rps, p99, errors = load(server.port, path, args.clients, args.seconds,
+                                    args.client_processes,
+                                    keep_alive=args.workload == 'keepalive')
+        finally:
+            server.stop()
+        print('%-18s %10.0f %8.1fms %8d' % (label, rps, p99 * 1000, errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # these use async def
+    collect_ignore.extend(['test_asgi.py', 'test_coroutines.py'])
+try:
+    import selectors
+except ImportError:
+    try:
+        import selectors34
+    except ImportError:
+        collect_ignore.append('test_server.py')
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import pytest
 
-from cocopot import Cocopot, Blueprint, request, g, abort
+from cocopot import Cocopot, Blueprint, request, g, abort, url_for
 from cocopot._compat import to_bytes
 from cocopot.request import Request
 from cocopot.app import RequestContextGlobals, RequestContext
@@ -276,3 +276,240 @@ def test_unicode_route():
     r = c.open(u'/地球')
     assert r[0] == to_bytes(u'你好地球')
     assert r[1] == '200 OK'
+
+def test_freeze():
+    app = Cocopot()
+    calls = []
+
+    @app.before_request
+    def app_before():
+        calls.append('app_before')
+
+    @app.teardown_request
+    def app_teardown(exc):
+        calls.append('app_teardown')
+
+    @app.route('/hello')
+    def hello():
+        return 'ok'
+
+    bp = Blueprint('foo', url_prefix='/foo')
+
+    @bp.before_request
+    def bp_before():
+        calls.append('bp_before')
+
+    @bp.after_request
+    def bp_after(resp):
+        calls.append('bp_after')
+        return resp
+
+    @bp.teardown_request
+    def bp_teardown(exc):
+        calls.append('bp_teardown')
+
+    @bp.route('/bar')
+    def bar():
+        return 'bar'
+
+    app.register_blueprint(bp)
+    hooks = app.freeze()
+    assert hooks['hello'] == ((app_before,), (), (app_teardown,))
+    assert hooks['foo.bar'] == ((app_before, bp_before), (bp_after,),
+                                (app_teardown, bp_teardown))
+
+    env = copy.deepcopy(env1)
+    assert app(env, start_response)[0] == b'bar'
+    assert calls == ['app_before', 'bp_before', 'bp_after',
+                     'app_teardown', 'bp_teardown']
+
+    @app.after_request
+    def app_after(resp):
+        calls.append('app_after')
+        return resp
+
+    assert app.request_hooks is None
+    del calls[:]
+    env = copy.deepcopy(env1)
+    env['PATH_INFO'] = '/hello'
+    assert app(env, start_response)[0] == b'ok'
+    assert calls == ['app_before', 'app_after', 'app_teardown']
+    assert app.request_hooks['hello'][1] == (app_after,)
+
+def test_error_handler_cache():
+    app = Cocopot()
+
+    class DatabaseError(Exception):
+        pass
+
+    class Timeout(DatabaseError):
+        pass
+
+    @app.errorhandler(DatabaseError)
+    def database_error(e):
+        return 'database'
+
+    @app.errorhandler(404)
+    def not_found(e):
+        return 'missing'
+
+    @app.route('/timeout')
+    def timeout():
+        raise Timeout()
+
+    @app.route('/key')
+    def key():
+        raise KeyError('key')
+
+    bp = Blueprint('api', url_prefix='/api')
+
+    @bp.errorhandler(Timeout)
+    def api_timeout(e):
+        return 'api timeout'
+
+    @bp.route('/timeout')
+    def api_timeout_view():
+        raise Timeout()
+
+    @bp.route('/missing')
+    def api_missing():
+        abort(404)
+
+    app.register_blueprint(bp)
+    client = CocopotClient(app)
+    for _ in range(2):
+        assert client.open('/timeout')[0] == b'database'
+        assert client.open('/api/timeout')[0] == b'api timeout'
+        assert client.open('/api/missing')[0] == b'missing'
+        assert client.open('/key')[1] == '500 Internal Server Error'
+    assert app.error_handler_cache == {
+        (None, Timeout): database_error,
+        ('api', Timeout): api_timeout,
+        ('api', 404): not_found,
+        (None, KeyError): None,
+    }
+
+    @app.errorhandler(LookupError)
+    def lookup_error(e):
+        return 'lookup'
+
+    assert app.error_handler_cache == {}
+    assert client.open('/key')[0] == b'lookup'
+    assert client.open('/timeout')[0] == b'database'
+
+def test_method_dispatch():
+    app = Cocopot()
+
+    @app.route('/item/<int:id>')
+    def get_item(id):
+        return 'get %d' % id
+
+    @app.route('/item/<int:id>', methods=['POST'])
+    def post_item(id):
+        return 'post %d' % id
+
+    c = CocopotClient(app)
+    assert c.open('/item/1')[0] == b'get 1'
+    assert c.open('/item/1', method='POST')[0] == b'post 1'
+    r = c.open('/item/1', method='PUT')
+    assert r[1] == '405 Method Not Allowed'
+    assert ('Allow', 'GET, HEAD, POST') in r[2]
+    body, status, headers = c.open('/item/1', method='HEAD')
+    assert (body, status) == (b'', '200 OK')
+    assert ('Content-Length', '5') in headers
+
+def test_url_for():
+    app = Cocopot()
+    bp = Blueprint('admin', url_prefix='/admin')
+
+    @app.route('/')
+    def index():
+        return url_for('index', _external=True)
+
+    @app.route('/user/<int:id>')
+    def user(id):
+        return url_for('user', id=id + 1, page=2)
+
+    @bp.route('/users')
+    def users():
+        return url_for('.users') + ' ' + url_for('index')
+
+    app.register_blueprint(bp)
+    c = CocopotClient(app)
+    assert c.open('/')[0] == b'http://localhost/'
+    assert c.open('/user/1')[0] == b'/user/2?page=2'
+    assert c.open('/admin/users')[0] == b'/admin/users /'
+    with pytest.raises(RuntimeError):
+        url_for('index')
+
+
+def test_body_limits():
+    from cocopot._compat import BytesIO
+    app = Cocopot('test')
+    app.config['body_spool_size'] = 16
+    app.config['max_content_length'] = 1000
+    bp = Blueprint('bp', url_prefix='/bp')
+
+    def body_info():
+        data = request.get_data()
+        return '%d %s' % (len(data), request.stream._rolled)
+    app.route('/upload', methods=['POST'])(body_info)
+    app.route('/big', methods=['POST'], endpoint='big', max_content_length=None,
+              body_spool_size=4096)(body_info)
+    bp.route('/small', methods=['POST'], max_content_length=10)(body_info)
+    app.register_blueprint(bp)
+
+    c = CocopotClient(app)
+    post = lambda path, size: c.open(path, method='POST', input_stream=BytesIO(b'x' * size))
+    assert post('/upload', 100)[0] == b'100 True'
+    assert post('/upload', 10)[0] == b'10 False'
+    assert post('/upload', 1001)[1] == '413 Request Entity Too Large'
+    assert post('/big', 2000)[0] == b'2000 False'
+    assert post('/big', 5000)[0] == b'5000 True'
+    assert post('/bp/small', 11)[1] == '413 Request Entity Too Large'
+    assert post('/bp/small', 10)[0] == b'10 False'
+
+
+def test_max_content_length():
+    from cocopot._compat import BytesIO
+    app = Cocopot('test')
+    app.config['max_content_length'] = 100
+    bp = Blueprint('bp', url_prefix='/bp', max_content_length=10)
+    hooks = []
+
+    @app.before_request
+    def before():
+        hooks.append(request.path)
+
+    def size():
+        return str(len(request.get_data()))
+    app.route('/upload', methods=['POST'])(size)
+    bp.route('/small', methods=['POST'], endpoint='small')(size)
+    bp.route('/large', methods=['POST'], endpoint='large', max_content_length=1000)(size)
+    app.register_blueprint(bp)
+
+    c = CocopotClient(app)
+    post = lambda path, size: c.open(path, method='POST', input_stream=BytesIO(b'x' * size))
+    assert post('/upload', 101)[1] == '413 Request Entity Too Large'
+    assert post('/bp/small', 11)[1] == '413 Request Entity Too Large'
+    assert post('/bp/large', 101)[0] == b'101'
+    assert hooks == ['/bp/large']
+
+    chunked = BytesIO(b'a\r\nxxxxxxxxxx\r\n' * 11 + b'0\r\n\r\n')
+    rv = c.open('/upload', method='POST', input_stream=chunked,
+                headers={'Transfer-Encoding': 'chunked'})
+    assert rv[1] == '413 Request Entity Too Large'
+    assert chunked.tell() < 11 * 15
+
+
+def test_blueprint_max_content_length_per_app():
+    from cocopot._compat import BytesIO
+    bp = Blueprint('bp', url_prefix='/bp')
+    bp.route('/upload', methods=['POST'])(lambda: str(len(request.get_data())))
+    small, large = Cocopot('small'), Cocopot('large')
+    small.register_blueprint(bp, max_content_length=10)
+    large.register_blueprint(bp, max_content_length=100)
+    for app, status in ((small, '413 Request Entity Too Large'), (large, '200 OK')):
+        rv = CocopotClient(app).open('/bp/upload', method='POST',
+                                     input_stream=BytesIO(b'x' * 50))
+        assert rv[1] == status
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from cocopot import Cocopot, request, g, abort
+
+
+async def call(app, path, method='GET', body=b'', headers=(), entry=None):
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': b'a=1',
+        'headers': [(b'host', b'test.cocopot.org')] + list(headers),
+        'server': ('test.cocopot.org', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body[:3], 'more_body': True},
+                {'type': 'http.request', 'body': body[3:]}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await (entry or app)(scope, receive, send)
+    assert sent[0]['type'] == 'http.response.start'
+    assert not sent[-1].get('more_body')
+    return (sent[0]['status'], dict(sent[0]['headers']),
+            b''.join(m.get('body', b'') for m in sent[1:]))
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_asgi_app():
+    app = Cocopot()
+    calls = []
+
+    @app.before_request
+    async def before():
+        g.user = 'bob'
+
+    @app.after_request
+    def after(response):
+        response.headers['X-User'] = g.get('user', '')
+        return response
+
+    @app.teardown_request
+    async def teardown(exc):
+        calls.append(request.path)
+
+    @app.route('/sync')
+    def sync_view():
+        return 'sync %s %s' % (request.args['a'], g.user)
+
+    @app.route('/async/<name>')
+    async def async_view(name):
+        await asyncio.sleep(0)
+        return 'async %s' % name
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return request.get_data()
+
+    @app.route('/fail')
+    async def fail():
+        abort(403)
+
+    @app.errorhandler(403)
+    async def forbidden(e):
+        return 'forbidden'
+
+    status, headers, body = run(call(app, '/sync'))
+    assert (status, body) == (200, b'sync 1 bob')
+    assert headers[b'x-user'] == b'bob'
+    assert run(call(app, '/async/x'))[2] == b'async x'
+    assert run(call(app, '/echo', 'POST', b'hello world'))[2] == b'hello world'
+    assert run(call(app, '/fail'))[2] == b'forbidden'
+    assert run(call(app, '/missing'))[0] == 404
+    assert run(call(app, '/echo'))[0] == 405
+    status, _, body = run(call(app, '/sync', 'HEAD'))
+    assert (status, body) == (200, b'')
+    assert calls == ['/sync', '/async/x', '/echo', '/fail', '/missing',
+                     '/echo', '/sync']
+
+
+def test_asgi_concurrency():
+    app = Cocopot()
+
+    @app.route('/poll/<int:n>')
+    async def poll(n):
+        g.n = n
+        await asyncio.sleep(0.01)
+        return '%s %s' % (request.path, g.n)
+
+    async def many():
+        return await asyncio.gather(*[call(app, '/poll/%d' % i)
+                                      for i in range(500)])
+
+    results = run(many())
+    assert [r[2] for r in results] == [
+        ('/poll/%d %d' % (i, i)).encode() for i in range(500)]
+    assert app.asgi_handler is not None
+
+
+def test_asgi_max_content_length():
+    app = Cocopot()
+    app.config['max_content_length'] = 5
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return request.get_data()
+
+    assert run(call(app, '/echo', 'POST', b'hello'))[2] == b'hello'
+    assert run(call(app, '/echo', 'POST', b'hello world'))[0] == 413
+    assert run(call(app, '/echo', 'POST', b'hello',
+                    [(b'content-length', b'11')]))[0] == 413
+
+
+def test_asgi_interface():
+    app = Cocopot()
+
+    @app.route('/')
+    def index():
+        return 'index'
+
+    # ASGI servers detecting the interface look for a coroutine function.
+    assert asyncio.iscoroutinefunction(app.asgi_app)
+    assert run(call(app, '/', entry=app.asgi_app))[2] == b'index'
+    # Calling the application with a scope starts the ASGI application.
+    scope = {'type': 'http', 'method': 'GET', 'path': '/'}
+    coro = app(scope, None, None)
+    assert asyncio.iscoroutine(coro)
+    coro.close()
+
+
+def test_asgi_streaming():
+    from cocopot import Response
+    closed = []
+
+    class Body(object):
+        def __iter__(self):
+            yield b'one'
+            yield b''
+            yield b'two'
+
+        def close(self):
+            closed.append(True)
+
+    class StreamingResponse(Response):
+        def __call__(self, environ, start_response):
+            start_response(self.status_line, self.headerlist)
+            return Body()
+
+    app = Cocopot()
+
+    @app.route('/stream')
+    def stream():
+        return StreamingResponse()
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    for method in ('GET', 'HEAD'):
+        del sent[:]
+        scope = {'type': 'http', 'method': method, 'path': '/stream'}
+        run(app(scope, receive, send))
+        assert [m['type'] for m in sent][0] == 'http.response.start'
+        assert [(m.get('body'), m.get('more_body', False)) for m in sent[1:]] == (
+            [(b'one', True), (b'two', True), (b'', False)] if method == 'GET'
+            else [(b'', False)])
+    assert closed == [True, True]
+
+
+def test_asgi_overridden_hooks():
+    calls = []
+
+    class App(Cocopot):
+        def preprocess_request(self):
+            calls.append('before')
+            if request.path == '/blocked':
+                return 'blocked'
+            return super(App, self).preprocess_request()
+
+        def process_response(self, response):
+            calls.append('after')
+            return super(App, self).process_response(response)
+
+        def do_teardown_request(self, exc=None):
+            calls.append('teardown')
+            return super(App, self).do_teardown_request(exc)
+
+    app = App()
+
+    @app.before_request
+    async def before():
+        await asyncio.sleep(0)
+        calls.append('async before')
+
+    @app.after_request
+    async def after(response):
+        calls.append('async after')
+        response.headers['X-After'] = 'yes'
+        return response
+
+    @app.route('/')
+    def index():
+        return 'index'
+
+    @app.route('/blocked')
+    def blocked():
+        return 'view'
+
+    status, headers, body = run(call(app, '/'))
+    assert (body, headers[b'x-after']) == (b'index', b'yes')
+    assert calls == ['before', 'async before', 'after', 'async after', 'teardown']
+    del calls[:]
+    assert run(call(app, '/blocked'))[2] == b'blocked'
+    assert calls == ['before', 'after', 'async after', 'teardown']
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+from cocopot import Cocopot, request, g, abort
+from cocopot.coroutines import shared_loop, _context_ident
+from cocopot.local import LocalStack, ContextVarStack, ContextVar
+from cocopot.testing import CocopotClient
+
+
+def test_coroutine_views():
+    app = Cocopot()
+    torn_down = []
+
+    @app.before_request
+    async def before():
+        await asyncio.sleep(0)
+        g.user = 'bob'
+
+    @app.teardown_request
+    async def teardown(exc):
+        torn_down.append(request.path)
+
+    @app.route('/hello/<name>')
+    async def hello(name):
+        await asyncio.sleep(0.01)
+        return '%s %s %s' % (name, request.args['a'], g.user)
+
+    @app.route('/missing')
+    async def missing():
+        await asyncio.sleep(0)
+        abort(404)
+
+    @app.errorhandler(404)
+    async def not_found(e):
+        return 'not found %s' % request.path
+
+    client = CocopotClient(app)
+    assert client.open('/hello/x', query_string='a=1')[0] == b'x 1 bob'
+    assert client.open('/missing')[0] == b'not found /missing'
+    assert torn_down == ['/hello/x', '/missing']
+
+    results = {}
+
+    def worker(i):
+        results[i] = client.open('/hello/%d' % i, query_string='a=%d' % i)[0]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == dict((i, ('%d %d bob' % (i, i)).encode()) for i in range(20))
+    assert shared_loop() is shared_loop()
+
+
+def test_context_stacks_with_tasks():
+    stacks = [LocalStack()]
+    stacks[0].__ident_func__ = _context_ident
+    if ContextVar is not None:
+        stacks.append(ContextVarStack())
+
+    async def task(stack, i):
+        stack.push(i)
+        await asyncio.sleep(0.001 * (i % 3))
+        top = stack.top
+        stack.pop()
+        return top
+
+    async def many(stack):
+        return await asyncio.gather(*[task(stack, i) for i in range(2000)])
+
+    for stack in stacks:
+        loop = asyncio.new_event_loop()
+        try:
+            assert loop.run_until_complete(many(stack)) == list(range(2000))
+        finally:
+            loop.close()
+        assert stack.top is None
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import threading
+import pytest
+
+pytest.importorskip('concurrent.futures')
+
+from cocopot import Cocopot, request, g, parallel
+from cocopot.testing import CocopotClient
+
+
+def test_parallel():
+    app = Cocopot()
+
+    def backend(name):
+        return lambda: '%s:%s:%s' % (name, request.path, g.user)
+
+    @app.route('/feed')
+    def feed():
+        g.user = 'bob'
+        return ','.join(parallel(backend('a'), backend('b'), backend('c')))
+
+    @app.route('/fail')
+    def fail():
+        g.user = 'bob'
+
+        def broken():
+            raise KeyError('broken')
+        try:
+            parallel(backend('a'), broken)
+        except KeyError:
+            return 'failed'
+
+    @app.route('/map')
+    def map_view():
+        g.user = 'alice'
+        future = app.executor.submit(lambda x: x + g.user, 'hi ')
+        return ','.join(app.executor.map(lambda a, b: a + b, 'ab', 'cd')) + \
+            ' ' + future.result()
+
+    client = CocopotClient(app)
+    assert client.open('/feed')[0] == b'a:/feed:bob,b:/feed:bob,c:/feed:bob'
+    assert client.open('/fail')[0] == b'failed'
+    assert client.open('/map')[0] == b'ac,bd hi alice'
+    with pytest.raises(RuntimeError):
+        parallel(lambda: 1)
+
+
+def test_cancel_at_teardown():
+    app = Cocopot()
+    app.executor_max_workers = 1
+    started, release = threading.Event(), threading.Event()
+    futures = []
+
+    def blocking():
+        started.set()
+        release.wait(5)
+
+    @app.route('/')
+    def index():
+        futures.append(app.executor.submit(blocking))
+        futures.append(app.executor.submit(lambda: request.path))
+        started.wait(5)
+        return 'ok'
+
+    assert CocopotClient(app).open('/')[0] == b'ok'
+    assert futures[1].cancelled()
+    release.set()
+    assert futures[0].result(5) is None
+    app.executor.shutdown()
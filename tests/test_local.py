@@ -1,7 +1,8 @@
 import pytest
 
 from cocopot.http import parse_content_type, parse_auth, parse_date, http_date, html_quote, parse_range_header
-from cocopot.local import LocalStack, LocalProxy
+import threading
+from cocopot.local import LocalStack, LocalProxy, ContextVarStack, ContextVar, make_stack
 from cocopot._compat import PY2
 import copy
 import time
@@ -22,6 +23,32 @@ def test_localstack():
     assert s.pop() == None
 
 
+@pytest.mark.skipif(ContextVar is None, reason='needs contextvars')
+def test_contextvarstack():
+    s = ContextVarStack()
+    assert s.top is None
+    assert s.pop() is None
+    s.push(42)
+    s.push(23)
+    assert s.top == 23
+    seen = []
+    t = threading.Thread(target=lambda: seen.append((s.top, s.push(1), s.top)))
+    t.start()
+    t.join()
+    assert seen == [(None, (1,), 1)]
+    assert s.pop() == 23
+    assert s.pop() == 42
+    assert s.top is None
+    assert isinstance(make_stack('contextvar'), ContextVarStack)
+
+
+def test_make_stack():
+    assert isinstance(make_stack('local'), LocalStack)
+    assert isinstance(make_stack(), ContextVarStack if ContextVar else LocalStack)
+    with pytest.raises(ValueError):
+        make_stack('thread')
+
+
 def test_localproxy():
     class Foo(object):
         pass
@@ -48,3 +75,14 @@ def test_localproxy():
 
     if PY2:
         assert unicode(p) == repr(p)
+
+def test_localproxy_introspection():
+    from cocopot import request, g
+    for p in (request, g, LocalProxy(object(), 'notexist')):
+        assert p.__module__ == 'cocopot.local'
+        assert p.__doc__ == LocalProxy.__doc__
+        assert 'unbound>' in p.__repr__()
+        assert p.__slots__ == LocalProxy.__slots__
+        assert p.__weakref__ is None
+    with pytest.raises(RuntimeError):
+        request.args
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import sys
+import logging
+
+from cocopot import Cocopot
+from cocopot.reporting import ExceptionReporter
+from cocopot.testing import CocopotClient
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(name):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    return logger, handler
+
+
+def exc_info(exc):
+    try:
+        raise exc
+    except Exception:
+        return sys.exc_info()
+
+
+def test_rate_limit():
+    logger, handler = make_logger('cocopot.test.ratelimit')
+    reporter = ExceptionReporter(logger, limit=2, interval=3600)
+    for i in range(5):
+        reporter.report(exc_info(KeyError(i)), 'Error %d', (i,))
+    assert reporter.report(exc_info(ValueError()), 'Error')
+    assert [r.getMessage() for r in handler.records] == ['Error 0', 'Error 1', 'Error']
+    assert reporter.counts == {KeyError: 5, ValueError: 1}
+
+    reporter.interval = 0
+    assert reporter.report(exc_info(KeyError(5)), 'Error %d', (5,))
+    assert handler.records[-1].getMessage() == 'Error 5 (3 similar errors suppressed)'
+    assert handler.records[-1].exc_info[0] is KeyError
+
+    reporter.reset()
+    assert reporter.counts == {}
+
+
+def test_disabled_level():
+    logger, handler = make_logger('cocopot.test.disabled')
+    logger.setLevel(logging.CRITICAL)
+    reporter = ExceptionReporter(logger)
+    assert not reporter.report(exc_info(KeyError()), 'Error')
+    assert handler.records == []
+    assert reporter.counts == {KeyError: 1}
+
+
+def test_app_reporting():
+    app = Cocopot('cocopot.test.app')
+    app.logger.propagate = False
+    handler = ListHandler()
+    app.logger.addHandler(handler)
+
+    @app.route('/fail')
+    def fail():
+        raise KeyError('fail')
+
+    client = CocopotClient(app)
+    assert client.open('/missing')[1] == '404 Not Found'
+    assert handler.records == []
+    assert client.open('/fail')[1] == '500 Internal Server Error'
+    assert len(handler.records) == 1
+    assert handler.records[0].getMessage() == 'Exception on /fail [GET]'
+    assert handler.records[0].levelno == logging.ERROR
+    assert app.exception_reporter.counts == {KeyError: 1}
@@ -149,6 +149,53 @@ Content-Type: text/html
     assert req.close() == None
 
 
+def test_multipart_spool():
+    boundary = 'b0und"ary'
+    photo = b'\r\n--b0und\r\n' * 10000
+    form_data = b'\r\n'.join([
+        b'--b0und"ary',
+        b'Content-Disposition: form-data; name="caption"',
+        b'',
+        b'caf\xc3\xa9',
+        b'--b0und"ary',
+        b'Content-Disposition: form-data; name="photo"; filename="p.jpg"',
+        b'Content-Type: image/jpeg',
+        b'',
+        photo,
+        b'--b0und"ary',
+        b'Content-Disposition: form-data; name="empty"; filename=""',
+        b'',
+        b'',
+        b'--b0und"ary--',
+        b''])
+    env = dict(copy.deepcopy(env1))
+    env['CONTENT_TYPE'] = 'multipart/form-data; boundary="b0und\\"ary"'
+    env['wsgi.input'] = BytesIO(form_data)
+    env['CONTENT_LENGTH'] = str(len(form_data))
+    req = Request(env)
+    req.form_spool_size = 1024
+    assert req.form['caption'] == to_native(u'caf\xe9')
+    assert req.form['empty'] == ''
+    photo_upload = req.files['photo']
+    assert photo_upload.content_type == 'image/jpeg'
+    assert photo_upload.file._rolled
+    assert photo_upload.file.read() == photo
+
+
+def test_multipart_errors():
+    for form_data, content_type in [
+            (b'--abc\r\nContent-Disposition: form-data; name="a"\r\n\r\nno end', 'boundary=abc'),
+            (b'no boundary at all', 'boundary=abc'),
+            (b'--abc\r\nbroken header\r\n\r\nx\r\n--abc--', 'boundary=abc'),
+            (b'--abc--', '')]:
+        env = dict(copy.deepcopy(env1))
+        env['CONTENT_TYPE'] = 'multipart/form-data; ' + content_type
+        env['wsgi.input'] = BytesIO(form_data)
+        env['CONTENT_LENGTH'] = str(len(form_data))
+        with pytest.raises(BadRequest):
+            Request(env).form
+
+
 def _test_chunked(body, expect):
     env = dict(copy.deepcopy(env1))
     env['wsgi.input'] = BytesIO(to_bytes(body))
@@ -175,6 +222,36 @@ def test_chunked():
     _test_chunked('2\r\nx\r\n', BadRequest)
     _test_chunked('x\r\nx\r\n', BadRequest)
     _test_chunked('abcdefg', BadRequest)
+    _test_chunked('-8\r\nxxxxxxxx\r\n0\r\n', BadRequest)
+    _test_chunked('8\r\nxxxxxxxx\r\n0\r\nX-Sum: 1\r\nX-Other:\r\n\r\n', 'xxxxxxxx')
+    _test_chunked('8\r\nxxxxxxxx\r\n0\r\nno colon\r\n\r\n', BadRequest)
+    _test_chunked('8\r\nxxxxxxxx\r\n0\r\nContent-Length: 8\r\n\r\n', BadRequest)
+
+def test_chunked_reads():
+    # The decoder must not read past the body: on a connection that would
+    # wait for data the client never sends.
+    body = b'400\r\n' + b'x' * 1024 + b'\r\n1\r\ny\r\n10000\r\n' + b'z' * 65536 + \
+        b'\r\n0\r\nX-Sum: 1\r\n\r\n'
+    stream = BytesIO(body + b'GET / HTTP/1.1\r\n')
+    req = Request({'wsgi.input': stream, 'HTTP_TRANSFER_ENCODING': 'chunked'})
+    parts = list(req.iter_chunked(stream.read, 4096))
+    assert stream.tell() == len(body)
+    assert b''.join(bytes(p) for p in parts) == b'x' * 1024 + b'y' + b'z' * 65536
+    assert max(len(p) for p in parts) <= 4096
+
+    # Reads returning less than asked for must not take the next request.
+    for data in (body, b'3\r\nabc\r\n0\r\n\r\n'):
+        for most in range(1, 9):
+            stream = BytesIO(data + b'NEXT')
+            read = lambda size: stream.read(min(size, most))
+            parts = list(req.iter_chunked(read, 4096))
+            assert stream.read() == b'NEXT'
+
+    # read1-like reads return less than asked for.
+    stream = BytesIO(body)
+    parts = list(req.iter_chunked(lambda size: stream.read(min(size, 3)), 4096,
+                                  partial_reads=True))
+    assert b''.join(bytes(p) for p in parts) == b'x' * 1024 + b'y' + b'z' * 65536
 
 def test_auth():
     user, pwd = 'marc', 'secret'
@@ -250,3 +327,64 @@ def test_json_forged_header_issue616():
     env['CONTENT_LENGTH'] = str(len(json.dumps(test)))
     r = Request(env)
     assert r.json == None
+
+def test_body_spool():
+    from cocopot.exceptions import RequestEntityTooLarge
+    from cocopot.request import MEMFILE_MAX
+    body = b'0123456789' * (MEMFILE_MAX // 10 + 1)
+    env = dict(copy.deepcopy(env1))
+    env['wsgi.input'] = BytesIO(body)
+    env['CONTENT_LENGTH'] = str(len(body))
+    req = Request(env)
+    assert req.stream._rolled
+    assert req.get_data() == body
+
+    env = dict(copy.deepcopy(env1))
+    env['wsgi.input'] = BytesIO(b'x' * 100)
+    env['CONTENT_LENGTH'] = '100'
+    req = Request(env)
+    req.max_content_length = 99
+    with pytest.raises(RequestEntityTooLarge):
+        req.get_data()
+
+    env = dict(copy.deepcopy(env1))
+    env['wsgi.input'] = BytesIO(b'5\r\nabcde\r\n5\r\nfghij\r\n0\r\n\r\n')
+    env['HTTP_TRANSFER_ENCODING'] = 'chunked'
+    req = Request(env)
+    req.max_content_length = 9
+    with pytest.raises(RequestEntityTooLarge):
+        req.get_data()
+
+def test_raw_stream():
+    from cocopot.exceptions import RequestEntityTooLarge
+    env = dict(copy.deepcopy(env1))
+    env['wsgi.input'] = BytesIO(b'0123456789 and more')
+    env['CONTENT_LENGTH'] = '10'
+    req = Request(env)
+    assert list(req.iter_body(4)) == [b'0123', b'4567', b'89']
+    assert req.raw_stream.read() == b''
+    assert req.raw_stream.position == 10
+    for attr in ('data', 'form', 'files'):
+        with pytest.raises(RuntimeError):
+            getattr(req, attr)
+    req.close()
+
+    env = dict(copy.deepcopy(env1))
+    env['wsgi.input'] = BytesIO(b'5\r\nabcde\r\n3\r\nfgh\r\n0\r\n\r\n')
+    env['HTTP_TRANSFER_ENCODING'] = 'chunked'
+    req = Request(env)
+    assert req.raw_stream.read(2) == b'ab'
+    assert req.raw_stream.read() == b'cdefgh'
+
+    env['wsgi.input'] = BytesIO(b'5\r\nabcde\r\n3\r\nfgh\r\n0\r\n\r\n')
+    req = Request(env)
+    req.max_content_length = 6
+    with pytest.raises(RequestEntityTooLarge):
+        list(req.iter_body())
+
+    env = dict(copy.deepcopy(env1))
+    env['wsgi.input'] = BytesIO(b'0123456789')
+    env['CONTENT_LENGTH'] = '10'
+    req = Request(env)
+    assert req.data == b'0123456789'
+    assert req.raw_stream.read() == b'0123456789'
@@ -1,6 +1,6 @@
 import pytest
 
-from cocopot.routing import Router
+from cocopot.routing import Router, RouteBuildError
 from cocopot.exceptions import BadRequest, NotFound, MethodNotAllowed
 
 def test_basic_routing():
@@ -44,3 +44,224 @@ def test_default_values():
     r = Router()
     r.add('/<name>', endpoint='index', defaults={'foo': 1234, 'name':'bar'})
     assert r.match('/foo') == ('index', {'name': 'foo', 'foo': 1234})
+
+
+def test_tree_precedence():
+    for mode in Router.modes:
+        r = Router(mode=mode)
+        r.add('/user/<name>', endpoint='name')
+        r.add('/user/<int:uid>', endpoint='uid')
+        r.add('/user/me', endpoint='me')
+        r.add('/<path:rest>', endpoint='rest')
+        r.add('/file/<name>.json', endpoint='json')
+        assert r.match('/user/12') == ('name', {'name': '12'})
+        assert r.match('/user/me') == ('me', {})
+        assert r.match('/file/a.json') == ('rest', {'rest': 'file/a.json'})
+        assert r.match('/a/b/') == ('rest', {'rest': 'a/b/'})
+
+
+def test_tree_fallback():
+    r = Router()
+    r.add_filter('hex', lambda: (r'[0-9a-f]+', lambda x: int(x, 16), None))
+    r.add('/file/<name>.<ext>', endpoint='file')
+    r.add('/color/<hex:color>', endpoint='color')
+    r.add('/color/<name>', endpoint='name')
+    r.add('/<path:p>/edit', endpoint='edit')
+    assert r.match('/file/a.json') == ('file', {'name': 'a', 'ext': 'json'})
+    assert r.match('/color/ff') == ('color', {'color': 255})
+    assert r.match('/color/red') == ('name', {'name': 'red'})
+    assert r.match('/a/b/edit') == ('edit', {'p': 'a/b'})
+    pytest.raises(NotFound, lambda: r.match('/color/'))
+    pytest.raises(NotFound, lambda: r.match('/file/'))
+    pytest.raises(ValueError, lambda: Router(mode='unknown'))
+
+
+def test_tree_replace_rule():
+    r = Router()
+    r.add('/item/<int:id>', endpoint='old')
+    r.add('/item/<int:id>', endpoint='new')
+    assert r.match('/item/3') == ('new', {'id': 3})
+    assert len(r.dynamic_patterns) == 1
+
+
+def test_combined_mode():
+    r = Router(mode='combined')
+    r.add_filter('re', lambda: (r'(ab|cd)+', None, None))
+    for i in range(200):
+        r.add('/item%d/<int:a>/<b>/<c>' % i, endpoint='item%d' % i)
+    r.add('/pair/<re:pair>/<int:n>', endpoint='pair')
+    index = r.method_indexes['GET']
+    assert len(index._build_combined(index.combined_rules)) > 1
+    assert r.match('/item0/1/x/y') == ('item0', {'a': 1, 'b': 'x', 'c': 'y'})
+    assert r.match('/item199/2/x/y') == ('item199', {'a': 2, 'b': 'x', 'c': 'y'})
+    assert r.match('/pair/abcd/3') == ('pair', {'pair': 'abcd', 'n': 3})
+    pytest.raises(NotFound, lambda: r.match('/item0/x/x/y'))
+    r.add('/late/<name>', endpoint='late')
+    assert r.match('/late/x') == ('late', {'name': 'x'})
+
+
+def test_prefix_dispatch():
+    for mode in Router.modes:
+        r = Router(mode=mode)
+        r.add_filter('re', lambda: (r'[a-z]+', None, None))
+        r.add_filter('ver', lambda: (r'v\d+', None, None))
+        r.add('/v1/users/<re:name>', endpoint='user')
+        r.add('/v1/<re:kind>/<int:id>', endpoint='kind')
+        r.add('/<ver:version>/feeds/<int:id>', endpoint='feed')
+        r.add('/v2/users<re:rest>', endpoint='users')
+        index = r.method_indexes['GET']
+        assert index.prefixes == {
+            r.dynamic_patterns[0]: ('', 'v1', 'users'),
+            r.dynamic_patterns[1]: ('', 'v1'),
+            r.dynamic_patterns[2]: ('',),
+            r.dynamic_patterns[3]: ('', 'v2'),
+        }
+        assert r.match('/v1/users/bob') == ('user', {'name': 'bob'})
+        assert r.match('/v1/users/3') == ('kind', {'kind': 'users', 'id': 3})
+        assert r.match('/v1/feeds/3') == ('kind', {'kind': 'feeds', 'id': 3})
+        assert r.match('/v2/feeds/3') == ('feed', {'version': 'v2', 'id': 3})
+        assert r.match('/v2/usersabc') == ('users', {'rest': 'abc'})
+        pytest.raises(NotFound, lambda: r.match('/v3/users/bob'))
+
+
+def test_match_cache():
+    r = Router(cache_size=2)
+    r.add('/user/<int:id>', endpoint='user', defaults={'tab': 'feed'})
+    assert r.match('/user/1') == ('user', {'id': 1, 'tab': 'feed'})
+    endpoint, args = r.match('/user/1')
+    args['id'] = 2
+    assert r.match('/user/1') == ('user', {'id': 1, 'tab': 'feed'})
+    pytest.raises(NotFound, lambda: r.match('/nothing'))
+    pytest.raises(NotFound, lambda: r.match('/nothing'))
+    pytest.raises(MethodNotAllowed, lambda: r.match('/user/1', method='POST'))
+    info = r.cache_info()
+    assert (info['hits'], info['misses'], info['size']) == (3, 3, 2)
+    r.match('/user/3')
+    assert r.cache_info()['evictions'] == 1
+    r.add('/nothing', endpoint='nothing')
+    assert r.cache_info()['size'] == 0
+    assert r.match('/nothing') == ('nothing', {})
+
+
+def test_method_routing():
+    for mode in Router.modes:
+        r = Router(mode=mode)
+        r.add('/item/<int:id>', endpoint='get_item', methods=['GET'])
+        r.add('/item/<int:id>', endpoint='post_item', methods=['POST'])
+        r.add('/item/<name>', endpoint='put_item', methods=['PUT'])
+        r.add('/items', endpoint='list', methods=['GET'])
+        r.add('/items', endpoint='create', methods=['POST'])
+        assert r.match('/item/1') == ('get_item', {'id': 1})
+        assert r.match('/item/1', method='POST') == ('post_item', {'id': 1})
+        assert r.match('/item/1', method='PUT') == ('put_item', {'name': '1'})
+        assert r.match('/items', method='POST') == ('create', {})
+        with pytest.raises(MethodNotAllowed) as e:
+            r.match('/item/1', method='DELETE')
+        assert e.value.valid_methods == ('GET', 'POST', 'PUT')
+        assert ('Allow', 'GET, POST, PUT') in e.value.get_headers()
+        with pytest.raises(MethodNotAllowed) as e:
+            r.match('/items', method='PUT')
+        assert e.value.valid_methods == ('GET', 'POST')
+        pytest.raises(NotFound, lambda: r.match('/nothing', method='DELETE'))
+
+        # Telling a 404 from a 405 takes no second lookup.
+        lookups = []
+        match = r.any_index.match
+        r.any_index.match = lambda path: lookups.append(path) or match(path)
+        pytest.raises(MethodNotAllowed, lambda: r.match('/item/1', method='DELETE'))
+        pytest.raises(NotFound, lambda: r.match('/nothing', method='PUT'))
+        assert lookups == ['/item/1', '/nothing']
+        r.method_indexes = {}  # the 405 does not search them
+        pytest.raises(MethodNotAllowed, lambda: r.match('/item/1', method='DELETE'))
+
+
+def test_allowed_methods():
+    for strict in (False, True):
+        r = Router(strict=strict)
+        r.add('/items', endpoint='list', methods=['GET'])
+        r.add('/<kind>', endpoint='kind', methods=['PUT'])
+        r.add('/files/<path:name>', endpoint='file', methods=['GET'])
+        r.add('/files/<name>/meta', endpoint='meta', methods=['POST'])
+        r.add('/files/<name:re:[a-z]+>.txt', endpoint='text', methods=['PATCH'])
+        r.add('/user/<int:id>', endpoint='user', methods=['GET'])
+        r.add('/user/me', endpoint='me', methods=['POST'])
+        r.add('/user/<int:id>/x', endpoint='other', methods=['DELETE'])
+        assert r.allowed_methods['/items'] == ('GET', 'PUT')
+        for path, allowed in [('/items', ('GET', 'PUT')),
+                              ('/files/a/meta', ('GET', 'PATCH', 'POST')),
+                              ('/user/1', ('GET',))]:
+            with pytest.raises(MethodNotAllowed) as e:
+                r.match(path, method='OPTIONS')
+            assert e.value.valid_methods == allowed
+
+
+def test_build():
+    r = Router()
+    r.add('/', endpoint='index')
+    r.add('/user/<int:id>', endpoint='user')
+    r.add('/user/<int:id>/<tab>', endpoint='user')
+    r.add('/file/<path:name>', endpoint='file', defaults={'name': 'index.html'})
+    assert r.build('index') == '/'
+    assert r.build_cache == {'index': '/'}
+    assert r.build('user', id=3) == '/user/3'
+    assert r.build('user', id='3', tab='feed') == '/user/3/feed'
+    assert r.build('user', id=3, page=2) == '/user/3?page=2'
+    assert r.build('file') == '/file/index.html'
+    assert r.build('file', name='a b/c.txt') == '/file/a%20b/c.txt'
+    pytest.raises(RouteBuildError, lambda: r.build('user'))
+    pytest.raises(RouteBuildError, lambda: r.build('nothing'))
+    pytest.raises(RouteBuildError, lambda: r.build('user', id='x'))
+    pytest.raises(RouteBuildError, lambda: r.build('user', id=None))
+    r.add('/u/<name>', endpoint='u')
+    assert r.build('u', name='a/b') == '/u/a%2Fb'
+    assert r.build('u', name='a b') == '/u/a%20b'
+    r.add('/index', endpoint='other')
+    assert r.build_cache == {}
+
+
+def test_route_cache_file(tmpdir):
+    cache_file = str(tmpdir.join('routes.json'))
+
+    def make_router(compile_allowed=True):
+        r = Router(cache_file=cache_file)
+        if not compile_allowed:
+            def fail(rule):
+                raise AssertionError('compiled %s' % rule)
+            r._compile_rule = fail
+        r.add('/', endpoint='index')
+        r.add('/user/<int:id>', endpoint='user')
+        r.add('/user/<int:id>', endpoint='user_post', methods=['POST'])
+        r.add('/file/<name>.<ext>', endpoint='file')
+        return r
+
+    r = make_router()
+    assert r.match('/user/1') == ('user', {'id': 1})
+    assert not tmpdir.join('routes.json').check()
+    r.freeze()
+    assert r.rule_records is None
+    assert [p.basename for p in tmpdir.listdir()] == ['routes.json']
+    mtime = tmpdir.join('routes.json').mtime()
+
+    r = make_router(compile_allowed=False)
+    assert r.match('/') == ('index', {})
+    assert r.match('/user/1', method='POST') == ('user_post', {'id': 1})
+    assert r.match('/file/a.json') == ('file', {'name': 'a', 'ext': 'json'})
+    assert r.build('user', id=2) == '/user/2'
+    r.freeze()
+    assert tmpdir.join('routes.json').mtime() == mtime
+
+    r = Router(cache_file=cache_file)
+    r.add_filter('int', lambda: (r'\d+', int, None))
+    r.add('/user/<int:id>', endpoint='user')
+    pytest.raises(NotFound, lambda: r.match('/user/-1'))
+
+    r = make_router()
+    r.add('/new/<name>', endpoint='new')
+    assert r.match('/new/x') == ('new', {'name': 'x'})
+    r.freeze()
+    r = make_router(compile_allowed=False)
+    r.add('/new/<name>', endpoint='new')
+
+    tmpdir.join('routes.json').write('garbage')
+    assert make_router().match('/user/1') == ('user', {'id': 1})
+    assert Router().rule_records is None
@@ -66,3 +66,123 @@ def test_run():
     while p.poll() == None:
         os.kill(p.pid, signal.SIGTERM)
         time.sleep(1)
+
+def serve_in_thread(app, **kwargs):
+    from cocopot.run import make_server
+    import threading
+    srv = make_server('127.0.0.1', 0, app, **kwargs)
+    t = threading.Thread(target=srv.serve_forever)
+    t.daemon = True
+    t.start()
+    return srv, t
+
+def test_pool_size():
+    app = Cocopot('test')
+    @app.route('/sleep')
+    def sleep():
+        time.sleep(0.3)
+        return 'ok'
+
+    srv, t = serve_in_thread(app, pool_size=4)
+    import threading
+    results = []
+    clients = [threading.Thread(target=lambda: results.append(fetch(srv.server_port, 'sleep')))
+               for _ in range(4)]
+    start = time.time()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    assert results == [to_bytes('ok')] * 4
+    assert time.time() - start < 1.0
+    assert len(srv._workers) == 4
+    srv.shutdown()
+    srv.server_close()
+    t.join()
+    assert srv._workers == []
+    assert not [th for th in threading.enumerate() if th.name.startswith('cocopot-worker')]
+
+def start_prefork(app, **kwargs):
+    from cocopot.run import PreforkServer
+    server = PreforkServer('127.0.0.1', 0, app, **kwargs)
+    server.poll_interval = 0.05
+    master = os.fork()
+    if master == 0:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    server.close()
+    for i in range(50):
+        if fetch(server.port, 'pid').isdigit():
+            break
+        time.sleep(0.1)
+    return server, master
+
+def stop_prefork(master):
+    os.kill(master, signal.SIGTERM)
+    _, status = os.waitpid(master, 0)
+    assert status == 0
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+@pytest.mark.parametrize('reuse_port', [False, True])
+def test_processes(reuse_port):
+    app = Cocopot('test')
+    @app.route('/pid')
+    def pid():
+        return str(os.getpid())
+
+    server, master = start_prefork(app, processes=2, reuse_port=reuse_port)
+    try:
+        worker = int(fetch(server.port, 'pid'))
+        assert worker != master
+        os.kill(worker, signal.SIGKILL)
+        pids = set()
+        for i in range(100):
+            rv = fetch(server.port, 'pid')
+            if rv.isdigit():
+                pids.add(int(rv))
+            if len(pids) == 2:
+                break
+            time.sleep(0.05)
+        assert worker not in pids
+        assert pids
+    finally:
+        stop_prefork(master)
+    for pid in pids:
+        with pytest.raises(OSError):
+            os.kill(pid, 0)
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_recycle_workers():
+    from cocopot.run import rss_mb
+    app = Cocopot('test')
+    @app.route('/pid')
+    def pid():
+        return str(os.getpid())
+    @app.route('/stats')
+    def stats():
+        s = request.environ['cocopot.supervisor'].stats()
+        return '%(recycled)d %(max_requests)d %(max_rss)d %(died)d' % s
+
+    server, master = start_prefork(app, processes=1, max_requests=3)
+    try:
+        pids = [fetch(server.port, 'pid') for i in range(9)]
+        assert all(pid.isdigit() for pid in pids)
+        assert len(set(pids)) >= 3
+        recycled, max_requests, max_rss, died = fetch(server.port, 'stats').split()
+        assert int(max_requests) >= 2 and int(max_rss) == 0 and int(died) == 0
+    finally:
+        stop_prefork(master)
+
+    if rss_mb() is None:
+        return
+    server, master = start_prefork(app, processes=1, max_rss_mb=1)
+    try:
+        pids = [fetch(server.port, 'pid') for i in range(3)]
+        assert all(pid.isdigit() for pid in pids)
+        assert len(set(pids)) == 3
+        # with the request start_prefork waits with
+        assert fetch(server.port, 'stats').split()[2] == to_bytes('4')
+    finally:
+        stop_prefork(master)
@@ -0,0 +1,179 @@
+import pytest
+
+import socket
+import threading
+import time
+
+from cocopot import Cocopot, request
+from cocopot.run import make_server
+
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+
+@pytest.fixture
+def server():
+    app = Cocopot('test')
+
+    @app.route('/hello')
+    def hello():
+        return 'hello ' + request.args.get('name', '')
+
+    @app.route('/port')
+    def port():
+        return request.environ['REMOTE_PORT']
+
+    @app.route('/size', methods=['POST'])
+    def size():
+        return str(len(request.get_data()))
+
+    @app.route('/small', methods=['POST'], max_content_length=10)
+    def small():
+        return str(len(request.get_data()))
+
+    srv = make_server('127.0.0.1', 0, app, keep_alive=True, pool_size=2)
+    srv.keep_alive_timeout = 0.5
+    t = threading.Thread(target=srv.serve_forever)
+    t.daemon = True
+    t.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+    t.join()
+
+
+def read_all(sock):
+    data = b''
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def test_keep_alive(server):
+    conn = HTTPConnection('127.0.0.1', server.server_port)
+    ports = set()
+    for i in range(3):
+        conn.request('GET', '/port')
+        r = conn.getresponse()
+        assert r.status == 200
+        ports.add(r.read())
+    assert len(ports) == 1
+    conn.request('HEAD', '/hello')
+    r = conn.getresponse()
+    assert r.getheader('Content-Length') == '6'
+    assert r.read() == b''
+    conn.request('POST', '/size', body=b'x' * 200000)
+    assert conn.getresponse().read() == b'200000'
+    conn.request('GET', '/missing')
+    r = conn.getresponse()
+    assert r.status == 404
+    r.read()
+    conn.request('GET', '/hello?name=again')
+    assert conn.getresponse().read() == b'hello again'
+    conn.close()
+
+
+def test_pipelining(server):
+    sock = socket.create_connection(('127.0.0.1', server.server_port))
+    sock.sendall(b'GET /hello?name=1 HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                 b'POST /size HTTP/1.1\r\nHost: localhost\r\nContent-Length: 3\r\n\r\nabc'
+                 b'GET /hello?name=2 HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+    data = read_all(sock)
+    sock.close()
+    assert data.count(b'HTTP/1.1 200 OK') == 3
+    bodies = [part.split(b'HTTP/1.1')[0] for part in data.split(b'\r\n\r\n')[1:]]
+    assert bodies == [b'hello 1', b'3', b'hello 2']
+
+
+def test_http10(server):
+    sock = socket.create_connection(('127.0.0.1', server.server_port))
+    sock.sendall(b'GET /hello HTTP/1.0\r\n\r\n')
+    data = read_all(sock)
+    sock.close()
+    assert data.startswith(b'HTTP/1.1 200 OK')
+    assert b'Connection: close' in data
+
+
+def test_bad_request(server):
+    sock = socket.create_connection(('127.0.0.1', server.server_port))
+    sock.sendall(b'GET /hello\r\n\r\n')
+    assert read_all(sock).startswith(b'HTTP/1.1 400 Bad Request')
+    sock.close()
+
+
+def test_idle_timeout(server):
+    sock = socket.create_connection(('127.0.0.1', server.server_port))
+    start = time.time()
+    assert read_all(sock) == b''
+    assert time.time() - start < 3
+    sock.close()
+
+
+def exchange(server, data):
+    sock = socket.create_connection(('127.0.0.1', server.server_port))
+    sock.sendall(data)
+    data = read_all(sock)
+    sock.close()
+    return data
+
+
+@pytest.mark.parametrize('header, body', [
+    (b'Content_Length: 5', b'hello'),
+    (b'Transfer_Encoding: chunked', b'5\r\nhello\r\n0\r\n\r\n'),
+])
+def test_underscore_header_ignored(server, header, body):
+    data = exchange(server, b'POST /size HTTP/1.1\r\nHost: localhost\r\n' + header +
+                    b'\r\n\r\n' + body + b'GET /hello?name=2 HTTP/1.1\r\n'
+                    b'Host: localhost\r\nConnection: close\r\n\r\n')
+    # The body was not taken for one, and the bytes after it for a request.
+    assert data.startswith(b'HTTP/1.1 200 OK')
+    assert data.split(b'\r\n\r\n')[1].startswith(b'0HTTP/1.1 4')
+    assert data.count(b'200 OK') == 1
+
+
+def test_bad_header_name(server):
+    for name in (b'Bad Name', b'Bad\x00Name', b' Host', b'Host '):
+        data = exchange(server, b'GET /hello HTTP/1.1\r\n' + name + b': x\r\n\r\n')
+        assert data.startswith(b'HTTP/1.1 400 Bad Request')
+
+
+@pytest.mark.parametrize('length', [
+    b'+5', b'-5', b'1_0', b'5 5', b'5,5', b'\x0b5', b'5\x0c', b'0x5', b'',
+])
+def test_bad_content_length(server, length):
+    data = exchange(server, b'POST /size HTTP/1.1\r\nHost: localhost\r\n'
+                    b'Content-Length: ' + length + b'\r\n\r\nhello')
+    assert data.startswith(b'HTTP/1.1 400 Bad Request')
+
+
+def test_content_length_whitespace(server):
+    data = exchange(server, b'POST /size HTTP/1.1\r\nHost: localhost\r\n'
+                    b'Connection: close\r\nContent-Length: \t5 \r\n\r\nhello')
+    assert data.startswith(b'HTTP/1.1 200 OK')
+    assert data.endswith(b'\r\n\r\n5')
+
+
+def test_expect_continue_rejected(server):
+    data = exchange(server, b'POST /small HTTP/1.1\r\nHost: localhost\r\n'
+                    b'Expect: 100-continue\r\nContent-Length: 100\r\n\r\n')
+    assert data.startswith(b'HTTP/1.1 413')
+    assert b'100 Continue' not in data
+
+
+def test_expect_continue(server):
+    sock = socket.create_connection(('127.0.0.1', server.server_port))
+    sock.sendall(b'POST /small HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+                 b'Expect: 100-continue\r\nContent-Length: 5\r\n\r\n')
+    data = b''
+    while not data.endswith(b'\r\n\r\n'):
+        data += sock.recv(1)
+    assert data == b'HTTP/1.1 100 Continue\r\n\r\n'
+    sock.sendall(b'hello')
+    data = read_all(sock)
+    sock.close()
+    assert data.startswith(b'HTTP/1.1 200 OK')
+    assert data.endswith(b'\r\n\r\n5')
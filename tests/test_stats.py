@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import pytest
+import threading
+
+from cocopot import Cocopot, abort
+from cocopot.stats import RouteStats
+from cocopot.testing import CocopotClient
+
+
+def test_route_stats():
+    stats = RouteStats(buckets=(0.01, 0.1))
+    stats.record('a', 200, 0.005)
+    stats.record('a', 404, 0.05)
+    stats.record('a', 500, 1.0)
+    threads = [threading.Thread(target=stats.record, args=('b', 301, 0.001))
+               for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    snapshot = stats.snapshot(['a', 'dead'])
+    assert snapshot['a']['count'] == 3
+    assert snapshot['a']['status'] == {'2xx': 1, '4xx': 1, '5xx': 1}
+    assert snapshot['a']['latency'] == [(10, 1), (100, 1), (None, 1)]
+    assert snapshot['b']['count'] == 4
+    assert snapshot['b']['status'] == {'3xx': 4}
+    assert snapshot['dead']['count'] == 0
+    assert snapshot['dead']['mean_ms'] == 0.0
+    stats.reset()
+    assert stats.snapshot() == {}
+
+
+def test_route_stats_threads():
+    stats = RouteStats()
+    stats.record('a', 200, 0.005)
+    for i in range(50):
+        t = threading.Thread(target=stats.record, args=('b', 200, 0.001))
+        t.start()
+        t.join()
+    # The shards of the threads that exited are folded together.
+    assert len(stats._shards) == 1
+    snapshot = stats.snapshot()
+    assert snapshot['a']['count'] == 1
+    assert snapshot['b']['count'] == 50
+    stats.reset()
+    assert stats.snapshot() == {}
+
+
+def test_app_route_stats():
+    app = Cocopot()
+
+    @app.route('/hello')
+    def hello():
+        return 'ok'
+
+    @app.route('/fail')
+    def fail():
+        abort(403)
+
+    @app.route('/unused')
+    def unused():
+        return 'unused'
+
+    with pytest.raises(RuntimeError):
+        app.route_stats()
+    app.enable_route_stats()
+    c = CocopotClient(app)
+    c.open('/hello')
+    c.open('/hello')
+    c.open('/fail')
+    c.open('/nothing')
+    stats = app.route_stats()
+    assert stats['hello']['count'] == 2
+    assert stats['hello']['status'] == {'2xx': 2}
+    assert sum(n for _, n in stats['hello']['latency']) == 2
+    assert stats['fail']['status'] == {'4xx': 1}
+    assert stats[None]['status'] == {'4xx': 1}
+    assert stats['unused']['count'] == 0